@@ -0,0 +1,70 @@
+"""Mesure de la répartition du solde sur des commandes de plusieurs milliers de lignes.
+
+Compare l'ancien parcours de compute_childcare_amount (float, boucles imbriquées,
+dictionnaire indexé par tuple) avec flatten_cost_details + allocate_balance.
+
+Usage : python benchmarks/bench_allocation.py
+"""
+import random
+import timeit
+
+from passerelle_imio_ia_aes.utils import allocate_balance, flatten_cost_details, to_cents
+
+
+def build_details(nb_lines, seed=0):
+    rng = random.Random(seed)
+    details = []
+    for activity_category_id in (10, 11, 12):
+        groups = []
+        for _ in range(nb_lines // 30):
+            groups.append([
+                {
+                    "price": rng.choice([1.5, 2.28, 4.56, 10.0, 12.5]),
+                    "invoiceable_parent_id": rng.randint(1, 3),
+                    "child_registration_line_id": rng.randint(1, 50),
+                }
+                for _ in range(10)
+            ])
+        details.append({"activity_category_id": activity_category_id, "details": groups})
+    return details
+
+
+def legacy(details, balance):
+    # Reprise du parcours historique (solde positif) de compute_childcare_amount
+    payments, reserved_balances, post_payments_reserved_balances = [], [], []
+    for detail in details:
+        for price_details in detail.get("details", []):
+            for item in price_details:
+                line_amount = float(item.get("price", 0.0))
+                payment = {
+                    "parent_id": int(item["invoiceable_parent_id"]),
+                    "activity_category_id": detail["activity_category_id"],
+                    "child_registration_line_id": item.get("child_registration_line_id"),
+                    "amount": line_amount - balance if line_amount > balance else 0.0,
+                }
+                amount = line_amount - (line_amount - balance)
+                if amount > line_amount:
+                    amount = line_amount
+                balance -= line_amount
+                if balance < 0:
+                    balance = 0.0
+                if amount > 0.01:
+                    reserved_balances.append({"amount": amount, "child_registration_line_id": item.get("child_registration_line_id")})
+                if payment["amount"] > 0.0:
+                    payments.append(payment)
+                    post_payments_reserved_balances.append({"amount": payment["amount"]})
+    return payments, reserved_balances, post_payments_reserved_balances
+
+
+def engine(details, balance):
+    prices, keys, lines = flatten_cost_details(details)
+    return allocate_balance(prices, keys, to_cents(balance))
+
+
+if __name__ == "__main__":
+    for nb_lines in (1000, 10000, 100000):
+        details = build_details(nb_lines)
+        balance = 2500.0
+        for name, func in (("legacy", legacy), ("engine", engine)):
+            duration = min(timeit.repeat(lambda: func(details, balance), number=5, repeat=3)) / 5
+            print(f"{nb_lines:>7} lignes  {name:<7} {duration * 1000:8.2f} ms")
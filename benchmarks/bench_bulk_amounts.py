@@ -0,0 +1,37 @@
+"""Mesure de compute_amounts_with_balance sur plusieurs centaines de milliers de lignes.
+
+Compare une boucle sur compute_amount_with_balance, le repli en Python pur et
+la version NumPy (si installée).
+
+Usage : python benchmarks/bench_bulk_amounts.py
+"""
+import random
+import time
+
+from passerelle_imio_ia_aes import utils
+from passerelle_imio_ia_aes.utils import compute_amount_with_balance, compute_amounts_with_balance
+
+
+def build_rows(nb_rows, seed=0):
+    rng = random.Random(seed)
+    return (
+        [round(rng.uniform(0, 120), 2) for _ in range(nb_rows)],
+        [round(rng.uniform(0, 80), 2) for _ in range(nb_rows)],
+        [round(rng.uniform(0, 20), 2) for _ in range(nb_rows)],
+    )
+
+
+def measure(label, func):
+    start = time.perf_counter()
+    func()
+    print(f"  {label:<10} {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    for nb_rows in (100000, 500000):
+        orders, balances, reserved = build_rows(nb_rows)
+        print(f"{nb_rows} lignes")
+        measure("scalaire", lambda: [compute_amount_with_balance(*row) for row in zip(orders, balances, reserved)])
+        measure("python", lambda: compute_amounts_with_balance(orders, balances, reserved, use_numpy=False))
+        if utils.get_numpy() is not None:
+            measure("numpy", lambda: compute_amounts_with_balance(orders, balances, reserved, use_numpy=True))
@@ -0,0 +1,116 @@
+"""Mesure des octets économisés et du coût CPU de la compression des grandes listes.
+
+Le connecteur ne compresse pas lui-même ses réponses : la compression est
+laissée au serveur web (gzip de nginx) ou à GZipMiddleware de Django. Ces
+mesures aident à choisir le niveau de compression.
+
+Charges représentatives, générées pour une commune moyenne : les localités
+belges, les factures d'un parent sur trois ans, les inscriptions aux repas
+d'un enfant sur un trimestre et les journées pédagogiques d'une famille de
+quatre enfants. Chaque charge est sérialisée dans l'enveloppe Passerelle puis
+compressée en gzip (niveaux 1, 6 et 9) et en brotli si le module est installé.
+
+Usage : python benchmarks/bench_compression.py
+"""
+import gzip
+import json
+import timeit
+from datetime import date, timedelta
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def localities(count=2800):
+    return {
+        "items": [
+            {"id": i, "name": f"Localité {i}", "zip": str(1000 + i % 8999), "text": f"{1000 + i % 8999} - Localité {i}"}
+            for i in range(count)
+        ],
+        "items_total": count,
+    }
+
+
+def invoices(count=150):
+    return {
+        "items": [
+            {
+                "id": i,
+                "name": f"FACT/2025/{i:05d}",
+                "date": (date(2023, 1, 1) + timedelta(days=7 * i)).isoformat(),
+                "amount_total": 12.5 + i % 40,
+                "amount_residual": 0.0 if i % 5 else 4.5,
+                "state": "paid" if i % 5 else "open",
+                "activity_category_id": i % 4 + 1,
+                "communication": f"+++{i:03d}/{i * 7 % 10000:04d}/{i * 13 % 100000:05d}+++",
+            }
+            for i in range(count)
+        ]
+    }
+
+
+def meal_registrations(days=65):
+    return [
+        {
+            "meal_detail_id": i,
+            "meal_date": (date(2025, 9, 1) + timedelta(days=i)).isoformat(),
+            "meal_name": "Potage et plat du jour",
+            "meal_regime": "standard",
+            "meal_activity_id": 12,
+            "meal_parent_id": 279,
+            "meal_authorized_parent_ids": [279, 280],
+        }
+        for i in range(days)
+    ]
+
+
+def pedagogical_days(nb_children=4, days=60):
+    return {
+        "items": [
+            {
+                "date": (date(2025, 9, 1) + timedelta(days=d)).isoformat(),
+                "activity_id": 3,
+                "activity_date_id": d,
+                "child_id": child_id,
+                "child_lastname": "Dupont",
+                "child_firstname": f"Enfant {child_id}",
+                "invoiceable_parent_id": 279,
+                "is_child_already_registered": False,
+                "text": f"Dupont Enfant {child_id}",
+                "id": f"3_{d}_{child_id}",
+                "disabled": False,
+                "group_by": "Lundi 1 septembre 2025",
+            }
+            for child_id in range(1, nb_children + 1)
+            for d in range(days)
+        ]
+    }
+
+
+def measure(name, compress, body, number=50):
+    seconds = timeit.timeit(lambda: compress(body), number=number) / number
+    size = len(compress(body))
+    print(f"  {name:<10} {size:>9} octets ({size / len(body):6.1%})  {seconds * 1000:8.3f} ms")
+
+
+def main():
+    payloads = {
+        "localités": localities(),
+        "factures": invoices(),
+        "inscriptions repas": meal_registrations(),
+        "journées pédagogiques": pedagogical_days(),
+    }
+    for name, payload in payloads.items():
+        body = json.dumps({"err": 0, "data": payload}, separators=(",", ":")).encode("utf-8")
+        print(f"{name} : {len(body)} octets non compressés")
+        for level in (1, 6, 9):
+            measure(f"gzip -{level}", lambda b, level=level: gzip.compress(b, compresslevel=level), body)
+        if brotli is not None:
+            measure("brotli -4", lambda b: brotli.compress(b, quality=4), body)
+            measure("brotli -11", lambda b: brotli.compress(b, quality=11), body, number=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Mesure de la décoration des éléments de calendrier sur une année scolaire.
+
+Une famille de quatre enfants, pour chaque jour d'école de l'année : une
+journée pédagogique, un mercredi après-midi (le mercredi) et une inscription
+générique. Compare le code historique (JOURS/MOIS reconstruits et
+date.fromisoformat appelé deux fois par élément) avec le module decorations.
+
+Usage : python benchmarks/bench_decorations.py
+"""
+import copy
+import timeit
+from datetime import date, timedelta
+
+from passerelle_imio_ia_aes import decorations
+
+JOURS = decorations.JOURS
+MOIS = decorations.MOIS
+
+
+def school_year(nb_children=4):
+    days = [date(2025, 9, 1) + timedelta(days=i) for i in range(305)]
+    days = [d for d in days if d.weekday() < 5]
+    pedagogical, wednesdays, generic = [], [], []
+    for child_id in range(1, nb_children + 1):
+        for d in days:
+            base = {
+                "date": d.isoformat(),
+                "activity_id": 3,
+                "activity_date_id": d.toordinal(),
+                "child_id": child_id,
+                "child_lastname": "Dupont",
+                "child_firstname": f"Enfant {child_id}",
+                "invoiceable_parent_id": 279,
+                "is_child_already_registered": False,
+            }
+            pedagogical.append(dict(base))
+            if d.weekday() == 2:
+                wednesdays.append(dict(base))
+            generic.append(
+                {"date": d.isoformat(), "child_name": f"Enfant {child_id}", "child_registration_line_id": child_id, "day": d.day}
+            )
+    return pedagogical, wednesdays, generic
+
+
+def legacy(pedagogical, wednesdays, generic):
+    result = []
+    for items in (pedagogical, wednesdays):
+        for item in items:
+            item_date = date.fromisoformat(item["date"])
+            if item_date >= date(2025, 9, 1):
+                item["text"] = f"{item['child_lastname']} {item['child_firstname']}"
+                item["disabled"] = item.get("is_child_already_registered") or not item.get("invoiceable_parent_id")
+                item["id"] = f"{item['activity_id']}_{item['activity_date_id']}_{item['child_id']}"
+                d = date.fromisoformat(item["date"])
+                item["group_by"] = f"{JOURS[d.weekday()]} {d.day} {MOIS[d.month - 1]} {d.year}".capitalize()
+                result.append(item)
+    for item in generic:
+        d = date.fromisoformat(item["date"])
+        item["group_by"] = f"{JOURS[d.weekday()]} {d.day} {MOIS[d.month - 1]} {d.year}".capitalize()
+        item["text"] = item["child_name"]
+        item["id"] = f"{item['child_registration_line_id']}_{item['day']}"
+        result.append(item)
+    return result
+
+
+def shared(pedagogical, wednesdays, generic):
+    start_date = date(2025, 9, 1)
+    return (
+        list(decorations.decorate_pedagogical_days(pedagogical, start_date))
+        + list(decorations.decorate_wednesday_afternoons(wednesdays, start_date))
+        + list(decorations.decorate_generic_registrations(generic))
+    )
+
+
+if __name__ == "__main__":
+    data = school_year()
+    print(f"{sum(len(items) for items in data)} éléments")
+    for name, func in (("legacy", legacy), ("shared", shared)):
+        duration = min(timeit.repeat(lambda: func(*copy.deepcopy(data)), setup="", number=1, repeat=20))
+        copies = min(timeit.repeat(lambda: copy.deepcopy(data), number=1, repeat=20))
+        print(f"  {name:<7} {(duration - copies) * 1000:7.2f} ms")
@@ -0,0 +1,70 @@
+"""Compare les appels séquentiels et les appels parallèles d'un endpoint multi-appels, sous charge.
+
+Un endpoint comme homepage fait trois appels indépendants (APIMS, deux vers
+w.c.s.). Chaque appel est simulé par une attente (LATENCY) et occupe une des
+POOL_MAXSIZE connexions du pool, comme avec la session du connecteur
+(pool_block activé). Les requêtes arrivent en parallèle, comme sur un worker
+gunicorn à plusieurs threads, et sont servies :
+
+- séquentiellement ;
+- en parallèle avec utils.gather (un ThreadPoolExecutor par requête).
+
+Usage : python benchmarks/bench_gather.py
+"""
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passerelle_imio_ia_aes.utils import gather
+
+LATENCY = 0.05
+CALLS_PER_REQUEST = 3
+POOL_MAXSIZE = 10
+
+connections = threading.BoundedSemaphore(POOL_MAXSIZE)
+
+
+def upstream_call():
+    with connections:
+        time.sleep(LATENCY)
+    return True
+
+
+def sequential():
+    return [upstream_call() for _ in range(CALLS_PER_REQUEST)]
+
+
+def parallel():
+    return gather(*[upstream_call] * CALLS_PER_REQUEST, max_workers=POOL_MAXSIZE, timeout=5)
+
+
+def measure(label, endpoint, concurrency, nb_requests=60):
+    durations = []
+
+    def serve():
+        start = time.perf_counter()
+        endpoint()
+        durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as workers:
+        for _ in range(nb_requests):
+            workers.submit(serve)
+    elapsed = time.perf_counter() - start
+    p95 = statistics.quantiles(durations, n=20)[-1]
+    print(
+        f"  {label:<22} médiane {statistics.median(durations) * 1000:7.1f} ms"
+        f"  p95 {p95 * 1000:7.1f} ms  {nb_requests / elapsed:6.1f} req/s"
+    )
+
+
+def main():
+    for concurrency in (1, 4, 16):
+        print(f"{concurrency} requête(s) simultanée(s), {CALLS_PER_REQUEST} appels de {LATENCY * 1000:.0f} ms chacune")
+        measure("séquentiel", sequential, concurrency)
+        measure("parallèle", parallel, concurrency)
+
+
+if __name__ == "__main__":
+    main()
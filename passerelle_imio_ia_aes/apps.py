@@ -0,0 +1,32 @@
+import threading
+
+from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db import connection
+
+
+def warm_up_connectors(sender, **kwargs):
+    """Préchauffe les pools de connexions des connecteurs à la première requête reçue par le worker.
+
+    Le préchauffage se fait dans un thread pour ne pas retarder cette première
+    requête ; les suivantes trouvent les connexions vers APIMS déjà ouvertes.
+    """
+    request_started.disconnect(warm_up_connectors)
+
+    def run():
+        from .models import ApimsAesConnector
+
+        try:
+            for connector in ApimsAesConnector.objects.all():
+                connector.warm_up_pools()
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+class ImioIaAesConfig(AppConfig):
+    name = "passerelle_imio_ia_aes"
+
+    def ready(self):
+        request_started.connect(warm_up_connectors)
@@ -0,0 +1,385 @@
+"""Primitives de cache partagées entre les workers.
+
+Ces fonctions ne dépendent pas de Django : le cache est passé en paramètre et
+doit seulement offrir les méthodes get, get_many, set, set_many, add, delete et
+incr du cache Django.
+En production, c'est le cache Django configuré pour Passerelle (memcached),
+ce qui permet de coordonner les workers entre eux.
+"""
+
+import hashlib
+import json
+import logging
+import random
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def payload_digest(payload):
+    """Empreinte stable d'une donnée sérialisable en JSON, indépendante de l'ordre des clés."""
+    serialized = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class SharedFailure(Exception):
+    """Échec de l'appel attendu par run_once, fait par un autre worker.
+
+    status est le code HTTP associé à l'erreur d'origine (attribut http_status
+    ou réponse d'une HTTPError de requests), None s'il n'est pas connu ;
+    error_class est le nom de sa classe.
+    """
+
+    def __init__(self, message, status=None, error_class=None):
+        super().__init__(message)
+        self.status = status
+        self.error_class = error_class
+
+
+def error_status(error):
+    """Code HTTP associé à une exception, ou None"""
+    status = getattr(error, "http_status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def run_once(cache, key, func, timeout, lock_timeout=30, poll_interval=0.05, error_timeout=5):
+    """Exécute func une seule fois par clé et mémorise son résultat pendant timeout secondes.
+
+    Tant que le résultat est mémorisé, il est renvoyé sans rappeler func. Si un
+    autre worker est déjà en train d'exécuter func pour la même clé, on attend
+    son résultat plutôt que de refaire l'appel.
+
+    Les exceptions levées par func ne sont pas mémorisées pour les appels
+    suivants, mais elles sont partagées avec les appels qui attendaient : ils
+    lèvent SharedFailure au lieu de refaire l'appel chacun leur tour (pendant
+    une panne, N appels en attente dureraient sinon N fois le timeout du
+    service distant).
+
+    Le verrou porte un jeton propre à l'appel : s'il a expiré pendant un appel
+    trop long et a été repris par un autre worker, il n'est pas supprimé.
+    """
+    result_key, lock_key, error_key = f"{key}:result", f"{key}:lock", f"{key}:error"
+    token = uuid.uuid4().hex
+    waiting_since = None
+    while True:
+        entry = cache.get(result_key)
+        if entry is not None:
+            return entry["result"]
+        if waiting_since is not None:
+            # L'erreur est enregistrée avant la libération du verrou
+            error = cache.get(error_key)
+            if error is not None and error["failed_at"] >= waiting_since:
+                raise SharedFailure(error["error"], error["status"], error["class"])
+        attempted_at = time.time()
+        if cache.add(lock_key, token, lock_timeout):
+            break
+        if waiting_since is None:
+            waiting_since = attempted_at
+        # Le verrou expire après lock_timeout, l'attente est donc bornée
+        time.sleep(poll_interval)
+    try:
+        result = func()
+    except Exception as e:
+        cache.set(
+            error_key,
+            {
+                "error": str(e) or e.__class__.__name__,
+                "status": error_status(e),
+                "class": e.__class__.__name__,
+                "failed_at": time.time(),
+            },
+            error_timeout,
+        )
+        raise
+    else:
+        # Le résultat est enveloppé pour pouvoir mémoriser None
+        cache.set(result_key, {"result": result}, timeout)
+        return result
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+class Generation:
+    """Numéro de génération partagé, pour invalider d'un coup toutes les clés qui l'incluent."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    def value(self):
+        generation = self.cache.get(self.key)
+        if generation is None:
+            # Partir de l'horloge évite de retomber sur une ancienne génération après une éviction
+            self.cache.add(self.key, time.time_ns(), None)
+            generation = self.cache.get(self.key)
+        return generation
+
+    def bump(self):
+        try:
+            self.cache.incr(self.key)
+        except ValueError:
+            self.cache.set(self.key, time.time_ns(), None)
+
+
+class TokenBucket:
+    """Budget de rate appels par seconde vers un service distant, partagé par les workers.
+
+    Le seau est rempli de rate jetons au début de chaque seconde : il est
+    représenté par un compteur de jetons consommés, propre à la seconde en
+    cours (une clé par seconde, incrémentée de manière atomique).
+
+    Deux files :
+
+    - take() consomme un jeton sans jamais attendre (écritures critiques) ;
+    - acquire() attend au plus wait secondes qu'un jeton soit disponible et
+      renvoie False si le budget reste épuisé (lectures, qui peuvent être
+      servies depuis le cache).
+
+    Les jetons des écritures sont décomptés du même budget : en cas d'afflux,
+    ce sont les lectures qui attendent. Une lecture en attente ne consomme
+    pas de jeton tant que le budget est épuisé, et se réveille à un instant
+    tiré au hasard dans les premières JITTER secondes de la seconde suivante,
+    pour que les lectures en attente ne reviennent pas toutes en même temps.
+    """
+
+    JITTER = 0.2
+
+    def __init__(self, cache, key, rate):
+        self.cache = cache
+        self.key = key
+        self.rate = rate
+
+    def _window_key(self):
+        return f"{self.key}:{int(time.time())}"
+
+    def _consume(self):
+        """Consomme un jeton de la seconde en cours, renvoie le nombre de jetons consommés"""
+        window_key = self._window_key()
+        self.cache.add(window_key, 0, 2)
+        try:
+            return self.cache.incr(window_key)
+        except ValueError:
+            # La clé a expiré entre add et incr
+            self.cache.add(window_key, 1, 2)
+            return 1
+
+    def take(self):
+        self._consume()
+
+    def acquire(self, wait, poll_interval=0.05):
+        deadline = time.monotonic() + wait
+        while True:
+            # Le compteur n'est incrémenté que s'il reste des jetons : une attente ne vide pas le budget
+            if (self.cache.get(self._window_key()) or 0) < self.rate and self._consume() <= self.rate:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Pas de nouveau jeton avant la seconde suivante
+            delay = 1 - time.time() % 1 + random.uniform(0, self.JITTER)
+            time.sleep(min(max(delay, poll_interval), remaining))
+
+
+class IdempotencyJournal:
+    """Résultats des écritures vers un service distant, pour ne pas les refaire quand la demande est rejouée.
+
+    Un rejeu des mêmes données dans les timeout secondes renvoie le résultat
+    mémorisé (voir run_once). Les entrées sont rangées sous une génération
+    globale et sous une génération par périmètre (un parent, un enfant) :
+    forget() les oublie après une annulation, pour qu'une nouvelle écriture
+    identique soit réellement envoyée.
+    """
+
+    def __init__(self, cache, namespace, timeout):
+        self.cache = cache
+        self.namespace = namespace
+        self.timeout = timeout
+
+    def generation_key(self, scope=None):
+        if scope is None:
+            return f"{self.namespace}:generation"
+        return f"{self.namespace}:generation:{scope}"
+
+    def key(self, scope, payload):
+        return ":".join(
+            [
+                self.namespace,
+                str(Generation(self.cache, self.generation_key()).value()),
+                str(scope),
+                str(Generation(self.cache, self.generation_key(scope)).value()),
+                payload_digest(payload),
+            ]
+        )
+
+    def call(self, scope, payload, func):
+        return run_once(self.cache, self.key(scope, payload), func, self.timeout)
+
+    def forget(self, scope=None):
+        """Oublie les écritures mémorisées du périmètre scope, ou toutes si scope n'est pas connu"""
+        Generation(self.cache, self.generation_key(scope)).bump()
+
+
+class NegativeCache:
+    """Mémorise brièvement les recherches qui n'ont rien trouvé.
+
+    Les entrées sont rangées sous une génération : invalidate() passe à la
+    génération suivante, ce qui oublie toutes les entrées d'un coup (par
+    exemple quand le connecteur crée lui-même la personne recherchée).
+    """
+
+    def __init__(self, cache, namespace, timeout):
+        self.cache = cache
+        self.namespace = namespace
+        self.timeout = timeout
+
+    @property
+    def generation_key(self):
+        return f"{self.namespace}:generation"
+
+    def generation(self):
+        return Generation(self.cache, self.generation_key).value()
+
+    def key(self, lookup):
+        return f"{self.namespace}:{self.generation()}:{payload_digest(lookup)}"
+
+    def get(self, lookup):
+        """Renvoie la valeur mémorisée pour cette recherche, None si elle n'est pas connue comme vide"""
+        return self.cache.get(self.key(lookup))
+
+    def set(self, lookup, value=True):
+        self.cache.set(self.key(lookup), value, self.timeout)
+
+    def invalidate(self):
+        Generation(self.cache, self.generation_key).bump()
+
+
+class Snapshot:
+    """Valeurs partagées par les workers, à jour pendant ttl secondes (ttl peut être inférieur à la seconde).
+
+    Chaque valeur est stockée avec l'heure de sa lecture : les caches Django
+    arrondissent les durées à la seconde, la fraîcheur est donc vérifiée ici.
+    Les entrées sont rangées sous une génération, comme NegativeCache.
+    """
+
+    def __init__(self, cache, namespace, ttl, timeout=300):
+        self.cache = cache
+        self.namespace = namespace
+        self.ttl = ttl
+        self.timeout = timeout
+
+    @property
+    def generation_key(self):
+        return f"{self.namespace}:generation"
+
+    def keys(self, items):
+        generation = Generation(self.cache, self.generation_key).value()
+        return {f"{self.namespace}:{generation}:{item}": item for item in items}
+
+    def get_many(self, items):
+        """Renvoie {item: valeur} pour les items dont la valeur est encore à jour"""
+        keys = self.keys(items)
+        now = time.time()
+        return {
+            keys[key]: entry["value"]
+            for key, entry in self.cache.get_many(list(keys)).items()
+            if now - entry["read_at"] < self.ttl
+        }
+
+    def update(self, values):
+        """Enregistre {item: valeur}, valeurs qui viennent d'être lues"""
+        now = time.time()
+        keys = self.keys(values)
+        self.cache.set_many(
+            {key: {"value": values[item], "read_at": now} for key, item in keys.items()}, self.timeout
+        )
+
+    def adjust(self, item, delta, minimum=0):
+        """Modifie une valeur connue sans changer sa fraîcheur (écriture qui vient d'aboutir).
+
+        La lecture puis l'écriture ne sont pas atomiques : une modification
+        simultanée peut être perdue, jusqu'à la relecture suivante, au plus
+        ttl secondes plus tard.
+        """
+        ((key, _),) = self.keys([item]).items()
+        entry = self.cache.get(key)
+        if entry is not None:
+            entry["value"] = max(entry["value"] + delta, minimum)
+            self.cache.set(key, entry, self.timeout)
+
+    def invalidate(self):
+        Generation(self.cache, self.generation_key).bump()
+
+    def get_or_fetch(self, items, fetch, wait=2, poll_interval=0.05):
+        """Renvoie les valeurs à jour des items, en appelant fetch (qui appelle update) si certaines sont expirées.
+
+        Les workers qui trouvent le même ensemble d'items expirés n'appellent
+        fetch qu'une fois : les autres attendent au plus wait secondes que les
+        valeurs soient rafraîchies. Les items qui n'ont pas pu l'être sont
+        absents du résultat, y compris quand fetch échoue : l'erreur est
+        journalisée et seules les valeurs encore à jour sont renvoyées.
+        """
+        values = self.get_many(items)
+        expired = sorted(set(items) - set(values))
+        if not expired:
+            return values
+        lock_key = f"{self.namespace}:refresh:{payload_digest(expired)}"
+        if self.cache.add(lock_key, True, 30):
+            try:
+                fetch()
+            except Exception:
+                logger.warning("Rafraîchissement de %s impossible", self.namespace, exc_info=True)
+            finally:
+                self.cache.delete(lock_key)
+            return self.get_many(items)
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline and self.cache.get(lock_key) is not None:
+            time.sleep(poll_interval)
+        return self.get_many(items)
+
+
+def get_or_refresh(cache, key, fetch, timeout, stale_timeout, stale_if_error_timeout, run_in_background):
+    """Lit une valeur en cache en tolérant une donnée expirée (stale-while-revalidate / stale-if-error).
+
+    - pendant timeout secondes, la valeur en cache est renvoyée telle quelle ;
+    - pendant les stale_timeout secondes suivantes, elle est encore renvoyée
+      immédiatement, et un seul rafraîchissement est lancé via run_in_background ;
+    - au-delà, fetch est appelé ; s'il échoue et que la valeur a moins de
+      timeout + stale_if_error_timeout secondes, la dernière valeur connue est
+      renvoyée plutôt que l'erreur.
+
+    Returns
+    -------
+        tuple (valeur, stale)
+            stale vaut None pour une valeur fraîche, sinon un dict décrivant
+            pourquoi une valeur expirée est servie (reason) et son âge (age).
+    """
+
+    def store(value):
+        cache.set(key, {"value": value, "fetched_at": time.time()}, timeout + max(stale_timeout, stale_if_error_timeout))
+
+    def refresh():
+        try:
+            store(fetch())
+        finally:
+            cache.delete(f"{key}:refresh")
+
+    entry = cache.get(key)
+    age = time.time() - entry["fetched_at"] if entry is not None else None
+    if entry is not None and age < timeout:
+        return entry["value"], None
+    if entry is not None and age < timeout + stale_timeout:
+        if cache.add(f"{key}:refresh", True, max(int(timeout), 30)):
+            run_in_background(refresh)
+        return entry["value"], {"stale": True, "reason": "revalidating", "age": int(age)}
+    try:
+        value = fetch()
+    except Exception:
+        if entry is not None and age < timeout + stale_if_error_timeout:
+            return entry["value"], {"stale": True, "reason": "upstream_error", "age": int(age)}
+        raise
+    store(value)
+    return value, None
@@ -0,0 +1,111 @@
+"""Complète les éléments de calendrier renvoyés par iA.AES pour les formulaires w.c.s.
+
+Les journées pédagogiques, les mercredis après-midi et les inscriptions aux
+activités génériques sont affichés de la même manière : un libellé (text), un
+identifiant (id), éventuellement un état (disabled) et un regroupement par
+date en toutes lettres (group_by). Les dates et leurs libellés sont mémorisés :
+une même date revient pour chaque enfant et chaque activité.
+"""
+
+from datetime import date
+from functools import lru_cache
+
+JOURS = ('lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche')
+MOIS = ('janvier', 'février', 'mars', 'avril', 'mai', 'juin',
+        'juillet', 'août', 'septembre', 'octobre', 'novembre', 'décembre')
+NUMEROS_MOIS = {mois: numero for numero, mois in enumerate(MOIS, start=1)}
+
+
+@lru_cache(maxsize=4096)
+def parse_iso_date(value):
+    """Convertit une date 'YYYY-MM-DD' en datetime.date"""
+    return date.fromisoformat(value)
+
+
+@lru_cache(maxsize=4096)
+def date_label(value):
+    """Formate une date 'YYYY-MM-DD' en 'Vendredi 18 juillet 2025'"""
+    d = parse_iso_date(value)
+    return f"{JOURS[d.weekday()]} {d.day} {MOIS[d.month - 1]} {d.year}".capitalize()
+
+
+def format_date(date_str):
+    """Formate une date 'YYYY-MM-DD' en 'Vendredi 18 juillet 2025', ou la renvoie telle quelle si elle est invalide"""
+    try:
+        return date_label(date_str)
+    except (TypeError, ValueError):
+        return date_str
+
+
+def parse_french_date(text_date):
+    """Convertit une date 'Jeudi 23 octobre 2025' en '2025-10-23', ou la renvoie telle quelle si elle est invalide"""
+    try:
+        parts = text_date.split(" ")  # ['Jeudi', '23', 'octobre', '2025']
+        return f"{int(parts[3]):04d}-{NUMEROS_MOIS[parts[2].lower()]:02d}-{int(parts[1]):02d}"
+    except (AttributeError, IndexError, KeyError, ValueError):
+        return text_date
+
+
+def child_name(item):
+    return f"{item['child_lastname']} {item['child_firstname']}"
+
+
+def is_unavailable(item):
+    return item.get("is_child_already_registered") or not item.get("invoiceable_parent_id")
+
+
+def in_window(start_date=None, end_date=None):
+    """Filtre gardant les éléments compris entre deux dates (incluses), None pour ne pas borner"""
+
+    def keep(item, item_date):
+        return (start_date is None or item_date >= start_date) and (end_date is None or item_date <= end_date)
+
+    return keep
+
+
+def decorate_calendar_items(items, make_id, make_text=child_name, is_disabled=None, keep=None):
+    """Générateur complétant des éléments datés avec text, id, disabled et group_by.
+
+    Parameters
+    ----------
+        items : itérable de dict ayant une clé date au format 'YYYY-MM-DD'
+        make_id, make_text : fonctions calculant l'identifiant et le libellé d'un élément
+        is_disabled : fonction calculant l'état disabled, None pour ne pas le renseigner
+        keep : fonction (item, datetime.date) -> bool, None pour garder tous les éléments
+    """
+    for item in items:
+        if keep is not None and not keep(item, parse_iso_date(item["date"])):
+            continue
+        item["text"] = make_text(item)
+        if is_disabled is not None:
+            item["disabled"] = is_disabled(item)
+        item["id"] = make_id(item)
+        item["group_by"] = date_label(item["date"])
+        yield item
+
+
+def decorate_pedagogical_days(items, start_date=None, end_date=None):
+    return decorate_calendar_items(
+        items,
+        make_id=lambda item: f"{item['activity_id']}_{item['activity_date_id']}_{item['child_id']}",
+        is_disabled=is_unavailable,
+        keep=in_window(start_date, end_date),
+    )
+
+
+def decorate_wednesday_afternoons(items, start_date=None, end_date=None):
+    return decorate_calendar_items(
+        items,
+        make_id=lambda item: f"{item['activity_id']}_{item.get('activity_date_id') or item['date']}_{item['child_id']}",
+        is_disabled=is_unavailable,
+        keep=in_window(start_date, end_date),
+    )
+
+
+def decorate_generic_registrations(items, keep=None):
+    return decorate_calendar_items(
+        items,
+        make_id=lambda item: f"{item['child_registration_line_id']}_{item['day']}",
+        make_text=lambda item: item["child_name"],
+        keep=keep,
+    )
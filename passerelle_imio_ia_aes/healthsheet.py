@@ -0,0 +1,297 @@
+"""Conversion de la fiche santé entre iA.AES et les formulaires w.c.s.
+
+Les deux sens sont décrits par des tables, compilées une seule fois à
+l'import du module :
+
+- READ_FIELDS : champs renvoyés au formulaire, calculés à partir de la fiche
+  santé lue dans APIMS ;
+- UPDATE_FIELDS : champs envoyés à APIMS, calculés à partir des données du
+  formulaire. Les champs dont le nom contient "selection" ou "text", les
+  contacts autorisés et les maladies sont traités ensuite par to_update.
+
+diff compare ensuite ces données à la fiche actuelle pour n'envoyer à APIMS
+que ce qui a changé.
+"""
+
+from operator import itemgetter
+
+# Le champ est repris tel quel
+COPY = "copy"
+# Le champ est repris, une valeur vide devient ""
+TEXT = "text"
+# Le champ n'est envoyé à APIMS que s'il est renseigné
+IF_SET = "if_set"
+# Une règle renvoie MISSING pour que le champ ne soit pas envoyé à APIMS
+MISSING = object()
+
+
+def _diseases_ids(data):
+    return [str(disease["disease_type_id"][0]) for disease in data["disease_ids"]]
+
+
+def _diseases_details(data):
+    return [
+        {
+            "id": disease["disease_type_id"][0],
+            "gravity": disease["gravity"] or "",
+            "treatment": disease["disease_text"],
+        }
+        for disease in data["disease_ids"]
+    ]
+
+
+def _medications(data):
+    return [
+        {
+            "name": medication["name"],
+            "quantity": medication["quantity"],
+            "period": medication["period"],
+            "self_medication": medication["self_medication_selection"],
+        }
+        for medication in data["medication_ids"]
+    ]
+
+
+READ_FIELDS = (
+    ("activity_no_available_reason", TEXT),
+    ("activity_no_available_selection", COPY),
+    ("activity_no_available_text", TEXT),
+    ("allergy_consequence", TEXT),
+    ("allergy_ids", lambda data: [str(allergy["id"]) for allergy in data["allergy_ids"]]),
+    ("allergy_selection", COPY),
+    ("allergy_treatment", TEXT),
+    ("allowed_contact_ids", COPY),
+    ("authorization_ids", COPY),
+    ("arnica", COPY),
+    ("bike", COPY),
+    ("blood_type", COPY),
+    ("comment", COPY),
+    ("disease_ids", _diseases_ids),
+    ("disease_details", _diseases_details),
+    ("doctor_id", COPY),
+    ("emotional_support", COPY),
+    ("facebook", COPY),
+    ("first_date_tetanus", COPY),
+    ("handicap_selection", COPY),
+    ("has_medication", lambda data: "yes" if len(data["medication_ids"]) > 0 else "not_specified"),
+    ("hearing_aid", COPY),
+    ("glasses", COPY),
+    ("id", COPY),
+    ("intervention_text", TEXT),
+    ("intervention_selection", COPY),
+    ("last_date_tetanus", COPY),
+    ("level_handicap", COPY),
+    ("medication_ids", _medications),
+    ("mutuality", TEXT),
+    ("nap", COPY),
+    ("photo", COPY),
+    ("photo_general", COPY),
+    ("self_medication", COPY),
+    ("specific_regime_selection", COPY),
+    ("specific_regime_text", TEXT),
+    ("swim", COPY),
+    ("swim_level", COPY),
+    ("tetanus_selection", COPY),
+    ("to_go_alone", COPY),
+    ("type_handicap", COPY),
+    ("weight", TEXT),
+)
+
+
+def _if_set(source, convert=None):
+    """Règle reprenant source s'il est renseigné, éventuellement converti"""
+
+    def rule(form):
+        value = form[source]
+        if not value:
+            return MISSING
+        return value if convert is None else convert(value)
+
+    return rule
+
+
+def _allergy_detail(source):
+    """Les détails des allergies ne sont envoyés que si une allergie est déclarée"""
+
+    def rule(form):
+        if form[source] and (form["allergy_ids"] or form["other_allergies"]):
+            return form[source]
+        return ""
+
+    return rule
+
+
+def _authorizations(form):
+    authorizations = list()
+    if form["mandatory_authorizations"]:
+        authorizations += form["mandatory_authorizations"]
+    if form["optional_authorizations"]:
+        authorizations += form["optional_authorizations"]
+    return [int(authorization) for authorization in authorizations]
+
+
+UPDATE_FIELDS = (
+    ("activity_no_available_reason", IF_SET),
+    ("allergy_consequence", _allergy_detail("allergy_consequence")),
+    ("allergy_ids", lambda form: [int(allergy) for allergy in form["allergy_ids"]] if form["allergy_ids"] else list()),
+    ("allergy_treatment", _allergy_detail("allergy_treatment")),
+    ("arnica", IF_SET),
+    ("authorization_ids", _authorizations),
+    ("bike", IF_SET),
+    ("blood_type", IF_SET),
+    ("comment", IF_SET),
+    ("child_id", _if_set("child_id", int)),
+    ("doctor_id", IF_SET),
+    ("emotional_support", IF_SET),
+    ("facebook", IF_SET),
+    ("first_date_tetanus", IF_SET),
+    ("glasses", IF_SET),
+    ("hearing_aid", IF_SET),
+    ("last_date_tetanus", IF_SET),
+    ("level_handicap", IF_SET),
+    ("medication_ids", _if_set("medications")),
+    ("mutuality", IF_SET),
+    ("nap", IF_SET),
+    # other_allergies est une liste de dict ([{"name": "autre allergie 1"}]), APIMS attend une liste de noms
+    ("other_allergies", _if_set("other_allergies", lambda allergies: [allergy["name"] for allergy in allergies])),
+    ("photo", IF_SET),
+    ("photo_general", IF_SET),
+    ("swim", IF_SET),
+    ("swim_level", IF_SET),
+    ("to_go_alone", IF_SET),
+    ("type_handicap", IF_SET),
+    ("weight", IF_SET),
+)
+
+
+def _compile_read(key, kind):
+    if kind == COPY:
+        return itemgetter(key)
+    if kind == TEXT:
+        return lambda data: data[key] or ""
+    return kind
+
+
+def _compile_update(key, kind):
+    return _if_set(key) if kind == IF_SET else kind
+
+
+READ_MAP = tuple((key, _compile_read(key, kind)) for key, kind in READ_FIELDS)
+UPDATE_MAP = tuple((key, _compile_update(key, kind)) for key, kind in UPDATE_FIELDS)
+
+
+def to_form(data):
+    """Fiche santé lue dans APIMS (premier élément de la réponse) -> données du formulaire"""
+    return {key: getter(data) for key, getter in READ_MAP}
+
+
+def to_update(form):
+    """Données du formulaire -> fiche santé à envoyer à APIMS"""
+    put_data = dict()
+    for key, rule in UPDATE_MAP:
+        value = rule(form)
+        if value is not MISSING:
+            put_data[key] = value
+    allowed_contact_ids = []
+    for key, value in form.items():
+        if ("selection" in key or "text" in key) and value:
+            put_data[key] = value
+        elif "contact" in key:
+            contact = value.split(" ; ")
+            if contact[0]:
+                allowed_contact_ids.append({"partner_id": int(contact[0]), "parental_link": contact[1]})
+    disease_ids, other_diseases = [], []
+    for disease in form["diseases"]:
+        disease_id = {
+            "gravity": disease["gravity"],
+            "disease_text": disease["treatment"],
+            "health_sheet_id": form["healthsheet_id"],
+        }
+        if disease["disease"] != "autre":
+            disease_id.update({"disease_type_id": int(disease["disease"])})
+            disease_ids.append(disease_id)
+        else:
+            disease_id.update({"name": disease["other_disease"]})
+            other_diseases.append(disease_id)
+    put_data["disease_ids"] = disease_ids
+    put_data["other_diseases"] = other_diseases
+    if allowed_contact_ids:
+        put_data["allowed_contact_ids"] = allowed_contact_ids
+    return put_data
+
+
+# Champs toujours envoyés à APIMS, même inchangés : ils identifient l'enfant
+ALWAYS_SENT = ("child_id",)
+
+
+def _id(value):
+    # Les relations Odoo sont renvoyées sous la forme [id, nom] ou {"id": ..., ...}
+    if isinstance(value, (list, tuple)):
+        return value[0]
+    if isinstance(value, dict):
+        return value["id"]
+    return int(value)
+
+
+COLLECTIONS = {
+    "allergy_ids": lambda items: sorted(_id(item) for item in items),
+    "authorization_ids": lambda items: sorted(_id(item) for item in items),
+    "allowed_contact_ids": lambda items: sorted((_id(item["partner_id"]), item["parental_link"]) for item in items),
+    "disease_ids": lambda items: sorted(
+        (_id(item["disease_type_id"]), item["gravity"] or "", item["disease_text"] or "") for item in items
+    ),
+    "medication_ids": lambda items: sorted(
+        (
+            item["name"],
+            str(item["quantity"]),
+            item["period"],
+            item.get("self_medication_selection", item.get("self_medication")),
+        )
+        for item in items
+    ),
+}
+
+
+def _is_empty(value):
+    return value is None or value is False or value == "" or value == []
+
+
+def _same(key, value, current):
+    """Vrai seulement s'il est certain que value ne change pas la valeur actuelle"""
+    if key in COLLECTIONS:
+        try:
+            return COLLECTIONS[key](value or []) == COLLECTIONS[key](current or [])
+        except (KeyError, TypeError, ValueError, IndexError):
+            return False
+    if value == current or (_is_empty(value) and _is_empty(current)):
+        return True
+    if isinstance(current, (list, tuple, dict)) and not isinstance(value, (list, tuple, dict)):
+        # Relation (par exemple doctor_id) : le formulaire n'envoie que l'identifiant
+        try:
+            current = _id(current)
+        except (KeyError, TypeError, ValueError, IndexError):
+            return False
+    # Le formulaire envoie les nombres sous forme de texte ("32" pour un poids de 32)
+    return not isinstance(value, bool) and not isinstance(current, bool) and str(value) == str(current)
+
+
+def diff(put_data, current):
+    """Ne garde de put_data que les champs qui modifient la fiche actuelle (telle que lue dans APIMS).
+
+    Un champ n'est retiré que s'il est certainement inchangé : dans le doute
+    (champ absent de la fiche, forme inattendue), il est envoyé. Les
+    collections sont envoyées entières quand elles changent, et une liste
+    vide absente de la fiche (other_diseases par exemple) est envoyée : elle
+    peut vider une collection qu'APIMS ne renvoie pas.
+    """
+    changes = dict()
+    for key, value in put_data.items():
+        if key in ALWAYS_SENT:
+            changes[key] = value
+        elif key not in current:
+            if not _is_empty(value) or isinstance(value, list):
+                changes[key] = value
+        elif not _same(key, value, current[key]):
+            changes[key] = value
+    return changes
+
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passerelle_imio_ia_aes', '0003_auto_20220411_1319'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apimsaesconnector',
+            name='payload_trace_sample_rate',
+            field=models.FloatField(default=0, help_text='Proportion des requêtes (entre 0 et 1) dont les données échangées sont tracées au niveau DEBUG. 0 désactive les traces.', verbose_name="Taux d'échantillonnage des traces de données"),
+        ),
+        migrations.AddField(
+            model_name='apimsaesconnector',
+            name='payload_trace_max_length',
+            field=models.PositiveIntegerField(default=2000, help_text='Nombre de caractères au-delà duquel les données tracées sont tronquées.', verbose_name='Taille maximale des traces de données'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passerelle_imio_ia_aes', '0004_payload_trace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apimsaesconnector',
+            name='pool_maxsize',
+            field=models.PositiveIntegerField(default=10, help_text='Nombre maximum de connexions conservées par service distant (APIMS, w.c.s., authentic) et par worker.', verbose_name='Taille des pools de connexions'),
+        ),
+        migrations.AddField(
+            model_name='apimsaesconnector',
+            name='pool_block',
+            field=models.BooleanField(default=False, help_text="Si coché, une requête attend qu'une connexion du pool se libère au lieu d'ouvrir une connexion supplémentaire non conservée.", verbose_name='Attendre une connexion libre'),
+        ),
+        migrations.AddField(
+            model_name='apimsaesconnector',
+            name='pool_warmup_connections',
+            field=models.PositiveIntegerField(default=2, help_text="Nombre de connexions ouvertes vers APIMS au démarrage de chaque worker. 0 désactive le préchauffage.", verbose_name='Connexions ouvertes au démarrage'),
+        ),
+    ]
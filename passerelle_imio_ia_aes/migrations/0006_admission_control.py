@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passerelle_imio_ia_aes', '0005_connection_pools'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apimsaesconnector',
+            name='admission_rate',
+            field=models.PositiveIntegerField(default=0, help_text="Budget d'appels par seconde vers APIMS, partagé par tous les workers pour cette instance iA.AES. Les écritures (inscriptions, paiements, mises à jour) passent toujours ; au-delà du budget, les lectures attendent ou sont servies depuis le cache. 0 désactive le contrôle.", verbose_name='Appels par seconde vers APIMS'),
+        ),
+        migrations.AddField(
+            model_name='apimsaesconnector',
+            name='admission_queue_timeout',
+            field=models.FloatField(default=0.5, help_text="Durée pendant laquelle une lecture attend que le budget d'appels se libère avant d'être servie depuis le cache ou refusée.", verbose_name='Attente maximale des lectures (secondes)'),
+        ),
+    ]
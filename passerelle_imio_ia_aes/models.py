@@ -17,32 +17,65 @@
 
 
 from builtins import str
-from email import header
 
 import json
 import logging
 import re
-from calendar import Calendar, monthrange
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
 from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseBadRequest
 from django.urls import path, reverse
 from django.core.exceptions import MultipleObjectsReturned
+from django.db import close_old_connections, connection
+from requests.exceptions import HTTPError, RequestException
 from datetime import date, datetime, timedelta, time
-from dateutil.relativedelta import relativedelta
 from passerelle.base.models import BaseResource
 from passerelle.base.signature import sign_url
 from passerelle.utils.api import endpoint
 from passerelle.utils.jsonresponse import APIError
-from workalendar.europe import Belgium
 from datetime import datetime
-from .utils import compute_amount_with_balance
+from . import decorations, healthsheet, pools
+from .caching import (
+    Generation,
+    IdempotencyJournal,
+    NegativeCache,
+    SharedFailure,
+    Snapshot,
+    TokenBucket,
+    get_or_refresh,
+    payload_digest,
+    run_once,
+)
+from .utils import (
+    PayloadTrace,
+    allocate_balance,
+    compute_amount_with_balance,
+    flatten_cost_details,
+    gather,
+    is_sampled,
+    project_fields,
+    to_cents,
+)
 
 
 logger = logging.getLogger(__name__)
-JOURS = ('lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche')
-MOIS = ('janvier', 'février', 'mars', 'avril', 'mai', 'juin',
-        'juillet', 'août', 'septembre', 'octobre', 'novembre', 'décembre')
+
+
+@lru_cache(maxsize=1)
+def get_belgian_calendar():
+    """Calendrier des jours ouvrables belges, construit une seule fois et à la première utilisation.
+
+    workalendar est long à importer : il n'est chargé que par les calculs de délai.
+    """
+    from workalendar.europe import Belgium
+
+    return Belgium()
+
 
 class ApimsAesConnector(BaseResource):
     """
@@ -63,6 +96,41 @@ class ApimsAesConnector(BaseResource):
         verbose_name="Instance d'AES à contacter",
         help_text="Par exemple : fleurus",
     )
+    payload_trace_sample_rate = models.FloatField(
+        default=0,
+        verbose_name="Taux d'échantillonnage des traces de données",
+        help_text="Proportion des requêtes (entre 0 et 1) dont les données échangées sont tracées au niveau DEBUG. 0 désactive les traces.",
+    )
+    payload_trace_max_length = models.PositiveIntegerField(
+        default=2000,
+        verbose_name="Taille maximale des traces de données",
+        help_text="Nombre de caractères au-delà duquel les données tracées sont tronquées.",
+    )
+    pool_maxsize = models.PositiveIntegerField(
+        default=10,
+        verbose_name="Taille des pools de connexions",
+        help_text="Nombre maximum de connexions conservées par service distant (APIMS, w.c.s., authentic) et par worker.",
+    )
+    pool_block = models.BooleanField(
+        default=False,
+        verbose_name="Attendre une connexion libre",
+        help_text="Si coché, une requête attend qu'une connexion du pool se libère au lieu d'ouvrir une connexion supplémentaire non conservée.",
+    )
+    pool_warmup_connections = models.PositiveIntegerField(
+        default=2,
+        verbose_name="Connexions ouvertes au démarrage",
+        help_text="Nombre de connexions ouvertes vers APIMS au démarrage de chaque worker. 0 désactive le préchauffage.",
+    )
+    admission_rate = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Appels par seconde vers APIMS",
+        help_text="Budget d'appels par seconde vers APIMS, partagé par tous les workers pour cette instance iA.AES. Les écritures (inscriptions, paiements, mises à jour) passent toujours ; au-delà du budget, les lectures attendent ou sont servies depuis le cache. 0 désactive le contrôle.",
+    )
+    admission_queue_timeout = models.FloatField(
+        default=0.5,
+        verbose_name="Attente maximale des lectures (secondes)",
+        help_text="Durée pendant laquelle une lecture attend que le budget d'appels se libère avant d'être servie depuis le cache ou refusée.",
+    )
 
     category = "Connecteurs iMio"
     api_description = "Ce connecteur propose les méthodes d'échanges avec le produit iA.AES à travers Apims."
@@ -79,6 +147,10 @@ class ApimsAesConnector(BaseResource):
         "description": "Identifiant Odoo interne de la personne",
         "example_value": "1",
     }
+    FIELDS_PARAM = {
+        "description": "Champs à renvoyer, séparés par des virgules, avec des chemins pointés pour les éléments imbriqués (optionnel, tous les champs par défaut)",
+        "example_value": "id,lastname,items.id",
+    }
     CATEGORY_PARAM = {
         "description": "Identifiants du type d'activité",
         "example_value": "holiday_plain",
@@ -90,6 +162,51 @@ class ApimsAesConnector(BaseResource):
         "pp-desinscription-repas": "static/imio/images/portail_parent/black-no-repas.svg",
     }
 
+    # Durée (en secondes) pendant laquelle une demande rejouée par w.c.s. renvoie la réponse mémorisée
+    IDEMPOTENCY_WINDOW = 600
+    # Durée (en secondes) du cache des journées pédagogiques d'un parent, partagé par les endpoints de listing
+    PEDAGOGICAL_DAYS_CACHE_DURATION = 30
+    # Durée (en secondes) pendant laquelle une recherche sans résultat n'est pas relancée vers APIMS
+    NEGATIVE_CACHE_DURATION = 60
+    # Durée (en secondes) après expiration pendant laquelle une lecture est servie depuis le cache et rafraîchie en arrière-plan
+    STALE_WHILE_REVALIDATE = 120
+    # Durée (en secondes) après expiration pendant laquelle une lecture est servie depuis le cache si APIMS est en erreur
+    STALE_IF_ERROR = 3600
+    # Durée (en secondes) pendant laquelle la réponse d'un GET est partagée entre les requêtes identiques simultanées
+    COALESCING_WINDOW = 2
+    # Durée maximale (en secondes) des appels faits en parallèle par un endpoint (voir gather)
+    GATHER_TIMEOUT = 30
+    # Durée (en secondes) pendant laquelle les soldes réservés d'un parent sont mémorisés, voir free_balances
+    RESERVED_BALANCES_CACHE_DURATION = 86400
+    # Durée (en secondes) du cache des menus et des inscriptions aux repas d'un enfant
+    MENU_CACHE_DURATION = 300
+    # Mois proposés dans le formulaire des repas : 0 pour le mois actuel, 1 pour le suivant, 2 pour celui d'après
+    SELECTABLE_MONTHS = (0, 1, 2)
+    # Durée (en secondes) du cache des données tirées des schémas de formulaires w.c.s.
+    WCS_SCHEMA_CACHE_DURATION = 300
+    # Durée (en secondes) du cache des localités, partagé par les connecteurs d'un même serveur APIMS
+    LOCALITIES_CACHE_DURATION = 600
+    # Durée (en secondes) du cache des pays, partagé par les connecteurs d'un même serveur APIMS
+    COUNTRIES_CACHE_DURATION = 3600
+    # Durée (en secondes) du cache de la fiche santé d'un enfant
+    HEALTHSHEET_CACHE_DURATION = 300
+    # Durée (en secondes) du cache des listes de référence de la fiche santé (champs, autorisations, allergies, maladies)
+    HEALTHSHEET_REFERENCE_CACHE_DURATION = 60
+    # Durée (en secondes) du cache des données de référence des formulaires parent et enfant
+    REFERENCE_CACHE_DURATION = 600
+    # Durée (en secondes) du cache des plaines proposées à un enfant
+    PLAINS_CACHE_DURATION = 15
+    # Durée (en secondes) pendant laquelle les places restantes d'une plaine sont considérées à jour
+    PLAIN_AVAILABILITY_TTL = 0.5
+    # Données de référence proposées par reference-bundle et chemin APIMS correspondant
+    REFERENCE_PATHS = {
+        "countries": "countries",
+        "levels": "levels",
+        "places": "places",
+        "school_implantations": "school-implantations",
+        "price_categories": "price_categories",
+    }
+
     class Meta:
         verbose_name = "Connecteur Apims AES"
 
@@ -99,8 +216,234 @@ class ApimsAesConnector(BaseResource):
     def make_requests(self, **kwargs):
         r = super().make_requests(**kwargs)
         r.headers.update({"Accept": "application/json"})
+        adapter = self.get_pool_adapter()
+        for url in self.upstream_urls():
+            r.mount(url, adapter)
         return r
 
+    def get_pool_adapter(self):
+        """Adaptateur HTTP partagé par les requêtes du worker, voir pools"""
+        return pools.get_adapter(self.slug, self.pool_maxsize, self.pool_block)
+
+    def upstream_urls(self):
+        """URL des services distants dont les connexions sont gardées dans les pools du connecteur"""
+        urls = [self.server_url] if self.server_url else []
+        known_services = getattr(settings, "KNOWN_SERVICES", {})
+        for service in ("wcs", "authentic"):
+            if known_services.get(service):
+                urls.append(list(known_services[service].values())[0]["url"])
+        return urls
+
+    def warm_up_pools(self):
+        """Ouvre pool_warmup_connections connexions vers APIMS, voir pools.warm_up"""
+        if not self.server_url:
+            return 0
+        connections = min(self.pool_warmup_connections, self.pool_maxsize)
+        return pools.warm_up(self.requests, self.server_url, connections)
+
+    def cache_key(self, *parts):
+        """Clé de cache propre à ce connecteur"""
+        return ":".join(["passerelle-imio-ia-aes", self.slug] + [str(part) for part in parts])
+
+    def upstream_cache_key(self, *parts):
+        """Clé de cache propre au serveur APIMS, partagée par tous les connecteurs qui l'interrogent"""
+        upstream = payload_digest(self.server_url.rstrip("/").lower())[:16]
+        return ":".join(["passerelle-imio-ia-aes", "upstream", upstream] + [str(part) for part in parts])
+
+    def negative_cache(self, name):
+        """Cache des recherches sans résultat, voir NegativeCache"""
+        return NegativeCache(cache, self.cache_key("negative", name), self.NEGATIVE_CACHE_DURATION)
+
+    def idempotency_journal(self, name):
+        return IdempotencyJournal(cache, self.cache_key("idempotency", name), self.IDEMPOTENCY_WINDOW)
+
+    def call_once(self, name, post_data, func, scope=None):
+        """Exécute une écriture vers APIMS une seule fois pour une même demande.
+
+        Quand une action de workflow expire, w.c.s. rejoue la requête. La clé est
+        construite à partir du numéro de la demande et d'une empreinte des
+        données reçues : un rejeu dans la fenêtre IDEMPOTENCY_WINDOW renvoie la
+        réponse mémorisée sans rappeler APIMS, et un doublon simultané attend la
+        réponse du premier appel. scope (parent ou enfant concerné) permet
+        d'oublier ces réponses après une annulation, voir forget_calls.
+        """
+        form_reference = post_data.get("form_number") or post_data.get("form_url") or ""
+        with self.shared_failures():
+            return self.idempotency_journal(name).call(scope, [form_reference, post_data], func)
+
+    def forget_calls(self, name, scope=None):
+        """Oublie les écritures mémorisées par call_once pour scope, ou pour tous si scope n'est pas connu"""
+        self.idempotency_journal(name).forget(scope)
+
+    def trace_payload(self, label, payload):
+        """Trace des données échangées, échantillonnées et tronquées selon la configuration du connecteur"""
+        if not is_sampled(self.payload_trace_sample_rate):
+            return
+        self.logger.debug("%s : %s", label, PayloadTrace(payload, self.payload_trace_max_length))
+
+    def run_in_background(self, func):
+        """Exécute func dans un thread, sans bloquer la réponse en cours"""
+
+        def run():
+            try:
+                func()
+            except Exception:
+                self.logger.warning("Échec du rafraîchissement en arrière-plan", exc_info=True)
+            finally:
+                # Le thread ne doit pas garder ouverte une connexion à la base de données
+                connection.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def admit(self, critical=False, wait=None):
+        """Contrôle d'admission des appels vers APIMS, avant chaque appel.
+
+        Le budget admission_rate (appels par seconde) est partagé par les
+        workers et par les connecteurs d'une même instance iA.AES (voir
+        TokenBucket). Les écritures (critical) sont décomptées du budget sans
+        jamais attendre. Une lecture attend au plus wait secondes
+        (admission_queue_timeout par défaut), puis lève une APIError : get_json
+        sert alors la dernière réponse en cache si elle existe (voir
+        STALE_IF_ERROR), les autres lectures échouent.
+        """
+        if not self.admission_rate:
+            return
+        bucket = TokenBucket(cache, self.upstream_cache_key("admission", self.aes_instance), self.admission_rate)
+        if critical:
+            bucket.take()
+        elif not bucket.acquire(self.admission_queue_timeout if wait is None else wait):
+            raise APIError(
+                "iA.AES est momentanément surchargé, veuillez réessayer dans quelques instants.", http_status=503
+            )
+
+    def coalesced_get(self, url, generation="", **kwargs):
+        """GET vers APIMS partagé entre les workers qui demandent la même URL au même moment.
+
+        Un seul worker interroge APIMS, les autres attendent sa réponse (voir
+        run_once) et la réutilisent pendant COALESCING_WINDOW secondes. Lors
+        d'un afflux d'usagers, les requêtes identiques ne font ainsi qu'un seul
+        appel à APIMS. generation (voir read_generation) fait partie de la clé :
+        une réponse lue avant une écriture n'est pas partagée après.
+        """
+
+        def fetch():
+            # Pas d'attente du budget en tenant le verrou : le refus est partagé avec les requêtes en attente
+            self.admit(wait=0)
+            response = self.requests.get(url, **kwargs)
+            response.raise_for_status()
+            return response.json()
+
+        with self.shared_failures():
+            return run_once(cache, self.cache_key("coalesce", generation, url), fetch, self.COALESCING_WINDOW)
+
+    @staticmethod
+    @contextmanager
+    def shared_failures():
+        """Répond aux appels en attente avec le code HTTP de l'erreur du premier appel (voir run_once)"""
+        try:
+            yield
+        except SharedFailure as e:
+            raise APIError(str(e), http_status=e.status or 500)
+
+    def gather(self, *funcs):
+        """Exécute en parallèle des appels indépendants (fonctions sans argument) et renvoie leurs résultats.
+
+        Les appels utilisent la même session et les mêmes pools que les appels
+        séquentiels, avec au plus pool_maxsize threads (voir utils.gather).
+        Au-delà de GATHER_TIMEOUT secondes, une APIError est levée.
+        """
+
+        def call(func):
+            try:
+                return func()
+            finally:
+                # Comme en fin de requête, les connexions à la base de données des threads sont recyclées
+                close_old_connections()
+
+        try:
+            return gather(
+                *(partial(call, func) for func in funcs), max_workers=self.pool_maxsize, timeout=self.GATHER_TIMEOUT
+            )
+        except FutureTimeoutError:
+            raise APIError("iA.AES ne répond pas, veuillez réessayer dans quelques instants.", http_status=504)
+
+    def read_generation(self, scope):
+        """Génération des lectures en cache d'un parent ou d'un enfant, voir invalidate_reads"""
+        if not scope:
+            return ""
+        return Generation(cache, self.cache_key("swr", "generation", *scope)).value()
+
+    def invalidate_reads(self, *scope):
+        """Oublie les lectures en cache (get_json) d'un parent ("parent", id) ou d'un enfant ("child", id).
+
+        À appeler après chaque écriture qui les modifie : sans cela, la réponse
+        d'avant l'écriture resterait servie jusqu'à son expiration, voire
+        pendant STALE_WHILE_REVALIDATE ou STALE_IF_ERROR secondes.
+        """
+        Generation(cache, self.cache_key("swr", "generation", *scope)).bump()
+
+    def get_json(self, url, timeout, fields=None, scope=None, stale_if_error=None, **kwargs):
+        """Lecture d'APIMS mise en cache pendant timeout secondes, voir get_or_refresh.
+
+        Une fois expirée, la réponse est encore servie pendant STALE_WHILE_REVALIDATE
+        secondes le temps de la rafraîchir en arrière-plan, et pendant stale_if_error
+        secondes (STALE_IF_ERROR par défaut) si APIMS ne répond pas.
+
+        Avec fields, seuls ces champs sont gardés (voir project_fields), avant
+        la mise en cache : chaque projection a sa propre entrée, plus petite.
+
+        scope, ("parent", id) ou ("child", id), range l'entrée sous la
+        génération de ce parent ou de cet enfant : invalidate_reads l'oublie
+        après une écriture.
+
+        Returns
+        -------
+            tuple (données, stale), stale vaut None si les données sont fraîches
+        """
+        generation = self.read_generation(scope)
+        data, stale = get_or_refresh(
+            cache,
+            self.cache_key("swr", generation, url, fields or ""),
+            lambda: project_fields(self.coalesced_get(url, generation=generation, **kwargs), fields),
+            timeout,
+            self.STALE_WHILE_REVALIDATE,
+            self.STALE_IF_ERROR if stale_if_error is None else stale_if_error,
+            self.run_in_background,
+        )
+        if stale is not None:
+            self.logger.info("Réponse en cache servie pour %s : %s", url, stale)
+        return data, stale
+
+    def get_shared_reference(self, name, fetch, timeout):
+        """Donnée commune à toutes les instances d'APIMS (pays, localités), mise en cache par serveur APIMS.
+
+        Les connecteurs des différentes communes qui interrogent le même
+        server_url partagent une seule copie et un seul rafraîchissement : la
+        donnée est servie expirée pendant son rafraîchissement en arrière-plan
+        (voir get_or_refresh), et les connecteurs qui la demandent ensemble
+        quand elle est absente du cache attendent un seul appel à APIMS.
+        """
+        key = self.upstream_cache_key("reference", name)
+        value, stale = get_or_refresh(
+            cache,
+            key,
+            lambda: run_once(cache, f"{key}:fetch", fetch, self.COALESCING_WINDOW),
+            timeout,
+            self.STALE_WHILE_REVALIDATE,
+            self.STALE_IF_ERROR,
+            self.run_in_background,
+        )
+        if stale is not None:
+            self.logger.info("Donnée de référence %s servie depuis le cache : %s", name, stale)
+        return value
+
+    @staticmethod
+    def flag_stale(result, stale):
+        """Signale dans la réponse (clé meta) que les données servies sont expirées"""
+        if stale is not None and isinstance(result, dict):
+            result = dict(result, meta=stale)
+        return result
+
     ############
     ### Test ###
     ############
@@ -117,6 +460,17 @@ class ApimsAesConnector(BaseResource):
         url = self.server_url
         return self.requests.get(url).json()
 
+    @endpoint(
+        name="connection-pools",
+        perm="can_access",
+        description="Consulter l'utilisation des pools de connexions",
+        long_description="Pour chaque service distant : connexions ouvertes et réutilisées, requêtes envoyées et temps d'attente d'une connexion libre. Les mesures sont propres au worker qui répond.",
+        display_order=1,
+        display_category="Test",
+    )
+    def connection_pools(self, request):
+        return self.get_pool_adapter().metrics()
+
     ##########################
     ### Données génériques ###
     ##########################
@@ -128,13 +482,10 @@ class ApimsAesConnector(BaseResource):
         description="Lister les pays",
         long_description="Liste les pays de iA.AES",
         display_category="Données génériques",
-        cache_duration=3600,
     )
     # list_states instead of list_countries as list_countries didn't work, don't know why.
     def list_states(self, request):
-        url = f"{self.server_url}/{self.aes_instance}/countries"
-        response = self.requests.get(url)
-        return response.json()
+        return self.get_countries()
 
     @endpoint(
         name="countries",
@@ -198,8 +549,51 @@ class ApimsAesConnector(BaseResource):
     )
     def list_school_implantations(self, request):
         url = f"{self.server_url}/{self.aes_instance}/school-implantations"
-        response = self.requests.get(url).json()
-        return response
+        return self.coalesced_get(url)
+
+    def get_reference(self, part):
+        """Donnée de référence (voir REFERENCE_PATHS et les localités), mise en cache"""
+        if part == "localities":
+            return self.get_localities()
+        if part == "countries":
+            return self.get_countries()
+        url = f"{self.server_url}/{self.aes_instance}/{self.REFERENCE_PATHS[part]}"
+        return run_once(
+            cache, self.cache_key("reference", part), lambda: self.coalesced_get(url), self.REFERENCE_CACHE_DURATION
+        )
+
+    @endpoint(
+        name="reference-bundle",
+        methods=["get"],
+        perm="can_access",
+        description="Lister les données de référence des formulaires parent et enfant",
+        long_description="Renvoie en une seule réponse les pays, localités, niveaux, implantations scolaires, lieux d'accueil et catégories tarifaires, ou la partie demandée. La réponse porte une version (empreinte de son contenu) : si le client envoie la version qu'il a déjà, seules la version et unchanged sont renvoyées.",
+        parameters={
+            "parts": {
+                "description": "Données à renvoyer, séparées par des virgules (optionnel, toutes par défaut) : countries, localities, levels, school_implantations, places, price_categories",
+                "example_value": "countries,localities",
+            },
+            "version": {
+                "description": "Version déjà connue du client (optionnel)",
+                "example_value": "",
+            },
+        },
+        display_category="Données génériques",
+    )
+    def reference_bundle(self, request, parts=None, version=None):
+        available_parts = ["localities"] + list(self.REFERENCE_PATHS)
+        parts = [part.strip() for part in parts.split(",") if part.strip()] if parts else available_parts
+        unknown_parts = [part for part in parts if part not in available_parts]
+        if unknown_parts:
+            return HttpResponseBadRequest(
+                json.dumps({"parts": f"Unknown parts: {', '.join(unknown_parts)}"}), content_type="application/json"
+            )
+        parts = sorted(set(parts), key=available_parts.index)
+        bundle = dict(zip(parts, self.gather(*(partial(self.get_reference, part) for part in parts))))
+        bundle_version = payload_digest(bundle)[:16]
+        if version == bundle_version:
+            return {"version": bundle_version, "unchanged": True}
+        return {"version": bundle_version, "unchanged": False, "parts": bundle}
 
     ##############
     ### Utiles ###
@@ -207,18 +601,33 @@ class ApimsAesConnector(BaseResource):
 
     def get_localities(self):
         url = f"{self.server_url}/{self.aes_instance}/localities"
-        response = self.requests.get(url)
-        items = [
-            dict(
-                id=item["id"],
-                name=item["name"],
-                zip=item["zip"],
-                text=f"{item['zip']} - {item['name']}",
-            )
-            for item in response.json()["items"]
-        ]
-        result = dict(items=items, items_total=response.json()["items_total"])
-        return result
+
+        def fetch():
+            response = self.requests.get(url)
+            response.raise_for_status()
+            data = response.json()
+            items = [
+                dict(
+                    id=item["id"],
+                    name=item["name"],
+                    zip=item["zip"],
+                    text=f"{item['zip']} - {item['name']}",
+                )
+                for item in data["items"]
+            ]
+            return dict(items=items, items_total=data["items_total"])
+
+        return self.get_shared_reference("localities", fetch, self.LOCALITIES_CACHE_DURATION)
+
+    def get_countries(self):
+        url = f"{self.server_url}/{self.aes_instance}/countries"
+
+        def fetch():
+            response = self.requests.get(url)
+            response.raise_for_status()
+            return response.json()
+
+        return self.get_shared_reference("countries", fetch, self.COUNTRIES_CACHE_DURATION)
 
     def filter_localities_by_zipcode(self, zipcode):
         localities = [
@@ -266,9 +675,7 @@ class ApimsAesConnector(BaseResource):
         return filtered_localities
 
     def list_countries(self):
-        url = f"{self.server_url}/{self.aes_instance}/countries"
-        response = self.requests.get(url)
-        return response.json()["items"]
+        return self.get_countries()["items"]
 
     def search_country(self, country):
         aes_countries = self.list_countries()
@@ -308,7 +715,6 @@ class ApimsAesConnector(BaseResource):
         description="Lister les localités",
         long_description="Liste les localités et leurs codes postaux.",
         display_category="Localités",
-        cache_duration=600,
     )
     def list_localities(self, request):
         return self.get_localities()
@@ -393,8 +799,12 @@ class ApimsAesConnector(BaseResource):
         else:
             return HttpResponseBadRequest(f"{partner_type} is not a valid partner.")
         url = f"{self.server_url}/{self.aes_instance}/persons/{id}"
+        self.admit(critical=True)
         response = self.requests.patch(url, json=patch_data)
         response.raise_for_status()
+        self.invalidate_reads(partner_type, id)
+        # Le numéro national a pu changer : une recherche infructueuse ne doit plus être mémorisée
+        self.negative_cache("persons").invalidate()
         return True
 
     ##############
@@ -423,6 +833,9 @@ class ApimsAesConnector(BaseResource):
     def search_parent(
         self, request, national_number="", registration_number="", partner_type=""
     ):
+        lookup = ["parent", national_number, registration_number, partner_type]
+        if self.negative_cache("persons").get(lookup):
+            return {"parent_id": None}
         url = f"{self.server_url}/{self.aes_instance}/persons?national_number={national_number}&registration_number={registration_number}&partner_type={partner_type}"
         response = self.requests.get(url)
         response.raise_for_status()
@@ -430,6 +843,7 @@ class ApimsAesConnector(BaseResource):
             raise MultipleObjectsReturned
         if response.json()["items_total"] == 0:
             parent_id = None
+            self.negative_cache("persons").set(lookup)
         else:
             parent_id = response.json()["items"][0]["id"]
         return {"parent_id": parent_id}
@@ -440,16 +854,14 @@ class ApimsAesConnector(BaseResource):
         perm="can_access",
         description="Lire un parent",
         long_description="Lire un parent selon son identifiant dans iA.AES",
-        parameters={"parent_id": PARENT_PARAM},
+        parameters={"parent_id": PARENT_PARAM, "fields": FIELDS_PARAM},
         example_pattern="{parent_id}/",
         pattern="^(?P<parent_id>\w+)/$",
         display_category="Parent",
-        cache_duration=30,
     )
-    def read_parent(self, request, parent_id):
+    def read_parent(self, request, parent_id, fields=None):
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/"
-        response = self.requests.get(url).json()
-        return response
+        return self.flag_stale(*self.get_json(url, 30, fields=fields, scope=("parent", parent_id)))
 
     @endpoint(
         name="create-parent",
@@ -483,8 +895,10 @@ class ApimsAesConnector(BaseResource):
         else:
             parent["zip"] = post_data["zipcode"]
             parent["city"] = post_data["locality"]
+        self.admit(critical=True)
         response = self.requests.post(url, json=parent)
         response.raise_for_status()
+        self.negative_cache("persons").invalidate()
         return response.json()
 
     @endpoint(
@@ -497,7 +911,6 @@ class ApimsAesConnector(BaseResource):
         example_pattern="{parent_id}/children/",
         pattern="^(?P<parent_id>\w+)/children/$",
         display_category="Parent",
-        cache_duration=15,
     )
     def list_children(self, request, parent_id):
         try:
@@ -505,7 +918,7 @@ class ApimsAesConnector(BaseResource):
         except (ValueError, TypeError, ZeroDivisionError):
             return HttpResponseBadRequest('{"parent_id": "Must be an integer > 0"}', content_type="application/json")
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/kids"
-        response = self.requests.get(url).json()
+        response, stale = self.get_json(url, 15, scope=("parent", parent_id))
         result = []
         for child in response["items"]:
             result.append(
@@ -525,7 +938,7 @@ class ApimsAesConnector(BaseResource):
                     "responsibility_id": child["responsibility_id"],
                 }
             )
-        return {"items": result}
+        return self.flag_stale({"items": result}, stale)
 
     @endpoint(
         name="get-forms",
@@ -575,13 +988,41 @@ class ApimsAesConnector(BaseResource):
         return signed_forms_url_response.json()
 
     def get_school_implantations_with_meals(self):
-        """Return the list of school implantations offering meals as a list of int
+        """Return the school implantations offering meals, read once from the w.c.s. schema and cached
         Return
         ------
-            List of str
+            frozenset of int
         """
-        path = "api/formdefs/pp-repas-scolaires/schema"
-        return self.get_data_from_wcs(path)["options"]["implantations_scolaires_raw"]
+
+        def fetch():
+            path = "api/formdefs/pp-repas-scolaires/schema"
+            implantations = self.get_data_from_wcs(path)["options"]["implantations_scolaires_raw"]
+            return frozenset(int(implantation) for implantation in implantations if str(implantation).isdigit())
+
+        key = self.cache_key("wcs", "school-implantations-with-meals")
+        return run_once(cache, key, fetch, self.WCS_SCHEMA_CACHE_DURATION)
+
+    def compile_child_forms(self, forms):
+        """Prépare une seule fois les formulaires affichés pour chaque enfant sur la page d'accueil
+
+        Returns
+        -------
+            liste de dict : form (titre, slug et image), status (statut selon
+            que la fiche santé est valide ou non) et needs_meals (formulaire
+            réservé aux écoles qui proposent des repas)
+        """
+        return [
+            {
+                "form": {"title": form["title"], "slug": form["slug"], "image": self.FORMS_ICONS[form["slug"]]},
+                "status": {
+                    has_valid_healthsheet: self.set_form_status(form["slug"], has_valid_healthsheet)
+                    for has_valid_healthsheet in (True, False)
+                },
+                "needs_meals": "repas" in form["slug"],
+            }
+            for form in forms
+            if form["slug"] in self.FORMS_ICONS
+        ]
 
     def set_form_status(self, form_slug, has_valid_healthsheet):
         if form_slug == "pp-plaines-de-vacances":
@@ -682,24 +1123,35 @@ class ApimsAesConnector(BaseResource):
         if not parent_id.isdigit():
             return None
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/homepage"
-        response = self.requests.get(url)
-        response.raise_for_status()
-        consolidated_parent_id = response.json().get("parent_id")
-        if consolidated_parent_id != int(parent_id):
-            self.update_parent_id(
-                consolidated_parent_id, parent_uuid
-            )  # TODO should be done asynchronously
-        forms = self.get_data_from_wcs("api/categories/portail-parent/formdefs/")[
-            "data"
-        ]
+
+        def fetch_homepage():
+            self.admit()
+            response = self.requests.get(url)
+            response.raise_for_status()
+            return response.json()
+
+        # APIMS, w.c.s. (formulaires et demandes de l'usager) sont interrogés en parallèle
+        homepage, forms, has_plain_registrations = self.gather(
+            fetch_homepage,
+            lambda: self.get_data_from_wcs("api/categories/portail-parent/formdefs/")["data"],
+            partial(self.has_plain_registrations, parent_uuid),
+        )
+        consolidated_parent_id = homepage.get("parent_id")
         form_slugs = [form["slug"] for form in forms]
+        calls = []
+        if consolidated_parent_id != int(parent_id):
+            calls.append(partial(self.update_parent_id, consolidated_parent_id, parent_uuid))
+        if "pp-repas-scolaires" in form_slugs:
+            calls.append(self.get_school_implantations_with_meals)
+        results = self.gather(*calls)
         if "pp-repas-scolaires" in form_slugs:
-            school_implantations_with_meals = self.get_school_implantations_with_meals()
+            school_implantations_with_meals = results[-1]
         else:
-            school_implantations_with_meals = []
+            school_implantations_with_meals = frozenset()
+        form_templates = self.compile_child_forms(forms)
         result = dict(
             parent_id=consolidated_parent_id,
-            has_plain_registrations=self.has_plain_registrations(parent_uuid),
+            has_plain_registrations=has_plain_registrations,
             children=list(),
             is_update_child_available="pp-modifier-les-donnees-d-un-enfant"
             in form_slugs,
@@ -707,27 +1159,22 @@ class ApimsAesConnector(BaseResource):
             is_update_parent_available="pp-modifier-mes-donnees-parent" in form_slugs,
             is_become_invoiceable_available="pp-me-designer-facturable" in form_slugs,
         )
-        for child in response.json().get("children"):
+        for child in homepage.get("children"):
             child_forms = list()
             if child["invoiceable_parent_id"]:
+                has_meals = self.does_school_have_meals(
+                    child["school_implantation"], school_implantations_with_meals
+                )
+                has_valid_healthsheet = bool(child["has_valid_healthsheet"])
                 child_forms = [
                     {
-                        "title": form["title"],
-                        "slug": form["slug"],
-                        "status": self.set_form_status(
-                            form["slug"], child["has_valid_healthsheet"]
-                        ),
-                        "image": self.FORMS_ICONS[form["slug"]],
+                        "title": template["form"]["title"],
+                        "slug": template["form"]["slug"],
+                        "status": template["status"][has_valid_healthsheet],
+                        "image": template["form"]["image"],
                     }
-                    for form in forms
-                    if form["slug"] in self.FORMS_ICONS
-                    and (
-                        "repas" not in form["slug"]
-                        or self.does_school_have_meals(
-                            child["school_implantation"],
-                            school_implantations_with_meals,
-                        )
-                    )
+                    for template in form_templates
+                    if has_meals or not template["needs_meals"]
                 ]
             ts_child = dict(
                 id=child["id"],
@@ -757,12 +1204,13 @@ class ApimsAesConnector(BaseResource):
         long_description="Récupére les données contenue dans le endpoint homepage de apims",
         parameters={
             "parent_id": PARENT_PARAM,
+            "fields": FIELDS_PARAM,
         },
         example_pattern="{parent_id}/homepage_lite",
         pattern="^(?P<parent_id>\w+)/homepage_lite$",
         display_category="Parent",
     )
-    def homepage_lite(self, request, parent_id):
+    def homepage_lite(self, request, parent_id, fields=None):
         """Check and update user's aes_id and build parent portal data structure
 
         Parameters:
@@ -777,7 +1225,7 @@ class ApimsAesConnector(BaseResource):
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/homepage"
         response = self.requests.get(url)
         response.raise_for_status()
-        return response.json()
+        return project_fields(response.json(), fields)
 
 
     ##############
@@ -789,19 +1237,18 @@ class ApimsAesConnector(BaseResource):
         perm="can_access",
         description="Récupérer les infos enfants via l'id enfant",
         long_description="Récupérer les infos enfants via l'id enfant",
-        parameters={"child_id": CHILD_PARAM},
+        parameters={"child_id": CHILD_PARAM, "fields": FIELDS_PARAM},
         example_pattern="{child_id}/",
         pattern="^(?P<child_id>\w+)/$",
         display_category="Enfant",
-        cache_duration=15,
     )
-    def read_child(self, request, child_id):
+    def read_child(self, request, child_id, fields=None):
         from time import perf_counter
 
         t0 = perf_counter()
         url = f"{self.server_url}/{self.aes_instance}/kids/{child_id}"
-        logging.error(f"READ_CHILD {url} - temps : {perf_counter()-t0}")
-        result = self.requests.get(url).json()
+        result, stale = self.get_json(url, 15, fields=fields, scope=("child", child_id))
+        result = self.flag_stale(dict(result), stale)
         result["time"] = perf_counter() - t0
         return result
 
@@ -882,8 +1329,11 @@ class ApimsAesConnector(BaseResource):
         }
         if post_data["national_number"]:
             child["national_number"] = post_data["national_number"]
+        self.admit(critical=True)
         response = self.requests.post(url, json=child)
         response.raise_for_status()
+        self.negative_cache("persons").invalidate()
+        self.invalidate_reads("parent", parent_id)
         return response.json()
 
     @endpoint(
@@ -932,6 +1382,9 @@ class ApimsAesConnector(BaseResource):
             raise TypeError(
                 "You have to give either the national_number, or the lastname, firstname and birthdate."
             )
+        lookup = ["child", url_parameters]
+        if self.negative_cache("persons").get(lookup):
+            return {"child": None}
         url = f"{self.server_url}/{self.aes_instance}/persons?{url_parameters}"
         response = self.requests.get(url)
         response.raise_for_status()
@@ -939,6 +1392,7 @@ class ApimsAesConnector(BaseResource):
             child = response.json()["items"][0]
         elif response.json()["items_total"] == 0:
             child = None
+            self.negative_cache("persons").set(lookup)
         else:
             raise MultipleObjectsReturned(
                 "More than one child were found. A manual action is needed."
@@ -959,8 +1413,10 @@ class ApimsAesConnector(BaseResource):
     def add_parent_to_child(self, request, child_id):
         url = f"{self.server_url}/{self.aes_instance}/kids/{child_id}"
         parent = json.loads(request.body)
+        self.admit(critical=True)
         response = self.requests.patch(url, json=parent)
         response.raise_for_status()
+        self.invalidate_reads("child", child_id)
         return True
 
     @endpoint(
@@ -982,6 +1438,7 @@ class ApimsAesConnector(BaseResource):
     def update_responsibilities(self, request, responsibility_id):
         url = f"{self.server_url}/{self.aes_instance}/responsibilities/{responsibility_id}"
         data = json.loads(request.body)
+        self.admit(critical=True)
         response = self.requests.patch(url, json=data)
         response.raise_for_status()
         return HttpResponse(status=204)
@@ -996,36 +1453,45 @@ class ApimsAesConnector(BaseResource):
         perm="can_access",
         description="Lister les plaines disponibles pour un enfant",
         long_description="Retourne les plaines auxquelles l'enfant passé peut être inscrit.",
-        parameters={"child_id": CHILD_PARAM},
+        parameters={"child_id": CHILD_PARAM, "fields": FIELDS_PARAM},
         example_pattern="raw",
         pattern="^raw$",
         display_category="Plaines",
     )
-    def list_available_plains_raw(self, request, child_id):
+    def list_available_plains_raw(self, request, child_id, fields=None):
         url = f"{self.server_url}/{self.aes_instance}/plains?kid_id={child_id}"
-        response = self.requests.get(url)
-        return response.json()
+        return project_fields(self.coalesced_get(url), fields)
 
     @endpoint(
         name="plains",
         methods=["get"],
         perm="can_access",
         description="Lister les plaines disponibles pour un enfant",
-        long_description="Retourne les plaines auxquelles l'enfant passé peut être inscrit.",
+        long_description=(
+            "Retourne les plaines auxquelles l'enfant passé peut être inscrit. remaining_places vaut null "
+            "quand les places restantes n'ont pas pu être relues dans iA.AES."
+        ),
         parameters={"child_id": CHILD_PARAM},
         display_category="Plaines",
-        cache_duration=15,
     )
     def list_available_plains(self, request, child_id):
-        url = f"{self.server_url}/{self.aes_instance}/plains?kid_id={child_id}"
-        response = self.requests.get(url)
+        response, stale = self.get_eligible_plains(child_id)
+        # Les places restantes viennent du snapshot partagé, relu dans APIMS s'il a expiré
+        remaining_places = self.plain_availability().get_or_fetch(
+            [self.plain_availability_key(plain["id"], plain["age_group_manager_id"]) for plain in response],
+            lambda: self.fetch_plains(child_id),
+        )
 
         plains = []
-        for plain in response.json():
-            if plain["nb_remaining_place"] > 0:
-                plain["disabled"] = False
-            else:
-                plain["disabled"] = True
+        for plain in response:
+            key = self.plain_availability_key(plain["id"], plain["age_group_manager_id"])
+            if key in remaining_places:
+                plain["nb_remaining_place"] = remaining_places[key]
+            elif stale is not None:
+                # Snapshot non relu et liste lue il y a plus de PLAINS_CACHE_DURATION secondes :
+                # le nombre de places est inconnu, APIMS refusera l'inscription si la plaine est complète
+                plain["nb_remaining_place"] = None
+            plain["disabled"] = plain["nb_remaining_place"] is not None and plain["nb_remaining_place"] <= 0
             plains.append(plain)
 
         weeks, available_plains = set(), []
@@ -1067,6 +1533,54 @@ class ApimsAesConnector(BaseResource):
 
         return sorted(available_plains, key=lambda x: x["monday"])
 
+    def plain_availability(self):
+        """Places restantes par plaine et groupe d'âge, partagées par les workers et les enfants"""
+        return Snapshot(
+            cache, self.upstream_cache_key("plains-availability", self.aes_instance), self.PLAIN_AVAILABILITY_TTL
+        )
+
+    @staticmethod
+    def plain_availability_key(activity_id, age_group_manager_id):
+        return f"{activity_id}_{age_group_manager_id}"
+
+    def fetch_plains(self, child_id):
+        """Plaines proposées à un enfant, lues dans APIMS. Le snapshot des places restantes est rafraîchi au passage."""
+        url = f"{self.server_url}/{self.aes_instance}/plains?kid_id={child_id}"
+        self.admit()
+        response = self.requests.get(url)
+        response.raise_for_status()
+        plains = response.json()
+        self.plain_availability().update(
+            {
+                self.plain_availability_key(plain["id"], plain["age_group_manager_id"]): plain["nb_remaining_place"]
+                for plain in plains
+            }
+        )
+        return plains
+
+    def get_eligible_plains(self, child_id):
+        """Plaines proposées à un enfant, mises en cache (voir get_or_refresh et invalidate_eligible_plains).
+
+        Returns
+        -------
+            tuple (plaines, stale), stale valant None si la liste a moins de PLAINS_CACHE_DURATION secondes
+        """
+        plains, stale = get_or_refresh(
+            cache,
+            self.cache_key("plains-eligibility", child_id),
+            lambda: self.fetch_plains(child_id),
+            self.PLAINS_CACHE_DURATION,
+            self.STALE_WHILE_REVALIDATE,
+            self.STALE_IF_ERROR,
+            self.run_in_background,
+        )
+        if stale is not None:
+            self.logger.info("Plaines de l'enfant %s servies depuis le cache : %s", child_id, stale)
+        return plains, stale
+
+    def invalidate_eligible_plains(self, child_id):
+        cache.delete(self.cache_key("plains-eligibility", child_id))
+
     @endpoint(
         name="registrations",
         methods=["post"],
@@ -1099,9 +1613,21 @@ class ApimsAesConnector(BaseResource):
             "form_number": int(post_data["form_number"]),
             "plains": plains,
         }
-        response = self.requests.post(url, json=registrations)
-        response.raise_for_status()
-        return response.json()
+
+        def register():
+            self.admit(critical=True)
+            response = self.requests.post(url, json=registrations)
+            response.raise_for_status()
+            # Mise à jour immédiate des places restantes, sans attendre la relecture d'APIMS
+            availability = self.plain_availability()
+            for plain in plains:
+                availability.adjust(
+                    self.plain_availability_key(plain["activity_id"], plain["age_group_manager_id"]), -1
+                )
+            self.invalidate_eligible_plains(registrations["kid_id"])
+            return response.json()
+
+        return self.call_once("plain-registrations", post_data, register, scope=registrations["kid_id"])
 
     @endpoint(
         name="registrations",
@@ -1114,15 +1640,40 @@ class ApimsAesConnector(BaseResource):
             "registration_id": {
                 "description": "Identifiant de l'inscription",
                 "exemple_value": "19",
-            }
+            },
+            "activity_id": {
+                "description": "Identifiant de la plaine (optionnel), pour mettre à jour ses places restantes",
+                "example_value": "",
+            },
+            "age_group_manager_id": {
+                "description": "Identifiant du groupe d'âge de l'inscription (optionnel, avec activity_id)",
+                "example_value": "",
+            },
+            "child_id": {
+                "description": "Identifiant Odoo interne de l'enfant (optionnel), pour rafraîchir ses plaines proposées",
+                "example_value": "",
+            },
         },
         example_pattern="delete",
         pattern="^delete$",
     )
-    def delete_plain_registration(self, request, registration_id):
+    def delete_plain_registration(
+        self, request, registration_id, activity_id=None, age_group_manager_id=None, child_id=None
+    ):
         url = f"{self.server_url}/{self.aes_instance}/plains/registration/{registration_id}"
+        self.admit(critical=True)
         response = self.requests.delete(url)
         response.raise_for_status()
+        availability = self.plain_availability()
+        if activity_id and age_group_manager_id:
+            availability.adjust(self.plain_availability_key(activity_id, age_group_manager_id), 1)
+        else:
+            # La plaine libérée n'est pas connue : toutes les places restantes seront relues
+            availability.invalidate()
+        if child_id:
+            self.invalidate_eligible_plains(child_id)
+        # Une nouvelle inscription identique doit être envoyée à APIMS
+        self.forget_calls("plain-registrations", int(child_id) if child_id else None)
         return response.json()
 
     @endpoint(
@@ -1151,18 +1702,18 @@ class ApimsAesConnector(BaseResource):
         ----------
             school: int or str
                 id of school
-            school_implantations_with_meals: list of str
-                school implantations as a list of ids, can be empty
+            school_implantations_with_meals: set of int
+                school implantations as a set of ids, can be empty
         Return
         ------
             Bool
         """
-        if (
-            not school_implantations_with_meals
-            or str(school) in school_implantations_with_meals
-        ):
+        if not school_implantations_with_meals:
             return True
-        return False
+        try:
+            return int(school) in school_implantations_with_meals
+        except (TypeError, ValueError):
+            return False
 
     def is_in_time(self, scheduled, days_in_delay, no_later_than):
         """
@@ -1179,8 +1730,7 @@ class ApimsAesConnector(BaseResource):
         """
 
         def is_workday(day):
-            cal = Belgium()
-            return cal.is_working_day(date(day.year, day.month, day.day))
+            return get_belgian_calendar().is_working_day(date(day.year, day.month, day.day))
 
         now = datetime.now()
         if days_in_delay < 0:
@@ -1203,6 +1753,7 @@ class ApimsAesConnector(BaseResource):
 
     def get_meal_registrations(self, child_id, parent_id=None):
         url = f"{self.server_url}/{self.aes_instance}/school-meals/registrations?kid_id={child_id}"
+        self.admit()
         response = self.requests.get(url)
         response.raise_for_status()
         if isinstance(response.json(), list):
@@ -1228,16 +1779,60 @@ class ApimsAesConnector(BaseResource):
             reasons.append("Too late to register: the meal date has passed or is today")
         return disabled, " - ".join(reasons)
 
-    def get_month_menu(self, child_id, parent_id, month):
+    def menu_cache_prefix(self, child_id):
+        """Préfixe des clés du cache des menus d'un enfant, voir invalidate_menus"""
+        return self.cache_key(
+            "menus",
+            Generation(cache, self.cache_key("menus", "generation")).value(),
+            Generation(cache, self.cache_key("menus", "generation", child_id)).value(),
+            child_id,
+        )
+
+    def invalidate_menus(self, child_id=None):
+        """Oublie les menus en cache d'un enfant, ou de tous les enfants si child_id n'est pas connu"""
+        key = self.cache_key("menus", "generation", child_id) if child_id else self.cache_key("menus", "generation")
+        Generation(cache, key).bump()
+
+    def fetch_month_menu(self, child_id, month):
         url = f"{self.server_url}/{self.aes_instance}/menus?kid_id={child_id}&month={month}"
-        response = self.requests.get(url)
-        response.raise_for_status()
+        return self.coalesced_get(url)["items"]
+
+    def get_cached_month_menu(self, child_id, month):
+        """Menus d'un mois et inscriptions aux repas d'un enfant, mis en cache par (enfant, mois).
+
+        Au premier accès, les menus des trois mois proposés (SELECTABLE_MONTHS) et
+        les inscriptions de l'enfant sont chargés en parallèle : changer de mois
+        dans le formulaire ne refait pas d'appel à APIMS. Le cache est invalidé
+        par les inscriptions et désinscriptions aux repas (invalidate_menus).
+
+        Returns
+        -------
+            tuple (menus du mois, inscriptions de l'enfant)
+        """
+        prefix = self.menu_cache_prefix(child_id)
+        registrations_key = f"{prefix}:registrations"
+        menu_items, registrations = cache.get(f"{prefix}:month:{month}"), cache.get(registrations_key)
+        if menu_items is not None and registrations is not None:
+            return menu_items, registrations
+        months = self.SELECTABLE_MONTHS if month in self.SELECTABLE_MONTHS else (month,)
+        registrations, *month_menus = self.gather(
+            partial(self.get_meal_registrations, child_id),
+            *(partial(self.fetch_month_menu, child_id, m) for m in months),
+        )
+        menus = dict(zip(months, month_menus))
+        for selectable_month, items in menus.items():
+            cache.set(f"{prefix}:month:{selectable_month}", items, self.MENU_CACHE_DURATION)
+        cache.set(registrations_key, registrations, self.MENU_CACHE_DURATION)
+        return menus[month], registrations
+
+    def get_month_menu(self, child_id, parent_id, month):
+        menu_items, child_registrations = self.get_cached_month_menu(child_id, int(month))
         registrations = {
             f"_{self.reverse_date(registration['meal_date'], '-')}_{registration['meal_regime']}-{registration['meal_activity_id']}": registration
-            for registration in self.get_meal_registrations(child_id)
+            for registration in child_registrations
         }
         menus = []
-        for menu in response.json()["items"]:
+        for menu in menu_items:
             for meal in menu["meal_ids"]:
                 if isinstance(meal, dict):
                     meal_id = f"_{self.reverse_date(menu['date'], '-')}_{meal['regime']}-{meal['activity_id']}"
@@ -1334,13 +1929,10 @@ class ApimsAesConnector(BaseResource):
         example_pattern="activity-categories",
         pattern=r"^activity-categories$",
         display_category="Données génériques",
-        cache_duration=60,
     )
     def get_activity_categories(self, request):
         url = f"{self.server_url}/{self.aes_instance}/activity-categories"
-        response = self.requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
+        return self.flag_stale(*self.get_json(url, 60, timeout=10))
 
     @endpoint(
         name="activity_category_by_activity_on_portal",
@@ -1409,10 +2001,26 @@ class ApimsAesConnector(BaseResource):
 
     def reserve_balance(self, parent_id, data):
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/reserved-balances"
-        logging.info(f"Reserving {data}")
+        self.trace_payload("Réservation de solde", data)
+        self.admit(critical=True)
         response = self.requests.post(url, json=data)
         response.raise_for_status()
-        return response.json()
+        reserved_balance = response.json()
+        if isinstance(reserved_balance, dict) and reserved_balance.get("id") is not None:
+            self.remember_reserved_balance(parent_id, reserved_balance["id"])
+        return reserved_balance
+
+    def reserved_balances_key(self, parent_id):
+        return self.cache_key("reserved-balances", int(parent_id))
+
+    def remember_reserved_balance(self, parent_id, reserved_balance_id):
+        """Mémorise qu'un solde réservé appartient au parent, voir free_balances.
+
+        La lecture puis l'écriture ne sont pas atomiques : un identifiant perdu
+        lors de réservations simultanées est simplement débloqué seul.
+        """
+        key = self.reserved_balances_key(parent_id)
+        cache.set(key, (cache.get(key) or set()) | {int(reserved_balance_id)}, self.RESERVED_BALANCES_CACHE_DURATION)
 
     @endpoint(
         name="parents",
@@ -1444,6 +2052,8 @@ class ApimsAesConnector(BaseResource):
                 "Le mois ne peut avoir comme valeur que 0, 1, ou 2. Voir la description du paramètre pour en savoir plus."
             )
         if month is not None:
+            from dateutil.relativedelta import relativedelta
+
             reference_day = date.today() + relativedelta(months=int(month))
         return self.get_balance(
             parent_id,
@@ -1454,6 +2064,7 @@ class ApimsAesConnector(BaseResource):
         )
 
     def get_or_create_child_registration_line(self, data):
+        self.admit(critical=True)
         response = self.requests.post(
             f"{self.server_url}/{self.aes_instance}/school-meals/registrations/lines",
             json=data,
@@ -1500,7 +2111,17 @@ class ApimsAesConnector(BaseResource):
         # Récupération du solde du parent, en tenant compte d'une éventuelle commande pour la même période
         # et le même enfant
         activity_category_id = order[0].get("activity_category_id") or "meal"
+        # On récupére aussi la ligne d'inscription concernée. Les soldes réservés sont en effet
+        # liés à une ligne d'inscription.
+        child_registration_line = {
+            "kid_id": body["child_id"],
+            "parent_id": int(parent_id),
+            "school_implantation_id": int(body["school_implantation_id"]),
+            "month": int(body["month"]),
+            "year": int(body["year"]),
+        }
         balance = self.get_balance(parent_id, activity_category_id, body.get("child_id"), year, month)
+        child_registration_line_response = self.get_or_create_child_registration_line(child_registration_line)
 
         # Calcul du montant à payer et du solde à réserver
         due_amount_with_spent_balance = compute_amount_with_balance(round(total_amount, 2), round(balance['amount'],2), round(balance['already_reserved_amount'],2))
@@ -1510,21 +2131,6 @@ class ApimsAesConnector(BaseResource):
 
         # Maintenant qu'on connaît la part du solde du parent consommé pour diminuer son montant dû,
         # on réserve cette part dans AES en créant un "solde réservé" (reserved_balance).
-        child_registration_line_response = None
-        reserved_balance = None
-        # On récupére la ligne d'inscription concernée. Les soldes réservés sont en effet
-        # liés à une ligne d'inscription.
-        child_registration_line = {
-            "kid_id": body["child_id"],
-            "parent_id": int(parent_id),
-            "school_implantation_id": int(body["school_implantation_id"]),
-            "month": int(body["month"]),
-            "year": int(body["year"]),
-        }
-        child_registration_line_response = (
-            self.get_or_create_child_registration_line(child_registration_line)
-        )
-
         # S'il y a du solde à réserver : ça se passe ici.
         # Pour qu'il y ait du solde à réserver, il faut que ce montant soit d'au moins un centime.
         if spent_balance > 0.01:
@@ -1557,6 +2163,7 @@ class ApimsAesConnector(BaseResource):
         }
 
     def create_meals_payment(self, data):
+        self.admit(critical=True)
         response = self.requests.post(
             f"{self.server_url}/{self.aes_instance}/school-meals/payments", json=data
         )
@@ -1591,14 +2198,20 @@ class ApimsAesConnector(BaseResource):
                 "child_registration_line_id": body.get("child_registration_line_id", "")
             }
         )
+        self.invalidate_reads("parent", parent_id)
         return payment
 
     @endpoint(
         name="parents",
-        methods=["post"],
+        methods=["post", "delete"],
         perm="can_access",
-        description="Réserve du solde",
+        description="Réserve du solde ou débloque plusieurs soldes",
+        description_post="Réserve du solde",
+        description_delete="Débloque plusieurs soldes",
         long_description="Réserve du solde d'un parent pour le rendre non disponible pour d'autres commandes.",
+        long_description_post="Réserve du solde d'un parent pour le rendre non disponible pour d'autres commandes.",
+        long_description_delete="Supprime plusieurs blocages de soldes d'un parent. Le corps de la requête contient "
+        "la liste des identifiants à débloquer ({\"reserved_balance_ids\": [1, 2]}). Renvoie le résultat pour chaque identifiant.",
         display_category="Parent",
         parameters={
             "parent_id": PARENT_PARAM,
@@ -1606,6 +2219,16 @@ class ApimsAesConnector(BaseResource):
         example_pattern="{parent_id}/reserved-balances/",
         pattern="^(?P<parent_id>\d+)/reserved-balances/$",
     )
+    def parent_reserved_balances(self, request, parent_id):
+        methods = {
+            "POST": self.create_reserved_balance,
+            "DELETE": self.free_balances,
+        }
+        method = methods.get(request.method)
+        if method is None:
+            return HttpResponseNotAllowed(list(methods))
+        return method(request, parent_id)
+
     def create_reserved_balance(self, request, parent_id):
         body = json.loads(request.body)
         balance = {
@@ -1614,23 +2237,26 @@ class ApimsAesConnector(BaseResource):
                 "date": date.today().strftime("%Y-%m-%d"),
                 "reserving_request": int(body["form_number"]),
             }
-        child_registration_line_id = body.get("child_registration_line_id")
-        if child_registration_line_id is None or child_registration_line_id == "":
-            child_registration_line = {
-                "kid_id": body["child_id"],
-                "parent_id": int(parent_id),  # TODO: parent factu
-                "school_implantation_id": int(body["school_implantation_id"]),
-                "month": int(body["month"]),
-                "year": int(body["year"]),
-            }
-            child_registration_line_response = (
-                self.get_or_create_child_registration_line(child_registration_line)
-            )
-            balance["child_registration_line_id"] = child_registration_line_response["id"]
-        else:
-            balance["child_registration_line_id"] = body["child_registration_line_id"]
-        reserved_balance = self.reserve_balance(parent_id, balance)
-        return reserved_balance
+
+        def reserve():
+            child_registration_line_id = body.get("child_registration_line_id")
+            if child_registration_line_id is None or child_registration_line_id == "":
+                child_registration_line = {
+                    "kid_id": body["child_id"],
+                    "parent_id": int(parent_id),  # TODO: parent factu
+                    "school_implantation_id": int(body["school_implantation_id"]),
+                    "month": int(body["month"]),
+                    "year": int(body["year"]),
+                }
+                child_registration_line_response = (
+                    self.get_or_create_child_registration_line(child_registration_line)
+                )
+                balance["child_registration_line_id"] = child_registration_line_response["id"]
+            else:
+                balance["child_registration_line_id"] = body["child_registration_line_id"]
+            return self.reserve_balance(parent_id, balance)
+
+        return self.call_once("reserved-balance", dict(body, parent_id=parent_id), reserve, scope=int(parent_id))
 
     @endpoint(
         name="parents",
@@ -1651,32 +2277,97 @@ class ApimsAesConnector(BaseResource):
     )
     def free_balance(self, request, parent_id, reserved_balance_id):
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/reserved-balances/{reserved_balance_id}"
+        self.admit(critical=True)
         response = self.requests.delete(url)
         response.raise_for_status()
+        # Une nouvelle réservation identique doit être envoyée à APIMS
+        self.forget_calls("reserved-balance", int(parent_id))
         return True
 
-    # @endpoint(
-    #     name="parents",
-    #     methods=["delete"],
-    #     perm="can_access",
-    #     description="Débloque plusieurs soldes",
-    #     long_description="Supprime plusieurs blocages de soldes.",
-    #     display_category="Parent",
-    #     parameters={
-    #         "parent_id": PARENT_PARAM,
-    #     },
-    #     example_pattern="{parent_id}/reserved-balances/list",
-    #     pattern="^(?P<parent_id>\d+)/reserved-balances/list$",
-    # )
-    # def free_balances(self, request, parent_id):
-    #     data = json.loads(request.body)
-    #     for id in data[""]
-    #     for identifiant in data.get("details"):
-    #         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/reserved-balances/"
-    #         response = self.requests.delete(url)
-    #         response.raise_for_status()
-
-    #     return responses 
+    def free_balances(self, request, parent_id):
+        """Débloque plusieurs soldes réservés d'un parent.
+
+        La suppression par lot d'APIMS (reserved-balances) n'est pas limitée à
+        un parent : seuls les soldes dont on sait qu'ils ont été réservés pour
+        ce parent par le connecteur (voir remember_reserved_balance) y sont
+        envoyés, et le résultat de chaque identifiant est lu dans sa réponse.
+        Les autres soldes, et tous les soldes si l'appel par lot échoue
+        (route inconnue, erreur serveur, APIMS injoignable), sont débloqués
+        individuellement, en parallèle, par la route propre au parent. Un
+        refus (401, 403) est renvoyé tel quel. freed vaut None quand la
+        réponse par lot ne permet pas de savoir si le solde a été débloqué.
+        """
+        body = json.loads(request.body or "null")
+        if isinstance(body, dict):
+            body = body.get("reserved_balance_ids")
+        try:
+            if not isinstance(body, list):
+                raise TypeError
+            reserved_balance_ids = list(dict.fromkeys(int(id) for id in body))
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest(
+                '{"reserved_balance_ids": "Must be a list of integers"}', content_type="application/json"
+            )
+        if not reserved_balance_ids:
+            return {"data": []}
+        owned = cache.get(self.reserved_balances_key(parent_id)) or set()
+        bulk_ids = [id for id in reserved_balance_ids if id in owned]
+        results = {}
+        if bulk_ids:
+            url = f"{self.server_url}/{self.aes_instance}/reserved-balances"
+            try:
+                self.admit(critical=True)
+                response = self.requests.delete(url, json=bulk_ids)
+            except RequestException:
+                self.logger.warning("Échec du déblocage par lot des soldes du parent %s", parent_id, exc_info=True)
+                response = None
+            if response is not None and response.status_code in (401, 403):
+                response.raise_for_status()
+            if response is not None and response.ok:
+                results = self.read_bulk_release(response, bulk_ids)
+        # Une nouvelle réservation identique doit être envoyée à APIMS
+        self.forget_calls("reserved-balance", int(parent_id))
+
+        def free(reserved_balance_id):
+            url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/reserved-balances/{reserved_balance_id}"
+            try:
+                self.admit(critical=True)
+                response = self.requests.delete(url)
+            except Exception as e:
+                return {"id": reserved_balance_id, "freed": False, "status_code": None, "error": str(e)}
+            return {"id": reserved_balance_id, "freed": response.ok, "status_code": response.status_code}
+
+        remaining_ids = [id for id in reserved_balance_ids if id not in results]
+        results.update(zip(remaining_ids, self.gather(*(partial(free, id) for id in remaining_ids))))
+        return {"data": [results[id] for id in reserved_balance_ids]}
+
+    @staticmethod
+    def read_bulk_release(response, reserved_balance_ids):
+        """Résultat par identifiant d'une suppression par lot, lu dans la réponse d'APIMS.
+
+        La réponse peut lister les soldes supprimés (identifiants ou objets avec
+        un id) ; sans liste exploitable (204 par exemple), freed vaut None.
+        """
+        try:
+            deleted = response.json()
+        except ValueError:
+            deleted = None
+        freed_ids = None
+        if isinstance(deleted, list):
+            freed_ids = set()
+            for item in deleted:
+                try:
+                    freed_ids.add(int(item.get("id") if isinstance(item, dict) else item))
+                except (TypeError, ValueError):
+                    pass
+        return {
+            id: {
+                "id": id,
+                "freed": None if freed_ids is None else id in freed_ids,
+                "status_code": response.status_code,
+            }
+            for id in reserved_balance_ids
+        }
 
     @endpoint(
         name="menus",
@@ -1711,9 +2402,15 @@ class ApimsAesConnector(BaseResource):
         if not len(data["meals"]):
             return
         url = f"{self.server_url}/{self.aes_instance}/school-meals/registrations"
-        response = self.requests.post(url, json=data)
-        response.raise_for_status()
-        return response.json()
+
+        def register():
+            self.admit(critical=True)
+            response = self.requests.post(url, json=data)
+            response.raise_for_status()
+            self.invalidate_menus(post_data["child_id"])
+            return response.json()
+
+        return self.call_once("menu-registrations", post_data, register, scope=data["kid_id"])
 
     @endpoint(
         name="children",
@@ -1795,32 +2492,39 @@ class ApimsAesConnector(BaseResource):
         long_description="Retourne, pour un enfant donné, ses inscriptions futures brutes, dans le but de voir ce qui s'y passe.",
         parameters={
             "child_id": CHILD_PARAM,
+            "fields": FIELDS_PARAM,
         },
         example_pattern="{child_id}/registrations/raw",
         pattern="^(?P<child_id>\w+)/registrations/raw$",
         display_category="Repas",
     )
-    def get_meal_registrations_raw(self, request, child_id):
-        return self.get_meal_registrations(child_id=child_id)
+    def get_meal_registrations_raw(self, request, child_id, fields=None):
+        return project_fields(self.get_meal_registrations(child_id=child_id), fields)
 
     @endpoint(
         name="children",
         methods=["post"],
         perm="can_access",
         description="Désinscrire un enfant des repas",
-        long_description="Supprime des inscriptions aux repas dans iA.AES pour un enfant.",
+        long_description="Supprime des inscriptions aux repas dans iA.AES pour un enfant. Le champ child_id, facultatif, limite à cet enfant l'invalidation du cache des menus.",
         example_pattern="registrations/delete",
         pattern="^registrations/delete$",
         display_category="Repas",
     )
     def delete_menu_registration(self, request):
+        post_data = json.loads(request.body)
         data = dict()
         data["meals"] = [
-            meal["meal_detail_id"] for meal in json.loads(request.body).get("meals")
+            meal["meal_detail_id"] for meal in post_data.get("meals")
         ]
         url = f"{self.server_url}/{self.aes_instance}/school-meals/registrations/delete"
+        self.admit(critical=True)
         response = self.requests.post(url, json=data)
         response.raise_for_status()
+        # Sans child_id dans la demande, les menus et inscriptions mémorisées de tous les enfants sont oubliés
+        child_id = int(post_data["child_id"]) if post_data.get("child_id") else None
+        self.invalidate_menus(child_id)
+        self.forget_calls("menu-registrations", child_id)
         return response.json()
 
     ###################
@@ -1910,19 +2614,39 @@ class ApimsAesConnector(BaseResource):
             ]
         }
 
-    def has_valid_healthsheet(self, child_id):
+    def get_healthsheet(self, child_id):
+        """Fiche santé d'un enfant telle que renvoyée par APIMS, mise en cache jusqu'à sa mise à jour
+
+        La même fiche sert à read_healthsheet et has_valid_healthsheet : un
+        workflow qui appelle les deux ne la demande qu'une fois à APIMS.
+        """
+        key = self.cache_key("healthsheet", child_id)
+        data = cache.get(key)
+        if data is None:
+            data = self.fetch_healthsheet(child_id)
+            cache.set(key, data, self.HEALTHSHEET_CACHE_DURATION)
+        return data
+
+    def fetch_healthsheet(self, child_id):
+        """Fiche santé d'un enfant lue dans APIMS, sans cache"""
         url = f"{self.server_url}/{self.aes_instance}/kids/{child_id}/healthsheet"
         response = self.requests.get(url)
-        if response.status_code >= 400:
+        response.raise_for_status()
+        return response.json()[0]
+
+    def has_valid_healthsheet(self, child_id):
+        try:
+            data = self.get_healthsheet(child_id)
+        except HTTPError as e:
             return {
                 "is_valid": False,
-                "status_code": response.status_code,
-                "details": response.json(),
+                "status_code": e.response.status_code,
+                "details": e.response.json(),
             }
-        if response.json()[0]["__last_update"] == response.json()[0]["create_date"]:
+        if data["__last_update"] == data["create_date"]:
             return False
         healthsheet_last_update = datetime.strptime(
-            response.json()[0]["__last_update"][:10], "%Y-%m-%d"
+            data["__last_update"][:10], "%Y-%m-%d"
         )
         is_healthsheet_valid = 30 >= (datetime.today() - healthsheet_last_update).days
         return is_healthsheet_valid
@@ -1938,80 +2662,38 @@ class ApimsAesConnector(BaseResource):
         display_category="Fiche santé",
     )
     def read_healthsheet(self, request, child_id):
-        url = f"{self.server_url}/{self.aes_instance}/kids/{child_id}/healthsheet"
-        response = self.requests.get(url)
-        data = response.json()[0]
-        healthsheet = dict()
-        healthsheet["activity_no_available_reason"] = (
-            data["activity_no_available_reason"] or ""
-        )
-        healthsheet["activity_no_available_selection"] = data[
-            "activity_no_available_selection"
-        ]
-        healthsheet["activity_no_available_text"] = (
-            data["activity_no_available_text"] or ""
+        return healthsheet.to_form(self.get_healthsheet(child_id))
+
+    @endpoint(
+        name="children",
+        methods=["get"],
+        perm="can_access",
+        description="Charger le formulaire de fiche santé d'un enfant",
+        long_description="Renvoie en une seule réponse les questions, les champs, les autorisations obligatoires et facultatives, les allergies, les maladies et la fiche santé de l'enfant. Les appels à APIMS sont faits en parallèle et les listes de référence sont mises en cache.",
+        parameters={"child_id": CHILD_PARAM},
+        example_pattern="{child_id}/healthsheet/bootstrap",
+        pattern="^(?P<child_id>\w+)/healthsheet/bootstrap$",
+        display_category="Fiche santé",
+    )
+    def bootstrap_healthsheet(self, request, child_id):
+        fields, authorizations, data = self.gather(
+            self.get_healthsheet_fields, self.fetch_authorizations, partial(self.get_healthsheet, child_id)
         )
-        healthsheet["allergy_consequence"] = data["allergy_consequence"] or ""
-        healthsheet["allergy_ids"] = [
-            str(allergy["id"]) for allergy in data["allergy_ids"]
-        ]
-        healthsheet["allergy_selection"] = data["allergy_selection"]
-        healthsheet["allergy_treatment"] = data["allergy_treatment"] or ""
-        healthsheet["allowed_contact_ids"] = data["allowed_contact_ids"]
-        healthsheet["authorization_ids"] = data["authorization_ids"]
-        healthsheet["arnica"] = data["arnica"]
-        healthsheet["bike"] = data["bike"]
-        healthsheet["blood_type"] = data["blood_type"]
-        healthsheet["comment"] = data["comment"]
-        healthsheet["disease_ids"], healthsheet["disease_details"] = list(), list()
-        for disease in data["disease_ids"]:
-            healthsheet["disease_ids"].append(str(disease["disease_type_id"][0]))
-            healthsheet["disease_details"].append(
-                {
-                    "id": disease["disease_type_id"][0],
-                    "gravity": disease["gravity"] or "",
-                    "treatment": disease["disease_text"],
-                }
-            )
-        healthsheet["doctor_id"] = data["doctor_id"]
-        healthsheet["emotional_support"] = data["emotional_support"]
-        healthsheet["facebook"] = data["facebook"]
-        healthsheet["first_date_tetanus"] = data["first_date_tetanus"]
-        healthsheet["handicap_selection"] = data["handicap_selection"]
-        healthsheet["has_medication"] = (
-            "yes" if len(data["medication_ids"]) > 0 else "not_specified"
+        # Les allergies et maladies proposées dépendent de la fiche santé
+        allergies, diseases = self.gather(
+            partial(self.fetch_allergies, data["id"]), partial(self.fetch_diseases, data["id"])
         )
-        healthsheet["hearing_aid"] = data["hearing_aid"]
-        healthsheet["glasses"] = data["glasses"]
-        healthsheet["id"] = data["id"]
-        healthsheet["intervention_text"] = data["intervention_text"] or ""
-        healthsheet["intervention_selection"] = data["intervention_selection"]
-        healthsheet["last_date_tetanus"] = data["last_date_tetanus"]
-        healthsheet["level_handicap"] = data["level_handicap"]
-        healthsheet["medication_ids"] = [
-            {
-                "name": medication["name"],
-                "quantity": medication["quantity"],
-                "period": medication["period"],
-                "self_medication": medication["self_medication_selection"],
-            }
-            for medication in data["medication_ids"]
-        ]
-        healthsheet["mutuality"] = data["mutuality"] or ""
-        healthsheet["nap"] = data["nap"]
-        # healthsheet["medication_type_selection"] = data.get("medication_type_selection") or []
-        healthsheet["photo"] = data["photo"]
-        healthsheet["photo_general"] = data["photo_general"]
-        healthsheet["self_medication"] = data["self_medication"]
-        healthsheet["specific_regime_selection"] = data["specific_regime_selection"]
-        healthsheet["specific_regime_text"] = data["specific_regime_text"] or ""
-        healthsheet["swim"] = data["swim"]
-        healthsheet["swim_level"] = data["swim_level"]
-        healthsheet["tetanus_selection"] = data["tetanus_selection"]
-        healthsheet["to_go_alone"] = data["to_go_alone"]
-        healthsheet["type_handicap"] = data["type_handicap"]
-        healthsheet["weight"] = data["weight"] or ""
-        return healthsheet
+        return {
+            "questions": self.healthsheet_questions(request)["data"],
+            "fields": fields,
+            "authorizations": {
+                "mandatory": self.filter_authorizations(authorizations, "mandatory")["data"],
+                "optional": self.filter_authorizations(authorizations, "optional")["data"],
+            },
+            "allergies": allergies["data"],
+            "diseases": diseases["data"],
+            "healthsheet": healthsheet.to_form(data),
+        }
 
     @endpoint(
         name="children",
@@ -2024,121 +2706,22 @@ class ApimsAesConnector(BaseResource):
         display_category="Fiche santé",
     )
     def update_healthsheet(self, request, child_id):
-        origin_data = json.loads(request.body)
-        put_data = dict()
-        # prepare authorizations
-        authorizations = list()
-        if origin_data["mandatory_authorizations"]:
-            authorizations += origin_data["mandatory_authorizations"]
-        if origin_data["optional_authorizations"]:
-            authorizations += origin_data["optional_authorizations"]
-        # prepare put_data
-        if origin_data["activity_no_available_reason"]:
-            put_data["activity_no_available_reason"] = origin_data[
-                "activity_no_available_reason"
-            ]
-        if origin_data["allergy_consequence"] and (
-            origin_data["allergy_ids"] or origin_data["other_allergies"]
-        ):
-            put_data["allergy_consequence"] = origin_data["allergy_consequence"]
-        else:
-            put_data["allergy_consequence"] = ""
-        put_data["allergy_ids"] = (
-            [int(allergy) for allergy in origin_data["allergy_ids"]]
-            if origin_data["allergy_ids"]
-            else list()
-        )
-        if origin_data["allergy_treatment"] and (
-            origin_data["allergy_ids"] or origin_data["other_allergies"]
-        ):
-            put_data["allergy_treatment"] = origin_data["allergy_treatment"]
-        else:
-            put_data["allergy_treatment"] = ""
-        if origin_data["arnica"]:
-            put_data["arnica"] = origin_data["arnica"]
-        put_data["authorization_ids"] = [
-            int(authorization) for authorization in authorizations
-        ]
-        if origin_data["bike"]:
-            put_data["bike"] = origin_data["bike"]
-        if origin_data["blood_type"]:
-            put_data["blood_type"] = origin_data["blood_type"]
-        if origin_data["comment"]:
-            put_data["comment"] = origin_data["comment"]
-        if origin_data["child_id"]:
-            put_data["child_id"] = int(origin_data["child_id"])
-        if origin_data["doctor_id"]:
-            put_data["doctor_id"] = origin_data["doctor_id"]
-        if origin_data["emotional_support"]:
-            put_data["emotional_support"] = origin_data["emotional_support"]
-        if origin_data["facebook"]:
-            put_data["facebook"] = origin_data["facebook"]
-        if origin_data["first_date_tetanus"]:
-            put_data["first_date_tetanus"] = origin_data["first_date_tetanus"]
-        if origin_data["glasses"]:
-            put_data["glasses"] = origin_data["glasses"]
-        if origin_data["hearing_aid"]:
-            put_data["hearing_aid"] = origin_data["hearing_aid"]
-        if origin_data["last_date_tetanus"]:
-            put_data["last_date_tetanus"] = origin_data["last_date_tetanus"]
-        if origin_data["level_handicap"]:
-            put_data["level_handicap"] = origin_data["level_handicap"]
-        if origin_data["medications"]:
-            put_data["medication_ids"] = origin_data["medications"]
-        if origin_data["mutuality"]:
-            put_data["mutuality"] = origin_data["mutuality"]
-        if origin_data["nap"]:
-            put_data["nap"] = origin_data["nap"]
-        if origin_data["other_allergies"]:
-            # As other_allergies is a list of dict ([{"name": "other allergie 1"}]), we need to make it a list of string ["other allergie 1"].
-            put_data["other_allergies"] = [
-                allergy["name"] for allergy in origin_data["other_allergies"]
-            ]
-        if origin_data["photo"]:
-            put_data["photo"] = origin_data["photo"]
-        if origin_data["photo_general"]:
-            put_data["photo_general"] = origin_data["photo_general"]
-        if origin_data["swim"]:
-            put_data["swim"] = origin_data["swim"]
-        if origin_data["swim_level"]:
-            put_data["swim_level"] = origin_data["swim_level"]
-        if origin_data["to_go_alone"]:
-            put_data["to_go_alone"] = origin_data["to_go_alone"]
-        if origin_data["type_handicap"]:
-            put_data["type_handicap"] = origin_data["type_handicap"]
-        if origin_data["weight"]:
-            put_data["weight"] = origin_data["weight"]
-        allowed_contact_ids = []
-        for key, value in origin_data.items():
-            if ("selection" in key or "text" in key) and value:
-                put_data[key] = value or ""
-            elif "contact" in key:
-                contact = value.split(" ; ")
-                if contact[0]:
-                    allowed_contact_ids.append(
-                        {"partner_id": int(contact[0]), "parental_link": contact[1]}
-                    )
-        disease_ids = []
-        other_diseases = []
-        for disease in origin_data["diseases"]:
-            disease_id = {
-                "gravity": disease["gravity"],
-                "disease_text": disease["treatment"],
-                "health_sheet_id": origin_data["healthsheet_id"],
-            }
-            if disease["disease"] != "autre":
-                disease_id.update({"disease_type_id": int(disease["disease"])})
-                disease_ids.append(disease_id)
-            else:
-                disease_id.update({"name": disease["other_disease"]})
-                other_diseases.append(disease_id)
-        put_data["disease_ids"] = disease_ids
-        put_data["other_diseases"] = other_diseases
-        if allowed_contact_ids:
-            put_data["allowed_contact_ids"] = allowed_contact_ids
+        put_data = healthsheet.to_update(json.loads(request.body))
+        try:
+            # Fiche relue sans cache : comparée à une fiche en cache, une modification pourrait être perdue
+            current = self.fetch_healthsheet(child_id)
+        except (RequestException, IndexError):
+            # Sans la fiche actuelle (erreur, APIMS injoignable, aucune fiche), la fiche est envoyée entière
+            current = None
+        if current is not None:
+            # Même sans modification, la fiche est envoyée (au moins child_id) : APIMS
+            # met à jour sa date de dernière modification, dont dépend has_valid_healthsheet
+            put_data = healthsheet.diff(put_data, current)
         url = f"{self.server_url}/{self.aes_instance}/kids/{child_id}/healthsheet"
+        self.admit(critical=True)
         response = self.requests.put(url, json=put_data)
         response.raise_for_status()
+        cache.delete(self.cache_key("healthsheet", child_id))
         return True
 
     @endpoint(
@@ -2151,8 +2734,21 @@ class ApimsAesConnector(BaseResource):
         display_category="Fiche santé",
     )
     def list_healthsheet_fields(self, request):
+        return self.get_healthsheet_fields()
+
+    def get_healthsheet_fields(self):
+        return run_once(
+            cache,
+            self.cache_key("healthsheet-reference", "fields"),
+            self.fetch_healthsheet_fields,
+            self.HEALTHSHEET_REFERENCE_CACHE_DURATION,
+        )
+
+    def fetch_healthsheet_fields(self):
         url = f"{self.server_url}/{self.aes_instance}/models/healthsheet"
-        response = self.requests.get(url).json()
+        response = self.requests.get(url)
+        response.raise_for_status()
+        response = response.json()
         result = dict()
         for k, v in response.items():
             if isinstance(v, dict):
@@ -2198,8 +2794,20 @@ class ApimsAesConnector(BaseResource):
             raise ValueError(
                 f"Filter value '{filter}' is unknown. It must be 'mandatory' or 'optional'."
             )
-        url = f"{self.server_url}/{self.aes_instance}/authorizations"
-        response = self.requests.get(url).json()
+        return self.filter_authorizations(self.fetch_authorizations(), filter)
+
+    def fetch_authorizations(self):
+        def fetch():
+            url = f"{self.server_url}/{self.aes_instance}/authorizations"
+            response = self.requests.get(url)
+            response.raise_for_status()
+            return response.json()
+
+        key = self.cache_key("healthsheet-reference", "authorizations")
+        return run_once(cache, key, fetch, self.HEALTHSHEET_REFERENCE_CACHE_DURATION)
+
+    @staticmethod
+    def filter_authorizations(response, filter):
         if not filter:
             return response
         if filter == "mandatory":
@@ -2231,18 +2839,24 @@ class ApimsAesConnector(BaseResource):
         cache_duration=60,
     )
     def list_allergies(self, request, healthsheet=None):
-        url = f"{self.server_url}/{self.aes_instance}/allergies"
-        if healthsheet:
-            url += f"?health_sheet_id={healthsheet}"
-        response = self.requests.get(url)
-        response.raise_for_status()
-        result = dict(
-            data=[
-                {"id": str(allergy["id"]), "name": allergy["name"]}
-                for allergy in response.json()["data"]
-            ]
-        )
-        return result
+        return self.fetch_allergies(healthsheet)
+
+    def fetch_allergies(self, healthsheet=None):
+        def fetch():
+            url = f"{self.server_url}/{self.aes_instance}/allergies"
+            if healthsheet:
+                url += f"?health_sheet_id={healthsheet}"
+            response = self.requests.get(url)
+            response.raise_for_status()
+            return dict(
+                data=[
+                    {"id": str(allergy["id"]), "name": allergy["name"]}
+                    for allergy in response.json()["data"]
+                ]
+            )
+
+        key = self.cache_key("healthsheet-reference", "allergies", healthsheet or "")
+        return run_once(cache, key, fetch, self.HEALTHSHEET_REFERENCE_CACHE_DURATION)
 
     @endpoint(
         name="diseases",
@@ -2263,12 +2877,19 @@ class ApimsAesConnector(BaseResource):
         cache_duration=60,
     )
     def list_diseases(self, request, healthsheet=None):
-        url = f"{self.server_url}/{self.aes_instance}/diseases"
-        if healthsheet:
-            url += f"?health_sheet_id={healthsheet}"
-        response = self.requests.get(url)
-        response.raise_for_status()
-        return response.json()
+        return self.fetch_diseases(healthsheet)
+
+    def fetch_diseases(self, healthsheet=None):
+        def fetch():
+            url = f"{self.server_url}/{self.aes_instance}/diseases"
+            if healthsheet:
+                url += f"?health_sheet_id={healthsheet}"
+            response = self.requests.get(url)
+            response.raise_for_status()
+            return response.json()
+
+        key = self.cache_key("healthsheet-reference", "diseases", healthsheet or "")
+        return run_once(cache, key, fetch, self.HEALTHSHEET_REFERENCE_CACHE_DURATION)
 
     ################
     ### Contacts ###
@@ -2303,6 +2924,7 @@ class ApimsAesConnector(BaseResource):
             "zip": post_data.get("zipcode") or "",
             "city": post_data.get("city") or "",
         }
+        self.admit(critical=True)
         response = self.requests.post(url, json=contact)
         response.raise_for_status()
         return response.json()
@@ -2337,6 +2959,7 @@ class ApimsAesConnector(BaseResource):
         else:
             doctor["zip"] = post_data["zip"]
             doctor["city"] = post_data["city"]
+        self.admit(critical=True)
         response = self.requests.post(url, json=doctor)
         response.raise_for_status()
         return response.json()
@@ -2352,15 +2975,17 @@ class ApimsAesConnector(BaseResource):
         description="Lister les factures d'un parent",
         parameters={
             "parent_id": PARENT_PARAM,
+            "fields": FIELDS_PARAM,
         },
         example_pattern="{parent_id}/invoices/",
         pattern="^(?P<parent_id>\w+)/invoices/$",
         display_category="Parent",
-        cache_duration=300
     )
-    def list_invoices(self, request, parent_id):
+    def list_invoices(self, request, parent_id, fields=None):
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/invoices"
-        return self.requests.get(url).json()
+        # Pas de facture en cache si APIMS ne répond pas : une facture payée serait affichée impayée
+        invoices = self.get_json(url, 300, fields=fields, scope=("parent", parent_id), stale_if_error=0)
+        return self.flag_stale(*invoices)
 
     @endpoint(
         name="parents",
@@ -2391,9 +3016,11 @@ class ApimsAesConnector(BaseResource):
             "online_transaction_id": post_data["transaction_id"],
             "prepayment_by_category_id": post_data["prepayment_by_category_id"],
         }
-        logger.info(f"POST_DATA:", post_data)
+        self.trace_payload("Paiement de facture", post_data)
+        self.admit(critical=True)
         response = self.requests.post(url, json=payment)
         response.raise_for_status()
+        self.invalidate_reads("parent", parent_id)
         return response.json()
 
     ################
@@ -2407,15 +3034,15 @@ class ApimsAesConnector(BaseResource):
         description="Lister les attestations d'un parent",
         parameters={
             "parent_id": PARENT_PARAM,
+            "fields": FIELDS_PARAM,
         },
         example_pattern="{parent_id}/certificates/",
         pattern="^(?P<parent_id>\w+)/certificates/$",
         display_category="Parent",
-        cache_duration=300
     )
-    def list_certificates(self, request, parent_id):
+    def list_certificates(self, request, parent_id, fields=None):
         url = f"{self.server_url}/{self.aes_instance}/parents/{parent_id}/certificates"
-        return self.requests.get(url).json()
+        return self.flag_stale(*self.get_json(url, 300, fields=fields, scope=("parent", parent_id)))
 
     ################
     ### Paiement ###
@@ -2438,8 +3065,10 @@ class ApimsAesConnector(BaseResource):
             "amount": float(post_data["amount"].replace(",", ".")),
             "comment": post_data["comment"],
         }
+        self.admit(critical=True)
         response = self.requests.post(url, json=payment)
         response.raise_for_status()
+        self.invalidate_reads("parent", payment["parent_id"])
         return response.json()
 
     @endpoint(
@@ -2470,10 +3099,17 @@ class ApimsAesConnector(BaseResource):
             if detail.get("child_registration_line_id") is not None:
                 payment.update({"child_registration_line_id": detail["child_registration_line_id"]})
             payments.append(payment)
-        response = self.requests.post(url, json=payments)
-        response.raise_for_status()
-        logging.info(f"Response payment creation: {response.json()}")
-        return response.json()
+
+        def pay():
+            self.admit(critical=True)
+            response = self.requests.post(url, json=payments)
+            response.raise_for_status()
+            for parent_id in {payment["parent_id"] for payment in payments}:
+                self.invalidate_reads("parent", parent_id)
+            self.trace_payload("Paiements créés", response.json())
+            return response.json()
+
+        return self.call_once("payments", post_data, pay)
 
     ###################
     ### Utilitaires ###
@@ -2524,33 +3160,12 @@ class ApimsAesConnector(BaseResource):
     @staticmethod
     def format_date(date_str):
         """Formate une date 'YYYY-MM-DD' en 'Vendredi 18 juillet 2025'"""
-        jours = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
-        mois = [
-            'janvier', 'février', 'mars', 'avril', 'mai', 'juin',
-            'juillet', 'août', 'septembre', 'octobre', 'novembre', 'décembre'
-        ]
-        try:
-            d = datetime.strptime(date_str, "%Y-%m-%d").date()
-            return f"{jours[d.weekday()]} {d.day} {mois[d.month - 1]} {d.year}"
-        except Exception:
-            return date_str 
-        
+        return decorations.format_date(date_str)
+
     @staticmethod
     def parse_french_date(text_date):
         """Convertit une date 'Jeudi 23 octobre 2025' en '2025-10-23'"""
-        mois = {
-            'janvier': 1, 'février': 2, 'mars': 3, 'avril': 4, 'mai': 5, 'juin': 6,
-            'juillet': 7, 'août': 8, 'septembre': 9, 'octobre': 10,
-            'novembre': 11, 'décembre': 12
-        }
-        try:
-            parts = text_date.split(" ")  # ['Jeudi', '23', 'octobre', '2025']
-            jour = int(parts[1])
-            mois_num = mois[parts[2].lower()]
-            annee = int(parts[3])
-            return f"{annee:04d}-{mois_num:02d}-{jour:02d}"
-        except Exception:
-            return text_date  # fallback si ça plante
+        return decorations.parse_french_date(text_date)
 
     
     ###########################
@@ -2558,10 +3173,30 @@ class ApimsAesConnector(BaseResource):
     ###########################
 
     def fetch_pedagogical_days(self, parent_id):
+        """Lit toutes les journées pédagogiques d'un parent.
+
+        Le résultat est mis en cache quelques secondes par parent, quelle que
+        soit la fenêtre de dates demandée : les endpoints de listing appelés
+        lors d'une même démarche n'interrogent APIMS qu'une fois et filtrent
+        ensuite les dates eux-mêmes (voir decorate_pedagogical_days).
+        """
+        key = self.cache_key("pedagogical-days", parent_id)
+        data = cache.get(key)
+        if data is not None:
+            return data
         url = f"{self.server_url}/{self.aes_instance}/pedagogical-days?parent_id={parent_id}"
         response = self.requests.get(url)
         response.raise_for_status()
-        return response.json()
+        data = response.json()
+        cache.set(key, data, self.PEDAGOGICAL_DAYS_CACHE_DURATION)
+        return data
+
+    def get_pedagogical_days_window(self, start_date, end_date):
+        """Convertit des délais en jours (à partir d'aujourd'hui) en dates, None si le délai n'est pas donné"""
+        return (
+            date.today() + timedelta(days=int(start_date)) if start_date not in (None, "") else None,
+            date.today() + timedelta(days=int(end_date)) if end_date not in (None, "") else None,
+        )
 
     @endpoint(
         name="pedagogical-days",
@@ -2587,26 +3222,9 @@ class ApimsAesConnector(BaseResource):
     )
 
     def list_pedagogical_days(self, request, parent_id, end_date=None, start_date=1):
-        data = self.fetch_pedagogical_days(parent_id) 
-
-        start_date = date.today() + timedelta(int(start_date))
-        end_date = date.today() + timedelta(int(end_date))
-        pedagogical_days = []
-
-        for item in data.get("items", []):
-            item_date = date.fromisoformat(item["date"])
-            logging.info(f"Item date: {item_date}, Start date: {start_date}, End date: {end_date}")
-            logging.info(f"expression end: {end_date is None} or {item_date <= end_date}")
-            logging.info(f"expression start: {(item_date >= start_date)}")
-            if (end_date is None or item_date <= end_date) and (item_date >= start_date):
-                item['text'] = f"{item['child_lastname']} {item['child_firstname']}"
-                item['disabled'] = item.get('is_child_already_registered') or not item.get('invoiceable_parent_id')
-                item['id'] = f"{item['activity_id']}_{item['activity_date_id']}_{item['child_id']}"
-                d = date.fromisoformat(item['date'])
-                item['group_by'] = f"{JOURS[d.weekday()]} {d.day} {MOIS[d.month - 1]} {d.year}".capitalize()
-                pedagogical_days.append(item)
-        data["items"] = pedagogical_days
-          
+        start_date, end_date = self.get_pedagogical_days_window(start_date, end_date)
+        data = dict(self.fetch_pedagogical_days(parent_id))
+        data["items"] = list(decorations.decorate_pedagogical_days(data.get("items", []), start_date, end_date))
         return data
 
     @endpoint(
@@ -2623,18 +3241,22 @@ class ApimsAesConnector(BaseResource):
                 "example_value": 279,
                 "description": "ID du parent"
             },
+            "end_date": {
+                "description": "Délai en jours pour masquer les dates au-delà (optionnel)",
+                "example_value": 30
+            },
+            "start_date": {
+                "description": "Délai en jours pour masquer les dates en deçà (optionnel)",
+                "example_value": 1
+            },
         }
     )
-    def list_pedagogical_days_per_dates(self, request, parent_id):
+    def list_pedagogical_days_per_dates(self, request, parent_id, end_date=None, start_date=None):
+        start_date, end_date = self.get_pedagogical_days_window(start_date, end_date)
         data = self.fetch_pedagogical_days(parent_id)
         items = {}
-        for item in data.get("items", []):
-            if items.get(item["date"]) is None:
-                items[item["date"]] = []
-            item["text"] = f"{item['child_lastname']} {item['child_firstname']}"
-            item["disabled"] = item["is_child_already_registered"]
-            item["id"] = f"{item['activity_id']}_{item['activity_date_id']}_{item['child_id']}"
-            items[item["date"]].append(item)
+        for item in decorations.decorate_pedagogical_days(data.get("items", []), start_date, end_date):
+            items.setdefault(item["date"], []).append(item)
         result = {"data": [{"id": k,"text": k,"registrations": v} for k,v in items.items()]}
         return result
 
@@ -2650,7 +3272,6 @@ class ApimsAesConnector(BaseResource):
     )
     def create_generic_registrations(self, request):
         post_data = json.loads(request.body)
-        logger.info(f"Données : {post_data}")
         url = f"{self.server_url}/{self.aes_instance}/generic-activities"
         registrations = []
         for registration in post_data["registrations"]:
@@ -2663,10 +3284,16 @@ class ApimsAesConnector(BaseResource):
             })
         
         payload = {"registrations": registrations}
-        logger.info(payload)
-        response = self.requests.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()
+        self.trace_payload("Inscriptions aux activités génériques", payload)
+
+        def register():
+            self.admit(critical=True)
+            response = self.requests.post(url, json=payload)
+            response.raise_for_status()
+            self.negative_cache("generic-activities-registrations").invalidate()
+            return response.json()
+
+        return self.call_once("generic-registrations", post_data, register)
     
     @endpoint(
         name="generic-activities",
@@ -2705,20 +3332,21 @@ class ApimsAesConnector(BaseResource):
         url = f"{self.server_url}/{self.aes_instance}/generic-activities/registrations"
         if parameters:
             url = url + "?" + "&".join(parameters)
+        not_found = self.negative_cache("generic-activities-registrations").get(parameters)
+        if not_found:
+            raise Http404(not_found)
         response = self.requests.get(url)
         if response.status_code == 404:
+            self.negative_cache("generic-activities-registrations").set(parameters, response.json()["detail"])
             raise Http404(response.json()["detail"])
         response.raise_for_status()
-        items = response.json().get("items", [])
-        result = []
-        for item in items:
-            d = date.fromisoformat(item["date"])
-            item_date = datetime.fromisoformat(item["date"])
-            if self.is_in_time(item_date, days_in_delay, time.fromisoformat(no_later_than)):
-                item['group_by'] = f"{JOURS[d.weekday()]} {d.day} {MOIS[d.month - 1]} {d.year}".capitalize()
-                item["text"] = item["child_name"]
-                item["id"] = f"{item['child_registration_line_id']}_{item['day']}"
-                result.append(item)
+        no_later_than = time.fromisoformat(no_later_than)
+        result = decorations.decorate_generic_registrations(
+            response.json().get("items", []),
+            keep=lambda item, item_date: self.is_in_time(
+                datetime.combine(item_date, time()), days_in_delay, no_later_than
+            ),
+        )
         return {"data": sorted(result, key=lambda i: i["date"])}
 
     @endpoint(
@@ -2740,6 +3368,7 @@ class ApimsAesConnector(BaseResource):
                 data[str(registration["child_registration_line_id"])] = [registration["day"]]
             else:
                 data[str(registration["child_registration_line_id"])].append(registration["day"])
+        self.admit(critical=True)
         response = self.requests.delete(url, json=data)
         response.raise_for_status()
         return response.json()
@@ -2747,7 +3376,6 @@ class ApimsAesConnector(BaseResource):
     def compute_childcare_amount(self, request, parent_id):
         # Je récupère les données JSON que j'encapsule dans la variable "body"
         body = json.loads(request.body)
-        logging.info(f"Données dans le body: {body}")
 
         # Je déclare une liste vide pour stocker les inscriptions "registrations"
         registrations = []
@@ -2767,174 +3395,75 @@ class ApimsAesConnector(BaseResource):
 
         # Je prépare le "payload" pour la requête POST (ce qui sera envoyé à l'API AES et donc c'est le contenu de la liste registrations)
         payload = {"registrations": registrations}
-        # Je logge le payload
-        logger.info(f"Payload : {payload}")
+        # Je trace le payload (échantillonné, voir trace_payload)
+        self.trace_payload("Calcul du coût des activités génériques", payload)
         # Je construis l'URL pour la requête POST, c'est le endpoint AES pour calculer le coût des journées pédagogiques
         url = f"{self.server_url}/{self.aes_instance}/generic-activities/cost"
+        self.admit(critical=True)
         # j'envoie la requête HTTP POST à l’URL donnée avec le payload (données) en JSON
         response = self.requests.post(url, json=payload)
         # Je vérifie que la requête s'est bien passée 
         response.raise_for_status()
         # Je récupère les données de coût de la réponse JSON
         cost_data = response.json()
-        logging.info(f"Données de coût : {cost_data}")
-
-        # Montant total renvoyé par AES
-        total_amount = float(cost_data["cost"])
-        # Infos du body
-        initial_balance = float(body["initial_balance"]) - float(body["already_reserved_amount"])
-        if initial_balance < 0:
-            initial_balance = 0
+        self.trace_payload("Coût des activités génériques", cost_data)
+
+        # Tous les calculs se font en centimes entiers pour éviter les erreurs d'arrondi
+        total_amount = to_cents(cost_data["cost"])
+        initial_balance = max(to_cents(body["initial_balance"]) - to_cents(body["already_reserved_amount"]), 0)
         activity_category_id = body.get("activity_category_id")
-        details = cost_data.get("details", {})
-        payments = []
-        post_payments_reserved_balances = []
+        prices, keys, lines = flatten_cost_details(cost_data.get("details", []))
+        allocation = allocate_balance(prices, keys, initial_balance)
 
-        # Si le solde initial est <= 0 :
-        if initial_balance <= 0:
-            payments_dict = {}
-            for detail in details:
-                for price_details in detail.get("details", []):
-                    for item in price_details:
-                        if payments_dict.get((item["invoiceable_parent_id"], detail["activity_category_id"])) is None:
-                            payments_dict[(item["invoiceable_parent_id"], detail["activity_category_id"])] = {
-                                "payment": {
-                                    "parent_id": int(item["invoiceable_parent_id"]),
-                                    "activity_category_id": detail["activity_category_id"],
-                                    "type": "online",
-                                    "child_registration_line_id": item.get("child_registration_line_id"),
-                                    "comment": body.get("comment", ""),
-                                    "form_url": body.get("form_url", ""),
-                                    "amount": 0.0
-                                },
-                                "post_payments_reserved_balances": {
-                                    "amount": 0.0,
-                                    "child_registration_line_id": item.get("child_registration_line_id"),
-                                    "prepayment_by_category_id": item.get("prepayment_by_category_id"),
-                                    "date": item.get("date"),
-                                    "reserving_request": body.get("form_number_raw"),
-                                }
-                            }
-                        payments_dict[(item["invoiceable_parent_id"], detail["activity_category_id"])]["payment"]["amount"] += float(item.get("price", 0.0))
-                        payments_dict[(item["invoiceable_parent_id"], detail["activity_category_id"])]["post_payments_reserved_balances"]["amount"] += float(item.get("price", 0.0))
-            
-            for value in payments_dict.values():
-                payments.append(value["payment"])
-                post_payments_reserved_balances.append(value["post_payments_reserved_balances"])
-            return {
-                "activity_category_id": activity_category_id,
-                "due_amount": round(total_amount, 2),
-                "initial_balance": round(initial_balance, 2),
-                "reserved_balances": [], 
-                "final_solde": 0,
-                "total_amount": round(total_amount, 2),
-                "payments": payments,
-                "post_payments_reserved_balances": post_payments_reserved_balances
+        # Une réservation de solde par ligne qui consomme du solde
+        reserved_balances = [
+            {
+                "amount": reserved / 100,
+                "child_registration_line_id": line.get("child_registration_line_id"),
+                "prepayment_by_category_id": line.get("prepayment_by_category_id"),
+                "date": line.get("date"),
+                "reserving_request": body.get("form_number_raw"),
             }
+            for line, reserved in zip(lines, allocation["reserved"])
+            if reserved > 0
+        ]
 
-        reserved_balances = []
-        balance = initial_balance
-        due_amount = total_amount
-        logging.info(f"Détails  : {details}")
-        for detail in details:
-            for price_details in detail.get("details", []):
-                for item in price_details:
-                    line_amount = float(item.get("price", 0.0))
-                    payment = {
-                        "parent_id": int(item["invoiceable_parent_id"]),
-                        "activity_category_id": detail["activity_category_id"],
-                        "child_registration_line_id": item.get("child_registration_line_id"),
-                        "type": "online",
-                        "comment": body.get("comment", ""),
-                        "form_url": body.get("form_url", ""),
-                        "amount": line_amount - balance if line_amount > balance else 0.0,
-                    }
-                    logging.info(f"payment: {payment}")
-                    amount = line_amount - (line_amount - balance)
-                    if amount > line_amount:
-                        amount = line_amount 
-                    balance -= line_amount
-                    due_amount -= amount
-                    if balance < 0:
-                        #due_amount += abs(balance)
-                        
-                        balance = 0.0
-                    if amount > 0.01:
-                        reserved_balances.append({
-                            "amount": amount,
-                            "child_registration_line_id": item.get("child_registration_line_id"),
-                            "prepayment_by_category_id": item.get("prepayment_by_category_id"),
-                            "date": item.get("date"),
-                            "reserving_request": body.get("form_number_raw"),
-                        })
-                    logging.info(f"Payment amount > 0 ? : {payment['amount']} {type(payment['amount'])} > 0 => {payment['amount'] > 0.0}")
-                    if payment["amount"] > 0.0:
-                        logging.info(f"Ajout du paiement : {payment}")
-                        payments.append(payment)
-                        post_payments_reserved_balances.append({
-                            "amount": payment["amount"],
-                            "child_registration_line_id": item.get("child_registration_line_id"),
-                            "prepayment_by_category_id": item.get("prepayment_by_category_id"),
-                            "date": item.get("date"),
-                            "reserving_request": body.get("form_number_raw"),
-                        })
-                    # if balance <= 0:
-                    #     return {
-                    #         "activity_category_id": activity_category_id,
-                    #         "due_amount": round(due_amount, 2),
-                    #         "balance": balance,
-                    #         "initial_balance": round(initial_balance, 2),
-                    #         "reserved_balances": reserved_balances,
-                    #         "total_amount": round(total_amount, 2),
-                    #         "payments": payments
-                    #     }
-        logging.info(f"Payments : {payments}")
+        # Un paiement par couple (parent facturable, catégorie d'activité) pour ce qui reste dû
+        payments = []
+        post_payments_reserved_balances = []
+        for (invoiceable_parent_id, line_category_id), due in allocation["due_by_key"].items():
+            if due <= 0:
+                continue
+            line = lines[allocation["first_line_by_key"][(invoiceable_parent_id, line_category_id)]]
+            payments.append({
+                "parent_id": invoiceable_parent_id,
+                "activity_category_id": line_category_id,
+                "child_registration_line_id": line.get("child_registration_line_id"),
+                "type": "online",
+                "comment": body.get("comment", ""),
+                "form_url": body.get("form_url", ""),
+                "amount": due / 100,
+            })
+            post_payments_reserved_balances.append({
+                "amount": due / 100,
+                "child_registration_line_id": line.get("child_registration_line_id"),
+                "prepayment_by_category_id": line.get("prepayment_by_category_id"),
+                "date": line.get("date"),
+                "reserving_request": body.get("form_number_raw"),
+            })
+
+        remaining_balance = allocation["remaining_balance"] / 100
         return {
             "activity_category_id": activity_category_id,
-            "due_amount": round(due_amount, 2),
-            "balance": balance,
-            "initial_balance": round(initial_balance, 2),
+            "due_amount": (total_amount - allocation["spent_balance"]) / 100,
+            "balance": remaining_balance,
+            "final_solde": remaining_balance,
+            "initial_balance": initial_balance / 100,
             "reserved_balances": reserved_balances,
-            "total_amount": round(total_amount, 2),
+            "total_amount": total_amount / 100,
             "payments": payments,
             "post_payments_reserved_balances": post_payments_reserved_balances
         }
-        
-        # registration_lines = [
-        #     {
-        #         "id": item.get("child_registration_line_id"),
-        #         "reserved_amount": float(item.get("price", 0.0)),
-        #     }
-        #     #astuce filée par copilot pour le triple for imbriqué ?
-        #     for group in cost_data.get("details", [])
-        #     for bucket in group.get("details", [])
-        #     for item in bucket
-        # ]
-
-        # final_solde = initial_balance
-        # due_amount = 0.0
-
-        # for line in registration_lines:
-        #     line_amount = float(line.get("reserved_amount", 0.0))
-        #     final_solde -= line_amount
-        #     if final_solde < 0:
-        #         due_amount += abs(final_solde)
-        #         final_solde = 0.0
-
-        # spent_balance = initial_balance - final_solde  
-
-        # return {
-        #     "activity_category_id": activity_category_id,
-        #     "child_registration_line_ids": [line["id"] for line in registration_lines],
-        #     "due_amount": round(due_amount, 2),
-        #     "initial_balance": round(initial_balance, 2),
-        #     "parent_id": int(parent_id),
-        #     "prepayment_by_category_id": prepayment_by_category_id,
-        #     "reserved_balance": None,  # ici on ne fait que le calcul, pas la réservation
-        #     "spent_balance": round(spent_balance, 2),
-        #     "total_amount": round(total_amount, 2),
-        # }
-
 
     ###############################
     ## Calcul du montant à payer ##
@@ -2960,7 +3489,7 @@ class ApimsAesConnector(BaseResource):
             "menus": self.compute_meals_order_amount,
             "childcare": self.compute_childcare_amount
         }
-        logging.info(f"REQUEST: {request, json.loads(request.body)}") 
+        self.trace_payload(f"Calcul du montant à payer ({activity_category_type})", request.body)
         if activity_category_type not in compute_amount_function.keys():
             raise ValueError(f"{activity_category_type} is not a valid activity category type")
 
@@ -2968,7 +3497,8 @@ class ApimsAesConnector(BaseResource):
     
     def create_reserved_balances(self, payload):
         url = f"{self.server_url}/{self.aes_instance}/reserved-balances"
-        logging.info(f"Payload reserved balances: {payload}")
+        self.trace_payload("Réservation de soldes", payload)
+        self.admit(critical=True)
         response = self.requests.post(url, json=payload)
         response.raise_for_status()
         return response.json()
@@ -2978,6 +3508,7 @@ class ApimsAesConnector(BaseResource):
         reserved_balances = payload.get("reserved_balances", [])
         if not reserved_balances:
             return HttpResponse(status_code=422)
+        self.admit(critical=True)
         response = self.requests.delete(url, json=[
             reserved_balance.get("id") for reserved_balance in reserved_balances if reserved_balance.get("id") is not None
         ])
@@ -3054,17 +3585,5 @@ class ApimsAesConnector(BaseResource):
 
         start_date = date.today() + timedelta(int(start_date))
         end_date = date.today() + timedelta(int(end_date))
-        wednesday_afternoon = []
-
-        for item in data.get("items", []):
-            item_date = date.fromisoformat(item["date"])
-            if (end_date is None or item_date <= end_date) and (item_date >= start_date):
-                item['text'] = f"{item['child_lastname']} {item['child_firstname']}"
-                item['disabled'] = item.get('is_child_already_registered') or not item.get('invoiceable_parent_id')
-                item['id'] = f"{item['activity_id']}_{item.get('activity_date_id') or item['date']}_{item['child_id']}"
-                d = date.fromisoformat(item['date'])
-                item['group_by'] = f"{JOURS[d.weekday()]} {d.day} {MOIS[d.month - 1]} {d.year}".capitalize()
-                wednesday_afternoon.append(item)
-
-        data["items"] = wednesday_afternoon
+        data["items"] = list(decorations.decorate_wednesday_afternoons(data.get("items", []), start_date, end_date))
         return data
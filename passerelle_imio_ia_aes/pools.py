@@ -0,0 +1,131 @@
+"""Pools de connexions HTTP partagés par les requêtes d'un même worker.
+
+Le connecteur est rechargé et une nouvelle session requests est créée à chaque
+requête reçue par Passerelle : sans adaptateur partagé, les connexions (et
+leur négociation TCP/TLS) ne sont pas réutilisées d'une requête à l'autre.
+Les adaptateurs sont donc gardés au niveau du processus, un par connecteur et
+par réglage, et montés sur les URL des services distants (APIMS, w.c.s. et
+authentic).
+
+Les pools mesurent le temps d'attente d'une connexion libre, et urllib3 compte
+déjà les connexions ouvertes et les requêtes envoyées : metrics() permet ainsi
+de dimensionner les pools pour les pics de charge.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class TimedPoolMixin:
+    """Compte les connexions demandées au pool et mesure les attentes d'une connexion libre.
+
+    Seules les demandes qui ont dû attendre (pool_block activé et toutes les
+    connexions du pool occupées) sont comptées dans wait_count et wait_time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_count = 0
+        self.wait_count = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _get_conn(self, timeout=None):
+        # Sans connexion disponible, un pool bloquant attend qu'une connexion soit rendue
+        blocked = self.block and self.pool is not None and self.pool.empty()
+        start = time.perf_counter()
+        try:
+            return super()._get_conn(timeout)
+        finally:
+            self.checkout_count += 1
+            if blocked:
+                elapsed = time.perf_counter() - start
+                self.wait_count += 1
+                self.wait_time += elapsed
+                self.max_wait_time = max(self.max_wait_time, elapsed)
+
+
+class TimedHTTPConnectionPool(TimedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class TimedHTTPSConnectionPool(TimedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """Adaptateur requests dont les pools mesurent leur utilisation"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def metrics(self):
+        """Utilisation de chaque pool (un par hôte) depuis le démarrage du worker"""
+        result = []
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            result.append(
+                {
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "maxsize": pool.pool.maxsize if pool.pool is not None else None,
+                    "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "connections_reused": max(pool.num_requests - pool.num_connections, 0),
+                    "checkouts": getattr(pool, "checkout_count", 0),
+                    "wait_count": getattr(pool, "wait_count", 0),
+                    "wait_time": round(getattr(pool, "wait_time", 0.0), 6),
+                    "max_wait_time": round(getattr(pool, "max_wait_time", 0.0), 6),
+                }
+            )
+        return result
+
+
+_adapters = {}
+_adapters_lock = threading.Lock()
+
+
+def get_adapter(name, pool_maxsize, pool_block):
+    """Adaptateur partagé par toutes les sessions du worker pour ce nom et ces réglages"""
+    key = (name, pool_maxsize, pool_block)
+    with _adapters_lock:
+        adapter = _adapters.get(key)
+        if adapter is None:
+            adapter = _adapters[key] = PooledHTTPAdapter(pool_maxsize=pool_maxsize, pool_block=pool_block)
+        return adapter
+
+
+def warm_up(session, url, connections, timeout=5):
+    """Ouvre jusqu'à connections connexions vers url, gardées ensuite dans le pool de la session.
+
+    Les requêtes HEAD sont envoyées simultanément pour que chacune ouvre sa
+    propre connexion. Les erreurs sont ignorées : le préchauffage ne doit pas
+    empêcher le worker de servir des requêtes.
+
+    Returns
+    -------
+        int : nombre de requêtes ayant abouti
+    """
+
+    def head(_):
+        try:
+            session.head(url, timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    if connections <= 0:
+        return 0
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        return sum(executor.map(head, range(connections)))
@@ -1,11 +1,67 @@
+import json
+import random
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def get_numpy():
+    """Module NumPy, importé à la première utilisation, ou None s'il n'est pas installé.
+
+    NumPy est optionnel (voir compute_amounts_with_balance) et coûteux à
+    importer : il n'est chargé que quand un calcul en a besoin.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def gather(*funcs, max_workers=8, timeout=None):
+    """Appelle en parallèle des fonctions sans argument et renvoie leurs résultats dans le même ordre.
+
+    Chaque appel crée son propre ThreadPoolExecutor : un appel lent ne retarde
+    que la requête qui l'a lancé. Au-delà de timeout secondes, TimeoutError
+    est levée sans attendre les appels encore en cours. La première exception
+    levée par une fonction est propagée.
+    """
+    if not funcs:
+        return []
+    executor = ThreadPoolExecutor(max_workers=min(len(funcs), max_workers))
+    try:
+        futures = [executor.submit(func) for func in funcs]
+        done, not_done = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future in done and future.exception() is not None:
+                raise future.exception()
+        if not_done:
+            raise FutureTimeoutError()
+        return [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def compute_amount_with_balance(order_amount, balance_amount, already_reserved_balance_amount):
     # Arrondir...
     order_amount = round(order_amount * 100)
     balance_amount = round(balance_amount * 100)
     already_reserved_balance_amount = round(already_reserved_balance_amount * 100)
-    due_amount = 0
-    spent_balance = 0
-    remaining_balance = 0
+    due_amount, spent_balance, remaining_balance = compute_cents_with_balance(
+        order_amount, balance_amount, already_reserved_balance_amount
+    )
+    # Retourner les résultats, avec les bonnes valeurs
+    return {"due_amount": round(due_amount / 100, 2), "spent_balance": round(spent_balance / 100, 2), "remaining_balance": round(remaining_balance / 100, 2)}
+
+
+def compute_cents_with_balance(order_amount, balance_amount, already_reserved_balance_amount):
+    """Version en centimes de compute_amount_with_balance.
+
+    Returns
+    -------
+        tuple (due_amount, spent_balance, remaining_balance), en centimes
+    """
     # Si le montant de la commande est supérieur ou égal au montant du solde...
     if order_amount >= balance_amount:
         # ... le montant à payer est le montant de la commande moins le montant du solde...
@@ -26,6 +82,218 @@ def compute_amount_with_balance(order_amount, balance_amount, already_reserved_b
         # ... sinon (si le montant de la commande est inférieur ou égal au montant du solde déjà réservé)
         else:
             spent_balance = 0
-    # Retourner les résultats, avec les bonnes valeurs
-    return {"due_amount": round(due_amount / 100, 2), "spent_balance": round(spent_balance / 100, 2), "remaining_balance": round(remaining_balance / 100, 2)}
+    return due_amount, spent_balance, remaining_balance
+
+
+def compute_amounts_with_balance(order_amounts, balance_amounts, already_reserved_balance_amounts, use_numpy=None):
+    """Variante de compute_amount_with_balance pour de nombreuses commandes à la fois.
+
+    Les montants sont donnés en euros, comme pour compute_amount_with_balance,
+    et les résultats sont renvoyés en centimes. Le calcul est vectorisé avec
+    NumPy s'il est installé, sinon il est fait en Python pur.
+
+    Parameters
+    ----------
+        order_amounts, balance_amounts, already_reserved_balance_amounts : séquences de même longueur
+        use_numpy : bool ou None
+            désactive NumPy (False). Sinon (True ou None, par défaut), NumPy est
+            utilisé s'il est installé (extra "numpy"), le calcul se fait en Python pur sinon.
+
+    Returns
+    -------
+        dict
+            due_amount, spent_balance, remaining_balance : tableaux de centimes
+            (numpy.ndarray d'int64 avec NumPy, listes d'int sinon)
+    """
+    numpy = get_numpy() if use_numpy is not False else None
+    use_numpy = numpy is not None
+    if len(order_amounts) != len(balance_amounts) or len(order_amounts) != len(already_reserved_balance_amounts):
+        raise ValueError("order_amounts, balance_amounts and already_reserved_balance_amounts must have the same length")
+    if use_numpy:
+        # numpy.rint arrondit au pair le plus proche, comme round() sur un float
+        orders = numpy.rint(numpy.asarray(order_amounts, dtype=numpy.float64) * 100).astype(numpy.int64)
+        balances = numpy.rint(numpy.asarray(balance_amounts, dtype=numpy.float64) * 100).astype(numpy.int64)
+        reserved = numpy.rint(numpy.asarray(already_reserved_balance_amounts, dtype=numpy.float64) * 100).astype(numpy.int64)
+        order_covers_balance = orders >= balances
+        return {
+            "due_amount": numpy.where(order_covers_balance, orders - balances, 0),
+            "spent_balance": numpy.where(
+                order_covers_balance,
+                balances - reserved,
+                numpy.where(orders > reserved, orders - reserved, 0),
+            ),
+            "remaining_balance": numpy.where(order_covers_balance, 0, balances - orders),
+        }
+    due_amounts, spent_balances, remaining_balances = [], [], []
+    for order_amount, balance_amount, already_reserved_balance_amount in zip(
+        order_amounts, balance_amounts, already_reserved_balance_amounts
+    ):
+        due_amount, spent_balance, remaining_balance = compute_cents_with_balance(
+            round(order_amount * 100), round(balance_amount * 100), round(already_reserved_balance_amount * 100)
+        )
+        due_amounts.append(due_amount)
+        spent_balances.append(spent_balance)
+        remaining_balances.append(remaining_balance)
+    return {"due_amount": due_amounts, "spent_balance": spent_balances, "remaining_balance": remaining_balances}
+
+
+def to_cents(amount):
+    """Convertit un montant en euros (float, str ou None) en centimes entiers."""
+    if amount is None or amount == "":
+        return 0
+    return round(float(amount) * 100)
+
+
+def flatten_cost_details(details):
+    """Aplatit les détails de coût renvoyés par AES (generic-activities/cost).
+
+    AES renvoie une structure à trois niveaux : catégorie d'activité -> groupes
+    de prix -> lignes. On la met à plat en tableaux parallèles, une entrée par
+    ligne, pour pouvoir la parcourir en une seule passe.
+
+    Returns
+    -------
+        tuple (prices, keys, lines)
+            prices : montants des lignes en centimes
+            keys : couples (parent facturable, catégorie d'activité) des lignes
+            lines : les lignes AES d'origine
+    """
+    prices, keys, lines = [], [], []
+    for detail in details:
+        activity_category_id = detail["activity_category_id"]
+        for price_details in detail.get("details", []):
+            lines.extend(price_details)
+            for item in price_details:
+                price = item.get("price")
+                prices.append(0 if price is None or price == "" else round(float(price) * 100))
+                keys.append((int(item["invoiceable_parent_id"]), activity_category_id))
+    return prices, keys, lines
+
+
+def allocate_balance(prices, keys, balance):
+    """Répartit un solde (en centimes) sur des lignes de commande, dans l'ordre.
+
+    Chaque ligne consomme le solde restant jusqu'à son propre montant, le reste
+    de la ligne étant dû. Le montant dû est agrégé par clé (typiquement
+    (parent facturable, catégorie d'activité)) dans la même passe.
+
+    Parameters
+    ----------
+        prices : list of int
+            montants des lignes, en centimes
+        keys : list
+            clé d'agrégation de chaque ligne
+        balance : int
+            solde disponible, en centimes
+
+    Returns
+    -------
+        dict
+            reserved : solde consommé par ligne, en centimes
+            due : montant dû par ligne, en centimes
+            due_by_key : montant dû agrégé par clé, dans l'ordre d'apparition
+            first_line_by_key : index de la première ligne de chaque clé
+            spent_balance : total du solde consommé
+            remaining_balance : solde restant
+    """
+    balance = max(balance, 0)
+    initial_balance = balance
+    reserved, due = [0] * len(prices), list(prices)
+    due_by_key, first_line_by_key = {}, {}
+    for index, key in enumerate(keys):
+        price = prices[index]
+        if price and (balance or price < 0):
+            spent = price if price < balance else balance
+            balance -= spent
+            reserved[index] = spent
+            due[index] = price - spent if price > spent else 0
+        if key in due_by_key:
+            due_by_key[key] += due[index]
+        else:
+            due_by_key[key] = due[index]
+            first_line_by_key[key] = index
+    spent_balance = initial_balance - balance
+    return {
+        "reserved": reserved,
+        "due": due,
+        "due_by_key": due_by_key,
+        "first_line_by_key": first_line_by_key,
+        "spent_balance": spent_balance,
+        "remaining_balance": balance,
+    }
+
+
+class PayloadTrace:
+    """Représentation paresseuse et tronquée d'une charge utile pour les logs.
+
+    La sérialisation n'a lieu que si le message de log est effectivement
+    formaté, c'est-à-dire si le niveau de log est actif.
+    """
+
+    def __init__(self, payload, max_length=2000):
+        self.payload = payload
+        self.max_length = max_length
+
+    def __str__(self):
+        payload = self.payload
+        if isinstance(payload, (bytes, bytearray)):
+            text = payload.decode("utf-8", errors="replace")
+        elif isinstance(payload, str):
+            text = payload
+        else:
+            text = json.dumps(payload, default=str, ensure_ascii=False)
+        if self.max_length and len(text) > self.max_length:
+            return f"{text[:self.max_length]}... ({len(text) - self.max_length} caractères tronqués)"
+        return text
+
+
+def is_sampled(sample_rate):
+    """Tire au sort si un événement doit être tracé, selon un taux entre 0 et 1."""
+    if sample_rate <= 0:
+        return False
+    return sample_rate >= 1 or random.random() < sample_rate
+
+
+@lru_cache(maxsize=256)
+def parse_fields(fields):
+    """Compile une liste de champs 'id,children.id,children.name' en arbre {'id': None, 'children': {...}}.
+
+    None signifie que le champ est gardé en entier. Demander à la fois 'a' et
+    'a.b' garde 'a' en entier.
+    """
+    tree = {}
+    for field in fields.split(","):
+        path = [part for part in field.strip().split(".") if part]
+        node = tree
+        for i, part in enumerate(path):
+            if i == len(path) - 1:
+                node[part] = None
+            elif node.get(part, {}) is None:
+                break
+            else:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def project_fields(data, fields):
+    """Ne garde de data que les champs demandés (chemins pointés séparés par des virgules).
+
+    Les listes sont parcourues : 'items.id' garde l'identifiant de chaque
+    élément de items. Les champs absents sont ignorés ; fields vide renvoie
+    data tel quel.
+    """
+    if not fields:
+        return data
+    return _project(data, parse_fields(fields))
+
 
+def _project(data, tree):
+    if isinstance(data, list):
+        return [_project(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: data[key] if subtree is None else _project(data[key], subtree)
+        for key, subtree in tree.items()
+        if key in data
+    }
@@ -70,6 +70,9 @@ setup(
     install_requires=[
         "django>=3.2, <5.3",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     zip_safe=False,
     cmdclass={
         "build": build,
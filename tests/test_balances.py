@@ -0,0 +1,80 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("passerelle")
+
+from django.core.cache import cache  # noqa: E402
+
+from passerelle_imio_ia_aes.models import ApimsAesConnector  # noqa: E402
+
+
+class Response:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        if self.data is None:
+            raise ValueError("No JSON")
+        return self.data
+
+
+class Session:
+    def __init__(self, bulk_response):
+        self.bulk_response = bulk_response
+        self.calls = []
+
+    def post(self, url, json=None, **kwargs):
+        self.calls.append(("post", url, json))
+        return Response(200, {"id": 31})
+
+    def delete(self, url, json=None, **kwargs):
+        self.calls.append(("delete", url, json))
+        if url.endswith("/aes/reserved-balances"):
+            return self.bulk_response
+        return Response(204)
+
+
+@pytest.fixture
+def connector():
+    cache.clear()
+    return ApimsAesConnector(slug="aes", server_url="https://apims.example.org", aes_instance="aes")
+
+
+def free_balances(connector, monkeypatch, bulk_response, ids):
+    session = Session(bulk_response)
+    monkeypatch.setattr(ApimsAesConnector, "requests", session)
+    connector.reserve_balance("4", {"amount": "1.50"})
+    request = SimpleNamespace(body=json.dumps({"reserved_balance_ids": ids}))
+    return connector.free_balances(request, "4")["data"], session.calls[1:]
+
+
+def test_owned_balances_are_freed_in_bulk(connector, monkeypatch):
+    data, calls = free_balances(connector, monkeypatch, Response(200, [{"id": 31}]), [31, 32])
+    assert data == [
+        {"id": 31, "freed": True, "status_code": 200},
+        {"id": 32, "freed": True, "status_code": 204},
+    ]
+    # Seul le solde réservé pour ce parent passe par la suppression par lot
+    assert calls == [
+        ("delete", "https://apims.example.org/aes/reserved-balances", [31]),
+        ("delete", "https://apims.example.org/aes/parents/4/reserved-balances/32", None),
+    ]
+
+
+def test_bulk_response_without_ids_is_not_assumed_successful(connector, monkeypatch):
+    data, _ = free_balances(connector, monkeypatch, Response(204), [31])
+    assert data == [{"id": 31, "freed": None, "status_code": 204}]
+
+
+@pytest.mark.parametrize("status_code", [404, 405, 502])
+def test_failed_bulk_call_falls_back_to_single_deletes(connector, monkeypatch, status_code):
+    data, calls = free_balances(connector, monkeypatch, Response(status_code), [31])
+    assert data == [{"id": 31, "freed": True, "status_code": 204}]
+    assert calls[-1] == ("delete", "https://apims.example.org/aes/parents/4/reserved-balances/31", None)
@@ -0,0 +1,414 @@
+import threading
+import time
+
+import pytest
+
+from passerelle_imio_ia_aes.caching import (
+    Generation,
+    IdempotencyJournal,
+    NegativeCache,
+    SharedFailure,
+    Snapshot,
+    TokenBucket,
+    get_or_refresh,
+    payload_digest,
+    run_once,
+)
+
+
+class MemoryCache:
+    """Cache en mémoire offrant le sous-ensemble de l'API du cache Django utilisé par le connecteur."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def _alive(self, key):
+        value, expires_at = self.data.get(key, (None, 0))
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            return False
+        return True
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data[key][0] if self._alive(key) else default
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.data[key] = (value, None if timeout is None else time.monotonic() + timeout)
+
+    def add(self, key, value, timeout=None):
+        with self.lock:
+            if self._alive(key):
+                return False
+            self.data[key] = (value, None if timeout is None else time.monotonic() + timeout)
+            return True
+
+    def get_many(self, keys):
+        with self.lock:
+            return {key: self.data[key][0] for key in keys if self._alive(key)}
+
+    def set_many(self, data, timeout=None):
+        for key, value in data.items():
+            self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incr(self, key, delta=1):
+        with self.lock:
+            if not self._alive(key):
+                raise ValueError(f"Key '{key}' not found")
+            value, expires_at = self.data[key]
+            self.data[key] = (value + delta, expires_at)
+            return value + delta
+
+
+@pytest.fixture
+def memory_cache():
+    return MemoryCache()
+
+
+def test_payload_digest_ignores_key_order():
+    assert payload_digest({"a": 1, "b": [1, 2]}) == payload_digest({"b": [1, 2], "a": 1})
+    assert payload_digest({"a": 1}) != payload_digest({"a": 2})
+
+
+def test_run_once_replays_stored_result(memory_cache):
+    calls = []
+    assert run_once(memory_cache, "k", lambda: calls.append(1) or {"id": 1}, timeout=60) == {"id": 1}
+    assert run_once(memory_cache, "k", lambda: calls.append(1) or {"id": 2}, timeout=60) == {"id": 1}
+    assert len(calls) == 1
+
+
+def test_run_once_stores_none(memory_cache):
+    calls = []
+    run_once(memory_cache, "k", lambda: calls.append(1), timeout=60)
+    run_once(memory_cache, "k", lambda: calls.append(1), timeout=60)
+    assert len(calls) == 1
+
+
+def test_run_once_does_not_store_failures(memory_cache):
+    def fail():
+        raise ValueError("APIMS is down")
+
+    with pytest.raises(ValueError):
+        run_once(memory_cache, "k", fail, timeout=60)
+    assert run_once(memory_cache, "k", lambda: "ok", timeout=60) == "ok"
+
+
+def test_run_once_concurrent_duplicates_wait_for_first_call(memory_cache):
+    calls, results = [], []
+
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    threads = [
+        threading.Thread(target=lambda: results.append(run_once(memory_cache, "k", slow_call, timeout=60)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ["done"] * 5
+
+
+def test_run_once_shares_failure_with_waiters(memory_cache):
+    calls, errors = [], []
+
+    def failing_call():
+        calls.append(1)
+        time.sleep(0.2)
+        raise ConnectionError("APIMS is down")
+
+    def call():
+        try:
+            run_once(memory_cache, "k", failing_call, timeout=60)
+        except (ConnectionError, SharedFailure) as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Les appels en attente ne refont pas l'appel chacun leur tour
+    assert len(calls) == 1
+    assert sorted(type(e).__name__ for e in errors) == ["ConnectionError"] + ["SharedFailure"] * 4
+    # Un nouvel appel réessaie
+    assert run_once(memory_cache, "k", lambda: "ok", timeout=60) == "ok"
+
+
+def test_run_once_shares_failure_status_with_waiters(memory_cache):
+    class Overloaded(Exception):
+        http_status = 503
+
+    errors = []
+
+    def failing_call():
+        time.sleep(0.2)
+        raise Overloaded("iA.AES est momentanément surchargé")
+
+    def call():
+        try:
+            run_once(memory_cache, "k", failing_call, timeout=60)
+        except (Overloaded, SharedFailure) as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    shared = [e for e in errors if isinstance(e, SharedFailure)]
+    assert len(shared) == 2
+    assert all(e.status == 503 and e.error_class == "Overloaded" for e in shared)
+    assert str(shared[0]) == "iA.AES est momentanément surchargé"
+
+
+def test_run_once_keeps_lock_taken_over_by_another_worker(memory_cache):
+    def slow_call():
+        # Le verrou a expiré et un autre worker l'a repris
+        memory_cache.set("k:lock", "other-worker", 30)
+        return "done"
+
+    assert run_once(memory_cache, "k", slow_call, timeout=60) == "done"
+    assert memory_cache.get("k:lock") == "other-worker"
+
+
+def test_generation(memory_cache):
+    child, other = Generation(memory_cache, "menus:1"), Generation(memory_cache, "menus:2")
+    first, other_first = child.value(), other.value()
+    assert child.value() == first
+    child.bump()
+    assert child.value() != first
+    assert other.value() == other_first
+    memory_cache.delete(child.key)
+    child.bump()
+    assert child.value() is not None
+
+
+def test_negative_cache(memory_cache):
+    persons = NegativeCache(memory_cache, "persons", timeout=60)
+    assert persons.get(["parent", "00000000097"]) is None
+    persons.set(["parent", "00000000097"])
+    persons.set(["child", "00000000097"], "not found")
+    assert persons.get(["parent", "00000000097"]) is True
+    assert persons.get(["child", "00000000097"]) == "not found"
+    assert persons.get(["parent", "00000000098"]) is None
+
+
+def test_negative_cache_invalidate(memory_cache):
+    persons = NegativeCache(memory_cache, "persons", timeout=60)
+    other = NegativeCache(memory_cache, "other", timeout=60)
+    persons.set(["parent", "00000000097"])
+    other.set(["parent", "00000000097"])
+    persons.invalidate()
+    assert persons.get(["parent", "00000000097"]) is None
+    assert other.get(["parent", "00000000097"]) is True
+
+
+def test_negative_cache_invalidate_without_generation(memory_cache):
+    persons = NegativeCache(memory_cache, "persons", timeout=60)
+    persons.set(["parent", "00000000097"])
+    memory_cache.delete(persons.generation_key)
+    persons.invalidate()
+    assert persons.get(["parent", "00000000097"]) is None
+
+
+class Upstream:
+    def __init__(self):
+        self.calls = 0
+        self.down = False
+
+    def fetch(self):
+        if self.down:
+            raise ConnectionError("APIMS is down")
+        self.calls += 1
+        return {"version": self.calls}
+
+
+def age_entry(memory_cache, key, seconds):
+    value, expires_at = memory_cache.data[key]
+    memory_cache.data[key] = (dict(value, fetched_at=value["fetched_at"] - seconds), expires_at)
+
+
+def test_get_or_refresh_fresh(memory_cache):
+    upstream, background = Upstream(), []
+    for _ in range(3):
+        value, stale = get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    assert value == {"version": 1} and stale is None
+    assert upstream.calls == 1 and background == []
+
+
+def test_get_or_refresh_stale_while_revalidate(memory_cache):
+    upstream, background = Upstream(), []
+    get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    age_entry(memory_cache, "k", 20)
+    value, stale = get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    assert value == {"version": 1}
+    assert stale == {"stale": True, "reason": "revalidating", "age": 20}
+    # Un seul rafraîchissement est lancé, même si d'autres requêtes arrivent entre-temps
+    get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    assert len(background) == 1 and upstream.calls == 1
+    background[0]()
+    value, stale = get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    assert value == {"version": 2} and stale is None
+
+
+def test_get_or_refresh_stale_if_error(memory_cache):
+    upstream, background = Upstream(), []
+    get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    age_entry(memory_cache, "k", 600)
+    upstream.down = True
+    value, stale = get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    assert value == {"version": 1}
+    assert stale == {"stale": True, "reason": "upstream_error", "age": 600}
+    age_entry(memory_cache, "k", 3600)
+    with pytest.raises(ConnectionError):
+        get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+
+
+def test_get_or_refresh_failed_background_refresh_releases_lock(memory_cache):
+    upstream, background = Upstream(), []
+    get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    age_entry(memory_cache, "k", 20)
+    get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    upstream.down = True
+    with pytest.raises(ConnectionError):
+        background[0]()
+    get_or_refresh(memory_cache, "k", upstream.fetch, 15, 60, 3600, background.append)
+    assert len(background) == 2
+
+
+def test_token_bucket_admits_rate_per_second(memory_cache, monkeypatch):
+    now = [1000.2]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    bucket = TokenBucket(memory_cache, "bucket", rate=2)
+    assert bucket.acquire(wait=0)
+    assert bucket.acquire(wait=0)
+    assert not bucket.acquire(wait=0)
+    # Seau rempli à la seconde suivante
+    now[0] = 1001.1
+    assert bucket.acquire(wait=0)
+
+
+def test_token_bucket_critical_lane_never_waits(memory_cache, monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: 1000.2)
+    bucket = TokenBucket(memory_cache, "bucket", rate=1)
+    for _ in range(5):
+        bucket.take()
+    # Les écritures ont consommé le budget : les lectures attendent
+    assert not bucket.acquire(wait=0)
+
+
+def test_token_bucket_failed_reads_do_not_consume(memory_cache, monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: 1000.2)
+    bucket = TokenBucket(memory_cache, "bucket", rate=1)
+    bucket.take()
+    for _ in range(3):
+        assert not bucket.acquire(wait=0)
+    assert memory_cache.get("bucket:1000") == 1
+
+
+def test_token_bucket_read_waits_for_next_second(memory_cache):
+    bucket = TokenBucket(memory_cache, "bucket", rate=1)
+    bucket.take()
+    start = time.monotonic()
+    assert bucket.acquire(wait=1.5)
+    assert time.monotonic() - start <= 1.5
+
+
+def test_snapshot_freshness(memory_cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    snapshot = Snapshot(memory_cache, "plains", ttl=0.5)
+    snapshot.update({"3_12": 4, "5_12": 0})
+    assert snapshot.get_many(["3_12", "5_12", "7_12"]) == {"3_12": 4, "5_12": 0}
+    now[0] = 1000.6
+    assert snapshot.get_many(["3_12"]) == {}
+
+
+def test_snapshot_adjust_and_invalidate(memory_cache):
+    snapshot = Snapshot(memory_cache, "plains", ttl=10)
+    snapshot.update({"3_12": 1})
+    snapshot.adjust("3_12", -1)
+    snapshot.adjust("3_12", -1)
+    assert snapshot.get_many(["3_12"]) == {"3_12": 0}
+    # Une valeur inconnue n'est pas créée
+    snapshot.adjust("5_12", 1)
+    assert snapshot.get_many(["5_12"]) == {}
+    snapshot.invalidate()
+    assert snapshot.get_many(["3_12"]) == {}
+
+
+def test_snapshot_get_or_fetch_single_flight(memory_cache):
+    snapshot = Snapshot(memory_cache, "plains", ttl=10)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        snapshot.update({"3_12": 4, "5_12": 2})
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(snapshot.get_or_fetch(["3_12", "5_12"], fetch)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"3_12": 4, "5_12": 2}] * 5
+    # Valeurs à jour : fetch n'est pas rappelé
+    assert snapshot.get_or_fetch(["3_12"], fetch) == {"3_12": 4}
+    assert len(calls) == 1
+
+
+def test_idempotency_journal_replays_until_forgotten(memory_cache):
+    journal = IdempotencyJournal(memory_cache, "idempotency:reserved-balance", timeout=600)
+    calls = []
+
+    def reserve():
+        calls.append(1)
+        return {"id": len(calls)}
+
+    payload = ["1234", {"amount": "12,50", "parent_id": "279"}]
+    assert journal.call(279, payload, reserve) == {"id": 1}
+    # Rejeu de w.c.s. : la réponse mémorisée est renvoyée
+    assert journal.call(279, payload, reserve) == {"id": 1}
+    assert len(calls) == 1
+    # Un autre parent n'est pas concerné par l'annulation
+    assert journal.call(280, payload, reserve) == {"id": 2}
+    journal.forget(279)
+    assert journal.call(279, payload, reserve) == {"id": 3}
+    assert journal.call(280, payload, reserve) == {"id": 2}
+    # Sans périmètre connu, toutes les écritures sont oubliées
+    journal.forget()
+    assert journal.call(280, payload, reserve) == {"id": 4}
+
+
+def test_snapshot_get_or_fetch_returns_fresh_values_when_fetch_fails(memory_cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    snapshot = Snapshot(memory_cache, "plains", ttl=0.5)
+    snapshot.update({"3_12": 4})
+    now[0] = 1000.3
+    snapshot.update({"5_12": 1})
+    now[0] = 1000.6
+
+    def fail():
+        raise ConnectionError("APIMS is down")
+
+    # 3_12 a expiré et n'a pas pu être relu : il est absent du résultat
+    assert snapshot.get_or_fetch(["3_12", "5_12"], fail) == {"5_12": 1}
+    # Le verrou est libéré : la demande suivante relance la lecture
+    assert snapshot.get_or_fetch(["3_12"], lambda: snapshot.update({"3_12": 2})) == {"3_12": 2}
@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+
+from passerelle_imio_ia_aes.decorations import (
+    date_label,
+    decorate_generic_registrations,
+    decorate_pedagogical_days,
+    decorate_wednesday_afternoons,
+    format_date,
+    parse_french_date,
+)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("2025-07-18", "Vendredi 18 juillet 2025"),
+        ("2025-02-03", "Lundi 3 février 2025"),
+        ("2025-12-28", "Dimanche 28 décembre 2025"),
+    ],
+)
+def test_date_label(value, expected):
+    assert date_label(value) == expected
+    assert format_date(value) == expected
+    assert parse_french_date(expected) == value
+
+
+@pytest.mark.parametrize("value", ["", "18/07/2025", None])
+def test_format_date_fallback(value):
+    assert format_date(value) == value
+
+
+@pytest.mark.parametrize("value", ["", "Jeudi 23 brumaire 2025", "Jeudi 23", None])
+def test_parse_french_date_fallback(value):
+    assert parse_french_date(value) == value
+
+
+def pedagogical_day(day, **kwargs):
+    item = {
+        "date": day,
+        "activity_id": 3,
+        "activity_date_id": 12,
+        "child_id": 22,
+        "child_lastname": "Dupont",
+        "child_firstname": "Léa",
+        "invoiceable_parent_id": 279,
+        "is_child_already_registered": False,
+    }
+    item.update(kwargs)
+    return item
+
+
+def test_decorate_pedagogical_days():
+    items = list(decorate_pedagogical_days([pedagogical_day("2025-07-18")]))
+    assert items == [
+        dict(
+            pedagogical_day("2025-07-18"),
+            text="Dupont Léa",
+            disabled=False,
+            id="3_12_22",
+            group_by="Vendredi 18 juillet 2025",
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "kwargs,disabled",
+    [
+        ({}, False),
+        ({"is_child_already_registered": True}, True),
+        ({"invoiceable_parent_id": None}, True),
+    ],
+)
+def test_decorate_pedagogical_days_disabled(kwargs, disabled):
+    (item,) = decorate_pedagogical_days([pedagogical_day("2025-07-18", **kwargs)])
+    assert item["disabled"] is disabled
+
+
+def test_decorate_pedagogical_days_window():
+    items = [pedagogical_day(f"2025-03-{day:02d}") for day in (1, 10, 20, 31)]
+    window = decorate_pedagogical_days(items, datetime.date(2025, 3, 10), datetime.date(2025, 3, 20))
+    assert [item["date"] for item in window] == ["2025-03-10", "2025-03-20"]
+    assert len(list(decorate_pedagogical_days(items, None, datetime.date(2025, 3, 10)))) == 2
+    assert len(list(decorate_pedagogical_days(items, datetime.date(2025, 3, 10), None))) == 3
+
+
+def test_decorate_wednesday_afternoons_id_falls_back_on_date():
+    (item,) = decorate_wednesday_afternoons([pedagogical_day("2025-03-05", activity_date_id=None)])
+    assert item["id"] == "3_2025-03-05_22"
+    assert item["group_by"] == "Mercredi 5 mars 2025"
+
+
+def test_decorate_generic_registrations():
+    items = [
+        {"date": "2025-03-05", "child_name": "Dupont Léa", "child_registration_line_id": 8, "day": 5},
+        {"date": "2025-03-06", "child_name": "Dupont Léa", "child_registration_line_id": 8, "day": 6},
+    ]
+    result = list(decorate_generic_registrations(items, keep=lambda item, item_date: item_date.day > 5))
+    assert result == [dict(items[1], text="Dupont Léa", id="8_6", group_by="Jeudi 6 mars 2025")]
+    assert "disabled" not in result[0]
@@ -0,0 +1,397 @@
+import copy
+import itertools
+
+import pytest
+
+from passerelle_imio_ia_aes import healthsheet
+
+# Implémentations précédentes de read_healthsheet et update_healthsheet, gardées
+# comme référence : les tables de healthsheet doivent produire exactement les
+# mêmes données.
+
+
+def legacy_read(data):
+    healthsheet = dict()
+    healthsheet["activity_no_available_reason"] = (
+        data["activity_no_available_reason"] or ""
+    )
+    healthsheet["activity_no_available_selection"] = data[
+        "activity_no_available_selection"
+    ]
+    healthsheet["activity_no_available_text"] = (
+        data["activity_no_available_text"] or ""
+    )
+    healthsheet["allergy_consequence"] = data["allergy_consequence"] or ""
+    healthsheet["allergy_ids"] = [
+        str(allergy["id"]) for allergy in data["allergy_ids"]
+    ]
+    healthsheet["allergy_selection"] = data["allergy_selection"]
+    healthsheet["allergy_treatment"] = data["allergy_treatment"] or ""
+    healthsheet["allowed_contact_ids"] = data["allowed_contact_ids"]
+    healthsheet["authorization_ids"] = data["authorization_ids"]
+    healthsheet["arnica"] = data["arnica"]
+    healthsheet["bike"] = data["bike"]
+    healthsheet["blood_type"] = data["blood_type"]
+    healthsheet["comment"] = data["comment"]
+    healthsheet["disease_ids"], healthsheet["disease_details"] = list(), list()
+    for disease in data["disease_ids"]:
+        healthsheet["disease_ids"].append(str(disease["disease_type_id"][0]))
+        healthsheet["disease_details"].append(
+            {
+                "id": disease["disease_type_id"][0],
+                "gravity": disease["gravity"] or "",
+                "treatment": disease["disease_text"],
+            }
+        )
+    healthsheet["doctor_id"] = data["doctor_id"]
+    healthsheet["emotional_support"] = data["emotional_support"]
+    healthsheet["facebook"] = data["facebook"]
+    healthsheet["first_date_tetanus"] = data["first_date_tetanus"]
+    healthsheet["handicap_selection"] = data["handicap_selection"]
+    healthsheet["has_medication"] = (
+        "yes" if len(data["medication_ids"]) > 0 else "not_specified"
+    )
+    healthsheet["hearing_aid"] = data["hearing_aid"]
+    healthsheet["glasses"] = data["glasses"]
+    healthsheet["id"] = data["id"]
+    healthsheet["intervention_text"] = data["intervention_text"] or ""
+    healthsheet["intervention_selection"] = data["intervention_selection"]
+    healthsheet["last_date_tetanus"] = data["last_date_tetanus"]
+    healthsheet["level_handicap"] = data["level_handicap"]
+    healthsheet["medication_ids"] = [
+        {
+            "name": medication["name"],
+            "quantity": medication["quantity"],
+            "period": medication["period"],
+            "self_medication": medication["self_medication_selection"],
+        }
+        for medication in data["medication_ids"]
+    ]
+    healthsheet["mutuality"] = data["mutuality"] or ""
+    healthsheet["nap"] = data["nap"]
+    # healthsheet["medication_type_selection"] = data.get("medication_type_selection") or []
+    healthsheet["photo"] = data["photo"]
+    healthsheet["photo_general"] = data["photo_general"]
+    healthsheet["self_medication"] = data["self_medication"]
+    healthsheet["specific_regime_selection"] = data["specific_regime_selection"]
+    healthsheet["specific_regime_text"] = data["specific_regime_text"] or ""
+    healthsheet["swim"] = data["swim"]
+    healthsheet["swim_level"] = data["swim_level"]
+    healthsheet["tetanus_selection"] = data["tetanus_selection"]
+    healthsheet["to_go_alone"] = data["to_go_alone"]
+    healthsheet["type_handicap"] = data["type_handicap"]
+    healthsheet["weight"] = data["weight"] or ""
+    return healthsheet
+
+
+def legacy_update(origin_data):
+    put_data = dict()
+    # prepare authorizations
+    authorizations = list()
+    if origin_data["mandatory_authorizations"]:
+        authorizations += origin_data["mandatory_authorizations"]
+    if origin_data["optional_authorizations"]:
+        authorizations += origin_data["optional_authorizations"]
+    # prepare put_data
+    if origin_data["activity_no_available_reason"]:
+        put_data["activity_no_available_reason"] = origin_data[
+            "activity_no_available_reason"
+        ]
+    if origin_data["allergy_consequence"] and (
+        origin_data["allergy_ids"] or origin_data["other_allergies"]
+    ):
+        put_data["allergy_consequence"] = origin_data["allergy_consequence"]
+    else:
+        put_data["allergy_consequence"] = ""
+    put_data["allergy_ids"] = (
+        [int(allergy) for allergy in origin_data["allergy_ids"]]
+        if origin_data["allergy_ids"]
+        else list()
+    )
+    if origin_data["allergy_treatment"] and (
+        origin_data["allergy_ids"] or origin_data["other_allergies"]
+    ):
+        put_data["allergy_treatment"] = origin_data["allergy_treatment"]
+    else:
+        put_data["allergy_treatment"] = ""
+    if origin_data["arnica"]:
+        put_data["arnica"] = origin_data["arnica"]
+    put_data["authorization_ids"] = [
+        int(authorization) for authorization in authorizations
+    ]
+    if origin_data["bike"]:
+        put_data["bike"] = origin_data["bike"]
+    if origin_data["blood_type"]:
+        put_data["blood_type"] = origin_data["blood_type"]
+    if origin_data["comment"]:
+        put_data["comment"] = origin_data["comment"]
+    if origin_data["child_id"]:
+        put_data["child_id"] = int(origin_data["child_id"])
+    if origin_data["doctor_id"]:
+        put_data["doctor_id"] = origin_data["doctor_id"]
+    if origin_data["emotional_support"]:
+        put_data["emotional_support"] = origin_data["emotional_support"]
+    if origin_data["facebook"]:
+        put_data["facebook"] = origin_data["facebook"]
+    if origin_data["first_date_tetanus"]:
+        put_data["first_date_tetanus"] = origin_data["first_date_tetanus"]
+    if origin_data["glasses"]:
+        put_data["glasses"] = origin_data["glasses"]
+    if origin_data["hearing_aid"]:
+        put_data["hearing_aid"] = origin_data["hearing_aid"]
+    if origin_data["last_date_tetanus"]:
+        put_data["last_date_tetanus"] = origin_data["last_date_tetanus"]
+    if origin_data["level_handicap"]:
+        put_data["level_handicap"] = origin_data["level_handicap"]
+    if origin_data["medications"]:
+        put_data["medication_ids"] = origin_data["medications"]
+    if origin_data["mutuality"]:
+        put_data["mutuality"] = origin_data["mutuality"]
+    if origin_data["nap"]:
+        put_data["nap"] = origin_data["nap"]
+    if origin_data["other_allergies"]:
+        # As other_allergies is a list of dict ([{"name": "other allergie 1"}]), we need to make it a list of string ["other allergie 1"].
+        put_data["other_allergies"] = [
+            allergy["name"] for allergy in origin_data["other_allergies"]
+        ]
+    if origin_data["photo"]:
+        put_data["photo"] = origin_data["photo"]
+    if origin_data["photo_general"]:
+        put_data["photo_general"] = origin_data["photo_general"]
+    if origin_data["swim"]:
+        put_data["swim"] = origin_data["swim"]
+    if origin_data["swim_level"]:
+        put_data["swim_level"] = origin_data["swim_level"]
+    if origin_data["to_go_alone"]:
+        put_data["to_go_alone"] = origin_data["to_go_alone"]
+    if origin_data["type_handicap"]:
+        put_data["type_handicap"] = origin_data["type_handicap"]
+    if origin_data["weight"]:
+        put_data["weight"] = origin_data["weight"]
+    allowed_contact_ids = []
+    for key, value in origin_data.items():
+        if ("selection" in key or "text" in key) and value:
+            put_data[key] = value or ""
+        elif "contact" in key:
+            contact = value.split(" ; ")
+            if contact[0]:
+                allowed_contact_ids.append(
+                    {"partner_id": int(contact[0]), "parental_link": contact[1]}
+                )
+    disease_ids = []
+    other_diseases = []
+    for disease in origin_data["diseases"]:
+        disease_id = {
+            "gravity": disease["gravity"],
+            "disease_text": disease["treatment"],
+            "health_sheet_id": origin_data["healthsheet_id"],
+        }
+        if disease["disease"] != "autre":
+            disease_id.update({"disease_type_id": int(disease["disease"])})
+            disease_ids.append(disease_id)
+        else:
+            disease_id.update({"name": disease["other_disease"]})
+            other_diseases.append(disease_id)
+    put_data["disease_ids"] = disease_ids
+    put_data["other_diseases"] = other_diseases
+    if allowed_contact_ids:
+        put_data["allowed_contact_ids"] = allowed_contact_ids
+    return put_data
+
+
+APIMS_HEALTHSHEET = {
+    "id": 12,
+    "__last_update": "2025-06-02 10:00:00",
+    "create_date": "2025-01-10 09:00:00",
+    "activity_no_available_reason": False,
+    "activity_no_available_selection": "no",
+    "activity_no_available_text": None,
+    "allergy_consequence": "Gonflement",
+    "allergy_ids": [{"id": 3, "name": "Arachides"}, {"id": 7, "name": "Pollen"}],
+    "allergy_selection": "yes",
+    "allergy_treatment": False,
+    "allowed_contact_ids": [{"partner_id": 41, "parental_link": "grand-parent"}],
+    "authorization_ids": [1, 2],
+    "arnica": True,
+    "bike": "yes",
+    "blood_type": "A+",
+    "comment": False,
+    "disease_ids": [
+        {"disease_type_id": [5, "Asthme"], "gravity": "moderate", "disease_text": "Ventoline"},
+        {"disease_type_id": [9, "Diabète"], "gravity": False, "disease_text": "Insuline"},
+    ],
+    "doctor_id": {"id": 8, "name": "Dr Martin"},
+    "emotional_support": "doudou",
+    "facebook": False,
+    "first_date_tetanus": "2019-03-01",
+    "handicap_selection": "no",
+    "hearing_aid": False,
+    "glasses": True,
+    "intervention_text": False,
+    "intervention_selection": "no",
+    "last_date_tetanus": "2024-03-01",
+    "level_handicap": False,
+    "medication_ids": [{"name": "Ventoline", "quantity": "2", "period": "matin", "self_medication_selection": "no"}],
+    "mutuality": None,
+    "nap": False,
+    "photo": True,
+    "photo_general": True,
+    "self_medication": False,
+    "specific_regime_selection": "yes",
+    "specific_regime_text": "Sans gluten",
+    "swim": "yes",
+    "swim_level": "good",
+    "tetanus_selection": "yes",
+    "to_go_alone": False,
+    "type_handicap": False,
+    "weight": 32,
+}
+
+FORM = {
+    "child_id": "22",
+    "healthsheet_id": 12,
+    "mandatory_authorizations": ["1"],
+    "optional_authorizations": ["2", "4"],
+    "activity_no_available_reason": "",
+    "activity_no_available_selection": "no",
+    "activity_no_available_text": "",
+    "allergy_consequence": "Gonflement",
+    "allergy_ids": ["3", "7"],
+    "allergy_selection": "yes",
+    "allergy_treatment": "Antihistaminique",
+    "other_allergies": [{"name": "Kiwi"}],
+    "arnica": True,
+    "bike": "yes",
+    "blood_type": "A+",
+    "comment": "",
+    "doctor_id": 8,
+    "emotional_support": "doudou",
+    "facebook": None,
+    "first_date_tetanus": "2019-03-01",
+    "glasses": True,
+    "hearing_aid": False,
+    "intervention_selection": "no",
+    "intervention_text": "",
+    "last_date_tetanus": "2024-03-01",
+    "level_handicap": "",
+    "medications": [{"name": "Ventoline", "quantity": "2", "period": "matin", "self_medication": "no"}],
+    "mutuality": "Solidaris",
+    "nap": False,
+    "photo": True,
+    "photo_general": False,
+    "specific_regime_selection": "yes",
+    "specific_regime_text": "Sans gluten",
+    "swim": "yes",
+    "swim_level": "good",
+    "to_go_alone": False,
+    "type_handicap": "",
+    "weight": "32",
+    "contact_1": "41 ; grand-parent",
+    "contact_2": " ; ",
+    "diseases": [
+        {"disease": "5", "gravity": "moderate", "treatment": "Ventoline", "other_disease": ""},
+        {"disease": "autre", "gravity": "low", "treatment": "Repos", "other_disease": "Migraine"},
+    ],
+}
+
+
+def test_to_form_matches_legacy():
+    assert healthsheet.to_form(APIMS_HEALTHSHEET) == legacy_read(APIMS_HEALTHSHEET)
+
+
+def test_to_form_without_collections():
+    data = dict(APIMS_HEALTHSHEET, allergy_ids=[], disease_ids=[], medication_ids=[], weight=0)
+    assert healthsheet.to_form(data) == legacy_read(data)
+    assert healthsheet.to_form(data)["has_medication"] == "not_specified"
+
+
+def test_to_form_keeps_key_order():
+    assert list(healthsheet.to_form(APIMS_HEALTHSHEET)) == list(legacy_read(APIMS_HEALTHSHEET))
+
+
+def test_to_update_matches_legacy():
+    assert healthsheet.to_update(copy.deepcopy(FORM)) == legacy_update(copy.deepcopy(FORM))
+    assert list(healthsheet.to_update(copy.deepcopy(FORM))) == list(legacy_update(copy.deepcopy(FORM)))
+
+
+@pytest.mark.parametrize(
+    "emptied",
+    [
+        combination
+        for size in (1, 2)
+        for combination in itertools.combinations(
+            [
+                "allergy_ids",
+                "other_allergies",
+                "allergy_consequence",
+                "mandatory_authorizations",
+                "optional_authorizations",
+                "medications",
+                "child_id",
+                "weight",
+                "specific_regime_text",
+                "contact_1",
+            ],
+            size,
+        )
+    ],
+)
+def test_to_update_with_empty_fields_matches_legacy(emptied):
+    form = copy.deepcopy(FORM)
+    for key in emptied:
+        form[key] = "" if key.startswith("contact") else None
+    if "contact_1" in emptied:
+        form["contact_1"] = " ; "
+    assert healthsheet.to_update(copy.deepcopy(form)) == legacy_update(copy.deepcopy(form))
+
+
+def test_diff_without_change_sends_identification_only():
+    current = dict(APIMS_HEALTHSHEET, allergy_consequence=False, allergy_treatment=False)
+    form = dict(
+        FORM,
+        allergy_ids=["7", "3"],
+        other_allergies=[],
+        allergy_consequence="",
+        allergy_treatment="",
+        mandatory_authorizations=["2"],
+        optional_authorizations=["1"],
+        mutuality=None,
+        medications=[{"name": "Ventoline", "quantity": "2", "period": "matin", "self_medication": "no"}],
+        photo_general=True,
+        contact_1="41 ; grand-parent",
+        diseases=[
+            {"disease": "9", "gravity": "", "treatment": "Insuline", "other_disease": ""},
+            {"disease": "5", "gravity": "moderate", "treatment": "Ventoline", "other_disease": ""},
+        ],
+    )
+    changes = healthsheet.diff(healthsheet.to_update(form), dict(current, other_diseases=[]))
+    assert changes == {"child_id": 22}
+
+
+def test_diff_sends_cleared_collection_unknown_to_current_sheet():
+    form = dict(FORM, diseases=[])
+    # other_diseases n'est pas renvoyé par APIMS : le vider est une modification
+    changes = healthsheet.diff(healthsheet.to_update(form), APIMS_HEALTHSHEET)
+    assert changes["other_diseases"] == []
+
+
+def test_diff_sends_only_changed_fields():
+    current = dict(APIMS_HEALTHSHEET, weight=30)
+    changes = healthsheet.diff(healthsheet.to_update(FORM), current)
+    assert changes["weight"] == "32"
+    # Collections inchangées
+    assert "allergy_ids" not in changes
+    assert "allowed_contact_ids" not in changes
+    # Collections modifiées, envoyées entières
+    assert changes["authorization_ids"] == [1, 2, 4]
+    assert [disease["disease_type_id"] for disease in changes["disease_ids"]] == [5]
+    # Champs inconnus de la fiche actuelle
+    assert changes["other_allergies"] == ["Kiwi"]
+    assert changes["other_diseases"][0]["name"] == "Migraine"
+    assert "bike" not in changes and "blood_type" not in changes
+
+
+def test_diff_sends_collections_with_unexpected_shape():
+    current = dict(APIMS_HEALTHSHEET, allergy_ids=[{"name": "Arachides"}])
+    changes = healthsheet.diff(healthsheet.to_update(FORM), current)
+    assert changes["allergy_ids"] == [3, 7]
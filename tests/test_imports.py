@@ -0,0 +1,58 @@
+import importlib.util
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Budgets (en secondes) du temps d'import cumulé, mesuré par python -X importtime :
+# seuls les modules importés pour la première fois sont comptés.
+HELPERS_IMPORT_BUDGET = 0.15
+MODELS_IMPORT_BUDGET = 0.5
+
+# Dépendances chargées seulement à la première utilisation
+LAZY_MODULES = ("numpy", "workalendar", "dateutil.relativedelta")
+
+
+def import_report(code, env=None):
+    """Exécute code dans un nouvel interpréteur et renvoie (durées cumulées d'import par module, modules chargés)"""
+    code += "\nimport sys\nprint(','.join(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        env=dict(os.environ, PYTHONPATH=ROOT, **(env or {})),
+        check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)", line)
+        if match:
+            cumulative[match.group(2)] = int(match.group(1)) / 1e6
+    return cumulative, set(result.stdout.strip().split(","))
+
+
+def test_helpers_import_budget():
+    cumulative, modules = import_report(
+        "import passerelle_imio_ia_aes.caching, passerelle_imio_ia_aes.decorations, passerelle_imio_ia_aes.utils"
+    )
+    total = sum(cumulative[f"passerelle_imio_ia_aes.{name}"] for name in ("caching", "decorations", "utils"))
+    assert total < HELPERS_IMPORT_BUDGET
+    assert not modules & set(LAZY_MODULES)
+
+
+@pytest.mark.skipif(importlib.util.find_spec("passerelle") is None, reason="passerelle is not installed")
+def test_models_import_budget():
+    cumulative, modules = import_report(
+        "import django\ndjango.setup()",
+        env={
+            "DJANGO_SETTINGS_MODULE": "passerelle.settings",
+            "PASSERELLE_SETTINGS_FILE": os.path.join(ROOT, "tests", "settings.py"),
+        },
+    )
+    assert cumulative["passerelle_imio_ia_aes.models"] < MODELS_IMPORT_BUDGET
+    assert not modules & set(LAZY_MODULES)
@@ -0,0 +1,107 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("passerelle")
+
+from django.core.cache import cache  # noqa: E402
+from passerelle.utils.jsonresponse import APIError  # noqa: E402
+
+from passerelle_imio_ia_aes.models import ApimsAesConnector  # noqa: E402
+
+PLAIN = {
+    "id": 12,
+    "age_group_manager_id": 3,
+    "name": "Plaine d'été",
+    "theme": "Les pirates",
+    "week": 28,
+    "year": 2026,
+    "start_date": "2026-07-06",
+    "end_date": "2026-07-10",
+    "nb_remaining_place": 5,
+}
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class Session:
+    def __init__(self):
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        self.calls.append(("post", url))
+        return Response({"id": 19})
+
+    def delete(self, url, **kwargs):
+        self.calls.append(("delete", url))
+        return Response(True)
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    cache.clear()
+    session = Session()
+    monkeypatch.setattr(ApimsAesConnector, "requests", session)
+    return ApimsAesConnector(slug="aes", server_url="https://apims.example.org", aes_instance="aes")
+
+
+def request(data):
+    return SimpleNamespace(body=json.dumps(data))
+
+
+def test_registration_takes_a_place(connector):
+    availability = connector.plain_availability()
+    key = connector.plain_availability_key(12, 3)
+    availability.update({key: 5})
+    connector.create_plain_registrations(
+        request(
+            {
+                "child_id": "7",
+                "parent_id": "4",
+                "form_number": "101",
+                "plains": [{"id": "2026_28_12", "year": 2026, "week": 28, "age_group_manager_id": 3}],
+            }
+        )
+    )
+    assert availability.get_many([key]) == {key: 4}
+
+
+def test_cancellation_gives_the_place_back(connector):
+    availability = connector.plain_availability()
+    key = connector.plain_availability_key(12, 3)
+    availability.update({key: 0})
+    connector.delete_plain_registration(None, "19", activity_id="12", age_group_manager_id="3", child_id="7")
+    assert availability.get_many([key]) == {key: 1}
+
+
+def test_cancellation_of_unknown_plain_invalidates_snapshot(connector):
+    availability = connector.plain_availability()
+    key = connector.plain_availability_key(12, 3)
+    availability.update({key: 2})
+    connector.delete_plain_registration(None, "19")
+    assert availability.get_many([key]) == {}
+
+
+def test_list_falls_back_to_fresh_eligible_plains(connector, monkeypatch):
+    def fetch_plains(child_id):
+        raise APIError("iA.AES est momentanément surchargé", http_status=503)
+
+    monkeypatch.setattr(connector, "fetch_plains", fetch_plains)
+    monkeypatch.setattr(connector, "get_eligible_plains", lambda child_id: ([dict(PLAIN)], None))
+    ((activity,),) = [week["activities"] for week in connector.list_available_plains(None, "7")]
+    assert activity["remaining_places"] == 5 and not activity["disabled"]
+
+    stale = {"reason": "error", "age": 600}
+    monkeypatch.setattr(connector, "get_eligible_plains", lambda child_id: ([dict(PLAIN)], stale))
+    ((activity,),) = [week["activities"] for week in connector.list_available_plains(None, "7")]
+    assert activity["remaining_places"] is None and not activity["disabled"]
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+
+from passerelle_imio_ia_aes import pools  # noqa: E402
+
+
+def test_get_adapter_is_shared_per_settings():
+    adapter = pools.get_adapter("test-shared", 4, False)
+    assert pools.get_adapter("test-shared", 4, False) is adapter
+    assert pools.get_adapter("test-shared", 8, False) is not adapter
+    assert pools.get_adapter("other", 4, False) is not adapter
+
+
+def test_metrics_measure_pool_usage():
+    adapter = pools.PooledHTTPAdapter(pool_maxsize=2)
+    assert adapter.metrics() == []
+    pool = adapter.poolmanager.connection_from_url("https://apims.example.org/")
+    assert isinstance(pool, pools.TimedHTTPSConnectionPool)
+    # Aucune connexion réseau n'est ouverte : urllib3 ne se connecte qu'à l'envoi d'une requête
+    conn = pool._get_conn()
+    pool._put_conn(conn)
+    (metrics,) = adapter.metrics()
+    assert metrics["host"] == "https://apims.example.org:443"
+    assert metrics["maxsize"] == 2
+    assert metrics["checkouts"] == 1
+    # La connexion était disponible : pas d'attente
+    assert metrics["wait_count"] == 0
+    assert metrics["requests"] == 0
+    assert metrics["connections_reused"] == 0
+
+
+def test_metrics_count_blocked_checkouts_only():
+    adapter = pools.PooledHTTPAdapter(pool_maxsize=1, pool_block=True)
+    pool = adapter.poolmanager.connection_from_url("https://apims.example.org/")
+    conn = pool._get_conn()
+    # Le pool est vide : la demande suivante attend que la connexion soit rendue
+    threading.Timer(0.05, pool._put_conn, args=(conn,)).start()
+    pool._put_conn(pool._get_conn(timeout=1))
+    (metrics,) = adapter.metrics()
+    assert metrics["checkouts"] == 2
+    assert metrics["wait_count"] == 1
+    assert metrics["wait_time"] >= 0.04
+
+
+def test_warm_up_ignores_errors():
+    class Session:
+        def __init__(self):
+            self.calls = 0
+
+        def head(self, url, timeout):
+            self.calls += 1
+            if self.calls > 1:
+                raise ConnectionError(url)
+
+    session = Session()
+    assert pools.warm_up(session, "https://apims.example.org/", 3) == 1
+    assert session.calls == 3
+    assert pools.warm_up(session, "https://apims.example.org/", 0) == 0
@@ -1,6 +1,22 @@
+import datetime
+import itertools
+import random
+import threading
+import time
+
 import pytest
 
-from passerelle_imio_ia_aes.utils import compute_amount_with_balance
+from passerelle_imio_ia_aes import utils
+from passerelle_imio_ia_aes.utils import (
+    PayloadTrace,
+    allocate_balance,
+    compute_amount_with_balance,
+    compute_amounts_with_balance,
+    flatten_cost_details,
+    is_sampled,
+    parse_fields,
+    project_fields,
+)
 
 # Cas de test pour compute_amount_with_balance, groupés par branche métier :
 #   - branche 1 (b1) : commande >= solde -> un dû reste à payer
@@ -48,3 +64,232 @@ def test_compute_amount_with_balance(
     assert result["due_amount"] == expected_due
     assert result["spent_balance"] == expected_spent
     assert result["remaining_balance"] == expected_remaining
+
+
+# --- allocate_balance -------------------------------------------------------
+#
+# Implémentation de référence volontairement naïve : on réserve le solde ligne
+# par ligne, puis on agrège le dû par clé dans une seconde passe.
+
+
+def reference_allocation(prices, keys, balance):
+    reserved, due = [], []
+    for price in prices:
+        spent = min(price, balance)
+        balance -= spent
+        reserved.append(spent)
+        due.append(max(price - spent, 0))
+    due_by_key = {}
+    for key, line_due in zip(keys, due):
+        due_by_key[key] = due_by_key.get(key, 0) + line_due
+    return reserved, due, due_by_key, balance
+
+
+@pytest.mark.parametrize("balance", [0, 1, 228, 456, 457, 1000, 10000])
+@pytest.mark.parametrize("prices", list(itertools.product([0, 1, 228, 456], repeat=4)))
+def test_allocate_balance_exhaustive(prices, balance):
+    keys = [(1, 10), (2, 10), (1, 10), (1, 11)]
+    result = allocate_balance(list(prices), keys, balance)
+    reserved, due, due_by_key, remaining = reference_allocation(prices, keys, balance)
+    assert result["reserved"] == reserved
+    assert result["due"] == due
+    assert result["due_by_key"] == due_by_key
+    assert result["remaining_balance"] == remaining
+    assert result["spent_balance"] == sum(reserved)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("nb_lines", [1000, 5000])
+def test_allocate_balance_large_orders(seed, nb_lines):
+    rng = random.Random(seed)
+    prices = [rng.choice([0, 150, 228, 456, 1000, 1250]) for _ in range(nb_lines)]
+    keys = [(rng.randint(1, 3), rng.randint(10, 12)) for _ in range(nb_lines)]
+    balance = rng.randint(0, sum(prices))
+    result = allocate_balance(prices, keys, balance)
+    assert result["spent_balance"] == min(balance, sum(prices))
+    assert result["spent_balance"] + result["remaining_balance"] == balance
+    assert sum(result["due_by_key"].values()) == sum(prices) - result["spent_balance"]
+    assert all(r + d == p for r, d, p in zip(result["reserved"], result["due"], prices))
+    # Le solde est consommé dans l'ordre : après la première ligne partiellement
+    # due, plus aucune ligne ne consomme de solde.
+    first_due = next((i for i, d in enumerate(result["due"]) if d), nb_lines)
+    assert not any(result["reserved"][first_due + 1:])
+    for key, index in result["first_line_by_key"].items():
+        assert keys[index] == key and key not in keys[:index]
+
+
+def test_allocate_balance_negative_balance_is_ignored():
+    result = allocate_balance([500], [(1, 10)], -300)
+    assert result["reserved"] == [0]
+    assert result["due_by_key"] == {(1, 10): 500}
+
+
+def test_flatten_cost_details():
+    details = [
+        {
+            "activity_category_id": 10,
+            "details": [
+                [
+                    {"price": 4.56, "invoiceable_parent_id": "1", "child_registration_line_id": 7},
+                    {"price": "2.28", "invoiceable_parent_id": 2},
+                ],
+                [{"price": None, "invoiceable_parent_id": 1}],
+            ],
+        },
+        {"activity_category_id": 11, "details": [[{"price": 35.10, "invoiceable_parent_id": 1}]]},
+    ]
+    prices, keys, lines = flatten_cost_details(details)
+    assert prices == [456, 228, 0, 3510]
+    assert keys == [(1, 10), (2, 10), (1, 10), (1, 11)]
+    assert lines[0]["child_registration_line_id"] == 7
+
+
+# --- compute_amounts_with_balance -------------------------------------------
+
+
+def random_amounts(seed, size):
+    rng = random.Random(seed)
+    values = [0.0, 2.28, 4.56, 9.12, 13.68, 35.10]
+    return [
+        [rng.choice(values + [round(rng.uniform(0, 50), 2)]) for _ in range(size)]
+        for _ in range(3)
+    ]
+
+
+def assert_matches_scalar(result, orders, balances, reserved):
+    for index, amounts in enumerate(zip(orders, balances, reserved)):
+        expected = compute_amount_with_balance(*amounts)
+        for key in ("due_amount", "spent_balance", "remaining_balance"):
+            assert int(result[key][index]) == round(expected[key] * 100)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_compute_amounts_with_balance_python(seed):
+    orders, balances, reserved = random_amounts(seed, 2000)
+    result = compute_amounts_with_balance(orders, balances, reserved, use_numpy=False)
+    assert_matches_scalar(result, orders, balances, reserved)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_compute_amounts_with_balance_numpy(seed):
+    pytest.importorskip("numpy")
+    orders, balances, reserved = random_amounts(seed, 2000)
+    result = compute_amounts_with_balance(orders, balances, reserved, use_numpy=True)
+    assert_matches_scalar(result, orders, balances, reserved)
+
+
+def test_compute_amounts_with_balance_without_numpy(monkeypatch):
+    monkeypatch.setattr(utils, "get_numpy", lambda: None)
+    orders, balances, reserved = random_amounts(0, 200)
+    result = compute_amounts_with_balance(orders, balances, reserved, use_numpy=True)
+    assert isinstance(result["due_amount"], list)
+    assert_matches_scalar(result, orders, balances, reserved)
+
+
+def test_compute_amounts_with_balance_cases():
+    cases = [case.values for case in compute_amount_with_balance_cases]
+    result = compute_amounts_with_balance(*[[case[i] for case in cases] for i in range(3)])
+    assert [int(v) for v in result["due_amount"]] == [round(case[3] * 100) for case in cases]
+    assert [int(v) for v in result["spent_balance"]] == [round(case[4] * 100) for case in cases]
+    assert [int(v) for v in result["remaining_balance"]] == [round(case[5] * 100) for case in cases]
+
+
+def test_compute_amounts_with_balance_length_mismatch():
+    with pytest.raises(ValueError):
+        compute_amounts_with_balance([1.0], [1.0, 2.0], [0.0])
+
+
+# --- PayloadTrace / is_sampled ----------------------------------------------
+
+
+class ExplodingPayload:
+    def __str__(self):
+        raise AssertionError("payload should not be serialized")
+
+
+def test_payload_trace_is_lazy():
+    PayloadTrace({"payload": ExplodingPayload()})
+
+
+@pytest.mark.parametrize(
+    "payload,expected",
+    [
+        ({"a": "é"}, '{"a": "é"}'),
+        (b'{"a": 1}', '{"a": 1}'),
+        ("texte", "texte"),
+        ({"date": datetime.date(2025, 7, 18)}, '{"date": "2025-07-18"}'),
+    ],
+)
+def test_payload_trace_serialization(payload, expected):
+    assert str(PayloadTrace(payload)) == expected
+
+
+def test_payload_trace_truncation():
+    trace = str(PayloadTrace("x" * 50, max_length=10))
+    assert trace == "xxxxxxxxxx... (40 caractères tronqués)"
+    assert str(PayloadTrace("x" * 50, max_length=0)) == "x" * 50
+
+
+def test_is_sampled(monkeypatch):
+    assert not is_sampled(0)
+    assert is_sampled(1)
+    # Tirages reproductibles, sans toucher au générateur global utilisé par les autres tests
+    monkeypatch.setattr(random, "random", random.Random(0).random)
+    assert 200 < sum(is_sampled(0.25) for _ in range(1000)) < 300
+
+
+def test_parse_fields():
+    assert parse_fields("id, lastname ,children.id,children.school.name") == {
+        "id": None,
+        "lastname": None,
+        "children": {"id": None, "school": {"name": None}},
+    }
+    assert parse_fields("children,children.id") == {"children": None}
+    assert parse_fields("children.id,children") == {"children": None}
+
+
+def test_project_fields():
+    parent = {
+        "id": 279,
+        "lastname": "Dupont",
+        "email": "dupont@example.org",
+        "children": [
+            {"id": 22, "firstname": "Léa", "school": {"id": 3, "name": "École du Centre"}},
+            {"id": 23, "firstname": "Tom", "school": None},
+        ],
+    }
+    assert project_fields(parent, "id,children.id,children.school.name,unknown") == {
+        "id": 279,
+        "children": [{"id": 22, "school": {"name": "École du Centre"}}, {"id": 23, "school": None}],
+    }
+    assert project_fields([{"id": 1, "name": "Plaine"}], "id") == [{"id": 1}]
+    assert project_fields(parent, "") is parent
+    assert project_fields(parent, None) is parent
+
+
+def test_gather_returns_results_in_order():
+    assert utils.gather(lambda: 1, lambda: "deux", lambda: [3]) == [1, "deux", [3]]
+    assert utils.gather() == []
+
+
+def test_gather_runs_calls_concurrently():
+    barrier = threading.Barrier(3, timeout=2)
+    # Chaque appel attend les deux autres : ils ne peuvent aboutir que s'ils tournent en même temps
+    assert sorted(utils.gather(barrier.wait, barrier.wait, barrier.wait, max_workers=3)) == [0, 1, 2]
+
+
+def test_gather_timeout_does_not_wait_for_pending_calls():
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        utils.gather(lambda: time.sleep(0.5), max_workers=1, timeout=0.05)
+    assert time.monotonic() - start < 0.4
+
+
+def test_gather_propagates_first_exception():
+    def fail():
+        raise ConnectionError("APIMS is down")
+
+    start = time.monotonic()
+    with pytest.raises(ConnectionError):
+        utils.gather(lambda: time.sleep(0.5), fail, timeout=2)
+    assert time.monotonic() - start < 0.4